@@ -146,6 +146,353 @@ def calc_bkg_dspec(spec, tim, bkgtim, interp_method='linear'):
 
     return spec_bkg
 
+
+def _reduce_baselines(spec, domedian=True):
+    """
+    Collapse the baseline axis of a chunk of visibilities.
+
+    Zero (flagged) and non-finite amplitudes are excluded, matching the masking used by
+    the in-memory ``domedian`` path of :meth:`Dspec.get_dspec`.
+
+    :param spec: Complex or real array of shape (npol, nfreq, nbl, ntime).
+    :type spec: ndarray
+    :param domedian: If True, take the median over baselines, otherwise the mean.
+    :type domedian: bool, optional
+    :return: Array of shape (npol, nfreq, ntime) in float32. Fully masked pixels are set to 0.
+    :rtype: ndarray
+    """
+    import warnings
+
+    amp = np.abs(spec).astype(np.float32)
+    amp[~(amp >= 1e-9)] = np.nan
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        if domedian:
+            red = np.nanmedian(amp, axis=2)
+        else:
+            red = np.nanmean(amp, axis=2)
+    red[~np.isfinite(red)] = 0.
+    return red
+
+
+def _stream_dspec_tb(tb, spwtb, datacol, order, spws_unq, spw_nfrq, scan_ntimes, npol, nbl, chunksize,
+                     blidx=None, domedian=True, applyflag=True, fillnan=None, verbose=False):
+    """
+    Read the MAIN table in time chunks and reduce over baselines on the fly.
+
+    Only a (npol, nfreq, nbl, ntime_chunk) buffer is held in memory at any one time, so the peak memory
+    is set by ``chunksize`` rather than by the length of the observation.
+
+    :param tb: An opened table tool on the MAIN table.
+    :param spwtb: An opened table tool on the SPECTRAL_WINDOW table.
+    :param datacol: Name of the data column ('DATA' or 'CORRECTED_DATA').
+    :param order: Sort order of the MAIN table, 't' (time) or 'f' (scan/spw).
+    :param spws_unq: Spectral window ids.
+    :param spw_nfrq: Number of channels in each spectral window.
+    :param scan_ntimes: Number of integrations in each scan.
+    :param npol: Number of correlations.
+    :param nbl: Number of baselines (rows) per integration and spectral window.
+    :param chunksize: Number of MAIN table rows to read per chunk. Rounded to whole integrations.
+    :param blidx: Indices of the baselines to keep. Default is all.
+    :param domedian: If True, take the median over baselines, otherwise the mean.
+    :return: ospec of shape (npol, 1, nfreq, ntime) in float32, the times and the frequencies.
+    """
+    nspw = len(spws_unq)
+    nf = int(np.sum(spw_nfrq))
+    nt = int(np.sum(scan_ntimes))
+    fptrs = np.hstack(([0], np.cumsum(spw_nfrq))).astype(int)
+    ntchunk = max(1, int(chunksize) // (nbl * nspw))
+    freq = np.zeros(nf, float)
+    for i, sp in enumerate(spws_unq):
+        freq[fptrs[i]:fptrs[i + 1]] = spwtb.getcol('CHAN_FREQ', sp, 1)[:, 0]
+    times = np.zeros(nt, float)
+    ospec = np.zeros((npol, 1, nf, nt), np.float32)
+    if verbose:
+        print('Streaming the MAIN table in chunks of {0:d} integrations'.format(ntchunk))
+
+    def fill(buf, spec_, flag, i, tslc):
+        if applyflag:
+            if type(fillnan) in [int, float]:
+                spec_[flag] = float(fillnan)
+            else:
+                spec_[flag] = 0.0
+        buf[:, fptrs[i]:fptrs[i + 1], :, tslc] = spec_
+
+    def reduce(buf, t1, t2):
+        if blidx is not None:
+            buf = buf[:, :, blidx, :]
+        ospec[:, 0, :, t1:t2] = _reduce_baselines(buf, domedian=domedian)
+
+    if order == 't':
+        for t1 in range(0, nt, ntchunk):
+            t2 = min(t1 + ntchunk, nt)
+            buf = np.zeros((npol, nf, nbl, t2 - t1), complex)
+            for j in range(t1, t2):
+                for i in range(nspw):
+                    row = nbl * (i + nspw * j)
+                    if i == 0:
+                        times[j] = tb.getcol('TIME', row, 1)[0]
+                    fill(buf, tb.getcol(datacol, row, nbl), tb.getcol('FLAG', row, nbl), i, j - t1)
+            reduce(buf, t1, t2)
+    else:
+        iptr = 0
+        s1 = 0
+        for s in scan_ntimes:
+            s = int(s)
+            for c1 in range(0, s, ntchunk):
+                c2 = min(c1 + ntchunk, s)
+                nc = c2 - c1
+                buf = np.zeros((npol, nf, nbl, nc), complex)
+                for i in range(nspw):
+                    row = iptr + nbl * (i * s + c1)
+                    if i == 0:
+                        times[s1 + c1:s1 + c2] = tb.getcol('TIME', row, nbl * nc).reshape(nc, nbl)[:, 0]
+                    spec_ = tb.getcol(datacol, row, nbl * nc).reshape(npol, spw_nfrq[i], nc, nbl)
+                    flag = tb.getcol('FLAG', row, nbl * nc).reshape(npol, spw_nfrq[i], nc, nbl)
+                    fill(buf, np.swapaxes(spec_, 2, 3), np.swapaxes(flag, 2, 3), i, slice(None))
+                reduce(buf, s1 + c1, s1 + c2)
+            iptr += nbl * s * nspw
+            s1 += s
+    return ospec, times, freq
+
+
+_worker_tool = None
+
+
+def _init_dspec_worker(vis, usetbtool=True):
+    """
+    Pool initializer. Each worker process keeps its own read-only table or ms handle on `vis`.
+    """
+    global _worker_tool
+    if usetbtool:
+        _worker_tool = tbtool()
+        _worker_tool.open(vis)
+    else:
+        _worker_tool = mstool()
+        _worker_tool.open(vis)
+
+
+def _shared_ndarray(shape, dtype, name=None):
+    """
+    Create (or attach to, if `name` is given) a numpy array backed by a memory-mapped file in shared memory
+    (/dev/shm where available). The file is removed by its creator once the workers are done. The mapping
+    stays valid for as long as the array is referenced, so the result can be returned without a copy.
+
+    :return: the name of the file and the array mapped on it.
+    """
+    if name is None:
+        import tempfile
+        fd, name = tempfile.mkstemp(prefix='suncasa_dspec_', suffix='.dat',
+                                    dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+        os.close(fd)
+        return name, np.memmap(name, dtype=dtype, mode='w+', shape=shape)
+    return name, np.memmap(name, dtype=dtype, mode='r+', shape=shape)
+
+
+def _fill_scan_spw(args):
+    """
+    Read one (scan, spw) block of the MAIN table and write it into the shared output arrays.
+    """
+    (specname, spec_shape, timename, datacol, iptr, nbl, s, f1, f2, s1, s2, applyflag, fillnan) = args
+    npol = spec_shape[0]
+    spec_ = _worker_tool.getcol(datacol, iptr, nbl * s)
+    flag = _worker_tool.getcol('FLAG', iptr, nbl * s)
+    if applyflag:
+        if type(fillnan) in [int, float]:
+            spec_[flag] = float(fillnan)
+        else:
+            spec_[flag] = 0.0
+    _, specf = _shared_ndarray(spec_shape, complex, name=specname)
+    _, times = _shared_ndarray((spec_shape[2],), float, name=timename)
+    specf[:, f1:f2, s1:s2] = spec_.reshape(npol, f2 - f1, s, nbl)
+    times[s1:s2] = _worker_tool.getcol('TIME', iptr, nbl * s).reshape(s, nbl)[:, 0]
+    del specf, times
+    return None
+
+
+def _getdata_spw(ms_, n, fillnan=None):
+    """
+    Read the amplitudes of data description `n` from an opened ms tool.
+
+    :return: amplitude of shape (npol, nchan, nbl, ntime), the channel frequencies and the times.
+    """
+    ms_.selectinit(datadescid=0, reset=True)
+    ms_.selectinit(datadescid=n)
+    data = ms_.getdata(['amplitude', 'time', 'axis_info'], ifraxis=True)
+    specamp_ = data['amplitude']
+    if fillnan is not None:
+        flag_ = ms_.getdata(['flag', 'time', 'axis_info'], ifraxis=True)['flag']
+        if type(fillnan) in [int, float]:
+            specamp_[flag_] = float(fillnan)
+        else:
+            specamp_[flag_] = 0.0
+    return specamp_, data['axis_info']['freq_axis']['chan_freq'].squeeze(), data['time']
+
+
+def _fill_spw(args):
+    """
+    Read one spectral window through the worker's ms tool and write the amplitudes into the shared output array.
+    """
+    n, specname, spec_shape, f1, f2, fillnan = args
+    specamp_, freq_, time_ = _getdata_spw(_worker_tool, n, fillnan=fillnan)
+    _, specamp = _shared_ndarray(spec_shape, float, name=specname)
+    specamp[:, f1:f2] = specamp_
+    del specamp
+    return freq_, time_
+
+
+_h5_extensions = ('.h5', '.hdf5')
+
+
+def _is_h5_dspec(fname):
+    return isinstance(fname, str) and fname.lower().endswith(_h5_extensions)
+
+
+def _wrt_dspec_h5(specfile, spec, tim, freq, pol=None, timeran='', spw='', bl='', uvrange='', chunk_mb=1.0):
+    """
+    Write a dynamic spectrum to a chunked HDF5 file.
+
+    `spec` of shape (npol, nbl, nfreq, ntime) is stored with one chunk spanning all (pol, bl, freq) and
+    a block of time, and an unlimited time axis so that more integrations can be appended later
+    with :func:`_append_dspec_h5`.
+
+    :param specfile: Output file name.
+    :param spec: Dynamic spectrum of shape (npol, nbl, nfreq, ntime).
+    :param tim: Times in MJD seconds, shape (ntime,).
+    :param freq: Frequencies in Hz, shape (nfreq,).
+    :param chunk_mb: Target chunk size in MB.
+    """
+    import h5py
+
+    spec = np.asarray(spec)
+    npol, nbl, nfreq, ntim = spec.shape
+    ct = int(max(1, min(max(ntim, 1), chunk_mb * 2 ** 20 // (npol * nbl * nfreq * spec.dtype.itemsize))))
+    with h5py.File(specfile, 'w') as f:
+        f.create_dataset('spec', data=spec, chunks=(npol, nbl, nfreq, ct), maxshape=(npol, nbl, nfreq, None))
+        f.create_dataset('tim', data=np.asarray(tim, dtype=float), chunks=(ct,), maxshape=(None,))
+        f.create_dataset('freq', data=np.asarray(freq, dtype=float))
+        f.attrs['pol'] = [str(p) for p in (pol if pol is not None else [])]
+        for k, v in zip(['timeran', 'spw', 'bl', 'uvrange'], [timeran, spw, bl, uvrange]):
+            f.attrs[k] = str(v)
+    return specfile
+
+
+def _append_dspec_h5(specfile, spec, tim):
+    """
+    Append integrations to an HDF5 dynamic spectrum written by :func:`_wrt_dspec_h5`.
+
+    Only the new chunks are written; nothing already on disk is rewritten. Integrations that are not
+    later than the last time already in the file are skipped.
+
+    :return: Number of integrations appended.
+    """
+    import h5py
+
+    tim = np.asarray(tim, dtype=float)
+    with h5py.File(specfile, 'a') as f:
+        dspec, dtim = f['spec'], f['tim']
+        nt0 = dtim.shape[0]
+        if nt0 > 0:
+            tidx, = np.where(tim > dtim[-1])
+        else:
+            tidx = np.arange(len(tim))
+        if len(tidx) == 0:
+            return 0
+        spec = np.asarray(spec)[..., tidx[0]:tidx[-1] + 1]
+        nnew = spec.shape[-1]
+        if spec.shape[:-1] != dspec.shape[:-1]:
+            raise ValueError('Shape {} of the new spectrum does not match {} in {}.'.format(
+                spec.shape[:-1], dspec.shape[:-1], specfile))
+        dspec.resize(nt0 + nnew, axis=3)
+        dtim.resize(nt0 + nnew, axis=0)
+        dspec[..., nt0:] = spec
+        dtim[nt0:] = tim[tidx[0]:tidx[-1] + 1]
+    return nnew
+
+
+def _load_dspec_raw(specfile):
+    """
+    Load the stored spectrum and metadata of a .npz or .h5 dynamic spectrum without any unit conversion.
+
+    :return: dict with keys spec, tim, freq, pol, timeran, spw, bl and uvrange.
+    """
+    keys = ['timeran', 'spw', 'bl', 'uvrange']
+    if _is_h5_dspec(specfile):
+        import h5py
+        with h5py.File(specfile, 'r') as f:
+            specdata = {'spec': f['spec'][...], 'tim': f['tim'][:], 'freq': f['freq'][:],
+                        'pol': list(f.attrs.get('pol', []))}
+            for k in keys:
+                specdata[k] = f.attrs.get(k, '')
+    else:
+        specdata_ = np.load(specfile)
+        specdata = {k: specdata_[k] for k in specdata_.files}
+        for k in keys + ['pol']:
+            specdata.setdefault(k, '' if k != 'pol' else [])
+    return specdata
+
+
+class _LazySpec:
+    """
+    Read-on-demand view of the `spec` dataset of an HDF5 dynamic spectrum.
+
+    Indexing reads only the requested hyperslab from disk and converts it to amplitude (or phase)
+    in the requested unit, the same way :meth:`Dspec.rd_dspec` does for .npz files.
+    """
+
+    def __init__(self, dset, spectype='amp', spec_unit='jy'):
+        self.dset = dset
+        self.spectype = spectype.lower()
+        self.spec_unit = spec_unit.lower()
+
+    @property
+    def shape(self):
+        return self.dset.shape
+
+    @property
+    def ndim(self):
+        return self.dset.ndim
+
+    def __len__(self):
+        return self.dset.shape[0]
+
+    def __getitem__(self, key):
+        spec = self.dset[key]
+        if np.iscomplexobj(spec):
+            if self.spectype == 'pha':
+                return np.angle(spec)
+            spec = np.abs(spec)
+        if self.spec_unit == 'jy':
+            spec = spec / 1.e4
+        return spec
+
+    def __array__(self, dtype=None, copy=None):
+        spec = self[...]
+        return spec if dtype is None else spec.astype(dtype)
+
+
+def _rd_dspec_window(spec, tim, freq, timerange=None, freqrange=None, freq_unit='GHz'):
+    """
+    Read the contiguous (freq, time) window that covers `timerange` and `freqrange` from a lazy spectrum.
+
+    :return: spec as an ndarray, and the matching time and frequency axes.
+    """
+    t1, t2 = 0, len(tim)
+    if timerange:
+        if isinstance(timerange[0], str):
+            timerange = Time(timerange)
+        tidx, = np.where((tim >= timerange[0]) & (tim <= timerange[1]))
+        if len(tidx) > 0:
+            t1, t2 = tidx[0], tidx[-1] + 1
+    f1, f2 = 0, len(freq)
+    if freqrange:
+        fscale = {'ghz': 1e9, 'mhz': 1e6, 'khz': 1e3}.get(freq_unit.lower(), 1e9)
+        fidx, = np.where((freq >= freqrange[0] * fscale) & (freq <= freqrange[1] * fscale))
+        if len(fidx) > 0:
+            f1, f2 = fidx[0], fidx[-1] + 1
+    return spec[..., f1:f2, t1:t2], tim[t1:t2], freq[f1:f2]
+
+
 class Dspec:
     """
     A class to handle dynamic spectra from radio observations.
@@ -198,6 +545,9 @@ class Dspec:
     concat_dspec(specfiles, outfile=None, savespec=False):
         Concatenates multiple dynamic spectrum files along the time axis.
 
+    close():
+        Closes the HDF5 file kept open by a lazy read. Also called on leaving a ``with Dspec(...)`` block.
+
     peek(*args, **kwargs):
         Plots the dynamic spectrum on the current axes.
 
@@ -216,10 +566,11 @@ class Dspec:
     uvrange = None
     pol = None
     spec_unit = 'sfu'
+    _h5file = None
 
     def __init__(self, fname=None, specfile=None, bl='', uvrange='', field='', scan='',
                  datacolumn='data', domedian=False, timeran=None, spw=None, timebin='0s', regridfreq=False,
-                 fillnan=None, verbose=False, usetbtool=True, ds_normalised=False):
+                 fillnan=None, verbose=False, usetbtool=True, ds_normalised=False, chunksize=None, ncpu=1):
         """
               Initializes the Dspec object by reading a FITS file or a saved numpy array.
 
@@ -257,6 +608,17 @@ class Dspec:
                   If True, uses CASA table tools for data extraction.
               ds_normalised : bool, optional
                   If True, normalizes the dynamic spectrum by the median value.
+              chunksize : int, optional
+                  If set, read the MAIN table in chunks of about this many rows and collapse the baselines
+                  chunk by chunk (median if `domedian`, otherwise mean of the amplitudes) into a
+                  (npol, 1, nfreq, ntime) float32 spectrum. Peak memory is then set by the chunk size
+                  instead of the length of the observation, at about 40 bytes per row, correlation and
+                  channel of a spw (the complex buffer and the amplitude copies of the median).
+                  Requires `usetbtool`.
+              ncpu : int, optional
+                  Number of processes used to read the (scan, spw) blocks of a scan/spw-sorted MS
+                  (or the spws when `usetbtool` is False) in parallel. Default is 1 (serial).
+                  Ignored when `chunksize` is set.
 
               """
         if fname:
@@ -266,7 +628,8 @@ class Dspec:
                         self.get_dspec(fname, specfile=specfile, bl=bl, uvrange=uvrange, field=field,
                                        scan=scan, datacolumn=datacolumn, domedian=domedian, timeran=timeran, spw=spw,
                                        timebin=timebin, regridfreq=regridfreq, fillnan=fillnan, verbose=verbose,
-                                       usetbtool=usetbtool, ds_normalised=ds_normalised)
+                                       usetbtool=usetbtool, ds_normalised=ds_normalised, chunksize=chunksize,
+                                       ncpu=ncpu)
                     else:
                         self.read(fname)
                 else:
@@ -274,6 +637,22 @@ class Dspec:
             else:
                 self.read(fname)
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """
+        Closes the HDF5 file kept open by a lazy read of an .h5/.hdf5 dynamic spectrum.
+        The lazy `data` can no longer be indexed afterwards.
+        """
+        if self._h5file is not None:
+            if self._h5file:
+                self._h5file.close()
+            self._h5file = None
+
     def read(self, fname, source=None, *args, **kwargs):
         """
         Reads dynamic spectrum data from a file.
@@ -286,6 +665,9 @@ class Dspec:
             Specifies the data source ('fits', 'suncasa', or 'lwa') to determine the appropriate reader.
 
         Additional parameters are passed to the specific reader function based on the source.
+        For HDF5 dynamic spectra (.h5/.hdf5), ``lazy=True`` (default) keeps the file open and only reads
+        the parts of the spectrum that are indexed, e.g., the `timerange`/`freqrange` window of :meth:`plot`.
+        The file stays open until :meth:`close`, the next lazy read, or the end of a ``with Dspec(...)`` block.
 
         """
         ##TODO The existing implementation of the mapping between extensions and instruments requires refinement and sophistication.
@@ -295,6 +677,8 @@ class Dspec:
         if type(fname) is str:
             _known_extensions = {
                 ('npz'): 'suncasa',
+                ('h5'): 'suncasa',
+                ('hdf5'): 'suncasa',
             }
             for extension, readername in _known_extensions.items():
                 if fname.lower().endswith(extension):
@@ -314,7 +698,8 @@ class Dspec:
                     self.observatory = 'OVRO'
 
             if source.lower() == 'suncasa':
-                spec, tim, freq, bl, pol, spec_unit = self.rd_dspec(fname, spectype='amp', spec_unit='jy')
+                spec, tim, freq, bl, pol, spec_unit = self.rd_dspec(fname, spectype='amp', spec_unit='jy',
+                                                                    lazy=kwargs.get('lazy', True))
                 self.data = spec
                 self.time_axis = Time(tim / 24 / 3600, format='mjd')
                 self.freq_axis = freq
@@ -415,7 +800,7 @@ class Dspec:
         from astropy.io import fits
 
         if hasattr(self, 'data'):
-            spec = self.data
+            spec = np.asarray(self.data)
             tim = self.time_axis
             freqghz = self.freq_axis / 1e9
 
@@ -497,7 +882,12 @@ class Dspec:
                   domedian=False, timeran=None, spw=None, timebin='0s', regridfreq=False,
                   hanning=False,
                   applyflag=True, fillnan=None, verbose=False,
-                  usetbtool=True, ds_normalised=False):
+                  usetbtool=True, ds_normalised=False, chunksize=None, ncpu=1):
+        if chunksize:
+            if not usetbtool:
+                raise ValueError('chunksize is only supported with usetbtool=True.')
+            if ds_normalised:
+                raise ValueError('ds_normalised needs the full time axis and cannot be used with chunksize.')
         if fname.endswith('/'):
             fname = fname[:-1]
         msfile = fname
@@ -648,7 +1038,13 @@ class Dspec:
             times = np.zeros(nt, float)
             if verbose:
                 print("npol, nf, nt, nbl:", npol, nf, nt, nbl)
-            if order == 't':
+            if chunksize:
+                blidx = np.where(antmask)[0] if len(antmask) > 0 else None
+                ospec, times, freq = _stream_dspec_tb(tb, spwtb, datacol, order, spws_unq, spw_nfrq, scan_ntimes,
+                                                      npol, nbl, chunksize, blidx=blidx, domedian=domedian,
+                                                      applyflag=applyflag, fillnan=fillnan, verbose=verbose)
+                specamp = None
+            elif order == 't':
                 specamp = np.zeros((npol, nf, nbl, nt), complex)
                 flagf = np.zeros((npol, nf, nbl, nt), int)
                 for j in range(nt):
@@ -676,6 +1072,44 @@ class Dspec:
                         flagf[:, fptr:fptr + nfrq, :, j] = flag
                         freq[fptr:fptr + nfrq] = cfrq
                         fptr += nfrq
+            elif ncpu > 1:
+                import multiprocessing as mprocs
+                # Each worker reads (scan, spw) blocks through its own table handle and writes them
+                # straight into shared memory, so nothing large is pickled back to the parent.
+                specname, specf = _shared_ndarray((npol, nf, nt, nbl), complex)
+                timename, times_ = _shared_ndarray((nt,), float)
+                blocks = []
+                iptr = 0
+                for j, scanid in enumerate(scanids):
+                    s = int(scan_ntimes[j])
+                    s1 = int(np.sum(scan_ntimes[:j]))
+                    for i, sp in enumerate(spws_unq):
+                        f1 = int(np.sum(spw_nfrq[:i]))
+                        f2 = int(np.sum(spw_nfrq[:i + 1]))
+                        if j == 0:
+                            cfrq = spwtb.getcol('CHAN_FREQ', sp, 1)[:, 0]
+                            freq[f1:f2] = cfrq
+                            spwlist += [i] * len(cfrq)
+                        blocks.append((specname, specf.shape, timename, datacol, iptr, nbl, s, f1, f2, s1, s1 + s,
+                                       applyflag, fillnan))
+                        iptr += nbl * s
+                if verbose:
+                    print('Filling up {0:d} (scan, spw) blocks with {1:d} processes'.format(len(blocks), ncpu))
+                try:
+                    pool = mprocs.Pool(min(ncpu, len(blocks)), initializer=_init_dspec_worker, initargs=(fname,))
+                    try:
+                        pool.map(_fill_scan_spw, blocks, chunksize=1)
+                    finally:
+                        # as on leaving a `with mprocs.Pool()` block, so that no worker outlives the shared arrays
+                        pool.terminate()
+                        pool.join()
+                    # a view on the shared array, it stays mapped after its file is removed
+                    specamp = np.swapaxes(specf.view(np.ndarray), 2, 3)
+                    times = np.array(times_)
+                finally:
+                    del specf, times_
+                    os.remove(specname)
+                    os.remove(timename)
             else:
                 specf = np.zeros((npol, nf, nt, nbl), complex)  # Array indexes are swapped
                 # flagf = np.zeros((npol, nf, nt, nbl), int)  # Array indexes are swapped
@@ -726,9 +1160,12 @@ class Dspec:
             tb.close()
             spwtb.close()
             ms.close()
-            if len(antmask) > 0:
-                specamp = specamp[:, :, np.where(antmask)[0], :]
-            (npol, nfreq, nbl, ntim) = specamp.shape
+            if chunksize:
+                (npol, nbl, nfreq, ntim) = ospec.shape
+            else:
+                if len(antmask) > 0:
+                    specamp = specamp[:, :, np.where(antmask)[0], :]
+                (npol, nfreq, nbl, ntim) = specamp.shape
             tim = times
             if hanning:
                 os.system('rm -rf {}'.format(fname))
@@ -785,32 +1222,65 @@ class Dspec:
                 time = []
                 if verbose:
                     print('A total of {0:d} spws to fill'.format(len(spwinfo.keys())))
-                for n, descid in enumerate(spwinfo.keys()):
-                    ms.selectinit(datadescid=0, reset=True)
-                    if verbose:
-                        print('filling up spw #{0:d}: {1:s}'.format(n, descid))
-                    descid = int(descid)
-                    ms.selectinit(datadescid=n)  # , reset=True)
-                    data = ms.getdata(['amplitude', 'time', 'axis_info'], ifraxis=True)
-                    if verbose:
-                        print('shape of this spw', data['amplitude'].shape)
-                    specamp_ = data['amplitude']
-                    freq_ = data['axis_info']['freq_axis']['chan_freq'].squeeze()
+                if ncpu > 1 and len(spwinfo.keys()) > 1:
+                    import multiprocessing as mprocs
+                    # Read the first spw here to get (npol, nbl, ntime); the other spws are read by the pool
+                    # into a shared-memory array sized from the channel counts in spwinfo.
+                    spwkeys = list(spwinfo.keys())
+                    nchans = [int(spwinfo[k]['NumChan']) for k in spwkeys]
+                    fptrs = np.hstack(([0], np.cumsum(nchans))).astype(int)
+                    specamp_, freq_, time_ = _getdata_spw(ms, 0, fillnan=fillnan)
+                    data = {'time': time_}
+                    npol_, _, nbl_, ntim_ = specamp_.shape
+                    specname, specamp_shr = _shared_ndarray((npol_, fptrs[-1], nbl_, ntim_), float)
+                    specamp_shr[:, :nchans[0]] = specamp_
+                    tasks = [(n, specname, specamp_shr.shape, fptrs[n], fptrs[n + 1], fillnan)
+                             for n in range(1, len(spwkeys))]
+                    try:
+                        pool = mprocs.Pool(min(ncpu, len(tasks)), initializer=_init_dspec_worker,
+                                           initargs=(vis_spl, False))
+                        try:
+                            res = pool.map(_fill_spw, tasks, chunksize=1)
+                        finally:
+                            pool.terminate()
+                            pool.join()
+                        specamp = specamp_shr.view(np.ndarray)
+                    finally:
+                        del specamp_shr
+                        os.remove(specname)
+                    freqs = [freq_] + [r[0] for r in res]
                     if len(freq_.shape) > 1:
                         # chan_freq for each datadecid contains the info for all the spws
-                        freq = freq_.transpose().flatten()
+                        freq = freqs[-1].transpose().flatten()
                     else:
-                        freq.append(freq_)
-                    time_ = data['time']
-                    if fillnan is not None:
-                        flag_ = ms.getdata(['flag', 'time', 'axis_info'], ifraxis=True)['flag']
-                        if type(fillnan) in [int, float]:
-                            specamp_[flag_] = float(fillnan)
+                        freq = np.concatenate(freqs, axis=0)
+                else:
+                    for n, descid in enumerate(spwinfo.keys()):
+                        ms.selectinit(datadescid=0, reset=True)
+                        if verbose:
+                            print('filling up spw #{0:d}: {1:s}'.format(n, descid))
+                        descid = int(descid)
+                        ms.selectinit(datadescid=n)  # , reset=True)
+                        data = ms.getdata(['amplitude', 'time', 'axis_info'], ifraxis=True)
+                        if verbose:
+                            print('shape of this spw', data['amplitude'].shape)
+                        specamp_ = data['amplitude']
+                        freq_ = data['axis_info']['freq_axis']['chan_freq'].squeeze()
+                        if len(freq_.shape) > 1:
+                            # chan_freq for each datadecid contains the info for all the spws
+                            freq = freq_.transpose().flatten()
                         else:
-                            specamp_[flag_] = 0.0
-                    specamp.append(specamp_)
-                    time.append(time_)
-                specamp = np.concatenate(specamp, axis=1)
+                            freq.append(freq_)
+                        time_ = data['time']
+                        if fillnan is not None:
+                            flag_ = ms.getdata(['flag', 'time', 'axis_info'], ifraxis=True)['flag']
+                            if type(fillnan) in [int, float]:
+                                specamp_[flag_] = float(fillnan)
+                            else:
+                                specamp_[flag_] = 0.0
+                        specamp.append(specamp_)
+                        time.append(time_)
+                    specamp = np.concatenate(specamp, axis=1)
                 try:
                     # if len(freq.shape) > 1:
                     freq = np.concatenate(freq, axis=0)
@@ -827,9 +1297,11 @@ class Dspec:
 
         if verbose:
             print('npol, nfreq, nbl, ntime:', (npol, nfreq, nbl, ntim))
-        spec = np.swapaxes(specamp, 2, 1)
-
-        if domedian:
+        if chunksize:
+            # already reduced over baselines chunk by chunk
+            pass
+        elif domedian:
+            spec = np.swapaxes(specamp, 2, 1)
             if verbose:
                 print('doing median of all the baselines')
             # mask zero values before median
@@ -855,14 +1327,19 @@ class Dspec:
                 ospec = spec_med_bl.reshape((npol, nbl, nfreq, ntim))
                 ospec = ospec * 1e4
         else:
-            ospec = spec
+            ospec = np.swapaxes(specamp, 2, 1)
         # Save the dynamic spectral data
         if not specfile:
             specfile = msfile + '.dspec.npz'
+        # the specfile may still be open from a previous lazy read
+        self.close()
         if os.path.exists(specfile):
             os.system('rm -rf ' + specfile)
-        np.savez(specfile, spec=ospec, tim=tim, freq=freq,
-                 timeran=timeran, spw=spw, bl=bl, uvrange=uvrange, pol=pol)
+        if _is_h5_dspec(specfile):
+            _wrt_dspec_h5(specfile, ospec, tim, freq, pol=pol, timeran=timeran, spw=spw, bl=bl, uvrange=uvrange)
+        else:
+            np.savez(specfile, spec=ospec, tim=tim, freq=freq,
+                     timeran=timeran, spw=spw, bl=bl, uvrange=uvrange, pol=pol)
         if verbose:
             print('Median dynamic spectrum saved as: ' + specfile)
 
@@ -896,8 +1373,29 @@ class Dspec:
             f.write(buf)
         f.close()
 
-    def rd_dspec(self, specdata, spectype='amp', spec_unit='jy'):
+    def rd_dspec(self, specdata, spectype='amp', spec_unit='jy', lazy=False):
         spectype = spectype.lower()
+        if _is_h5_dspec(specdata):
+            import h5py
+            if spec_unit.lower() not in ['jy', 'sfu', 'k']:
+                raise ValueError("Input spec_unit is {}. "
+                                 "If spectype = 'amp', spec_unit must be 'jy', 'sfu', or 'k'".format(spec_unit))
+            if spectype not in ['amp', 'pha']:
+                raise ValueError('spectype must be amp or phase!')
+            f = h5py.File(specdata, 'r')
+            spec = _LazySpec(f['spec'], spectype=spectype, spec_unit=spec_unit)
+            tim = f['tim'][:]
+            freq = f['freq'][:]
+            bl = f.attrs.get('bl', '')
+            pol = list(f.attrs.get('pol', []))
+            if lazy:
+                # only one file is kept open, release the one of a previous lazy read
+                self.close()
+                self._h5file = f
+            else:
+                spec = spec[...]
+                f.close()
+            return spec, tim, freq, bl, pol, spec_unit
         if type(specdata) is str:
             try:
                 specdata = np.load(specdata)
@@ -947,8 +1445,11 @@ class Dspec:
     def concat_dspec(self, specfiles, outfile=None, savespec=False):
         '''
         concatenate a list of specfiles in time axis
-        :param specfiles: a list of specfile to concatenate
-        :return: concatenated specdata
+        :param specfiles: a list of specfile (.npz or .h5) to concatenate
+        :param outfile: output file name. If it ends with .h5/.hdf5, the specfiles are appended one by one
+            to this chunked HDF5 file. An existing outfile is extended in place and only integrations later
+            than its last time stamp are added, so nothing already on disk is rewritten.
+        :return: concatenated specdata, or the name of the HDF5 outfile
         '''
         from tqdm import tqdm
         if isinstance(specfiles, list):
@@ -961,27 +1462,34 @@ class Dspec:
             print('Please provide a list of specfiles')
             return -1
 
-        specdata = {}
-
-        specdata_ = np.load(specfiles[0])
-        for k, v in specdata_.iteritems():
-            specdata[k] = v
+        if savespec and _is_h5_dspec(outfile):
+            for spfile in tqdm(specfiles):
+                specdata_ = _load_dspec_raw(spfile)
+                if not os.path.exists(outfile):
+                    _wrt_dspec_h5(outfile, specdata_['spec'], specdata_['tim'], specdata_['freq'],
+                                  pol=specdata_['pol'], timeran=specdata_['timeran'], spw=specdata_['spw'],
+                                  bl=specdata_['bl'], uvrange=specdata_['uvrange'])
+                else:
+                    _append_dspec_h5(outfile, specdata_['spec'], specdata_['tim'])
+            return outfile
 
+        specdata = _load_dspec_raw(specfiles[0])
+        specs = [specdata['spec']]
+        tims = [specdata['tim']]
         for spfile in tqdm(specfiles[1:]):
-            specdata_ = np.load(spfile)
-            specdata['spec'] = np.concatenate((specdata['spec'], specdata_['spec']), axis=-1)
-            specdata['tim'] = np.hstack((specdata['tim'], specdata_['tim']))
+            specdata_ = _load_dspec_raw(spfile)
+            specs.append(specdata_['spec'])
+            tims.append(specdata_['tim'])
+        specdata['spec'] = np.concatenate(specs, axis=-1)
+        specdata['tim'] = np.hstack(tims)
 
         if savespec:
-            if not outfile:
-                specfile = 'dspec.npz'
+            specfile = outfile if outfile else 'dspec.npz'
             if os.path.exists(specfile):
                 os.system('rm -rf ' + specfile)
             np.savez(specfile, **specdata)
         return specdata
 
-
-
     def peek(self, *args, **kwargs):
         """
         Plot dynamaic spectrum onto current axes.
@@ -1076,6 +1584,12 @@ class Dspec:
             return 0
 
         spec = self.data
+        tim_ = self.time_axis
+        freq = self.freq_axis
+        if isinstance(spec, _LazySpec):
+            # read only the requested time/frequency window from disk
+            spec, tim_, freq = _rd_dspec_window(spec, tim_, freq, timerange=timerange, freqrange=freqrange,
+                                                freq_unit=freq_unit)
 
         try:
             cmap = copy(plt.get_cmap(cmap))
@@ -1093,14 +1607,13 @@ class Dspec:
             norm = colors.LogNorm(vmax=vmax, vmin=vmin)
 
         bl = self.bl
-        freq = self.freq_axis
         if spec_unit is None:
             spec_unit = self.spec_unit
         elif spec_unit.lower() != self.spec_unit.lower():
             if spec_unit.lower() == 'sfu' and self.spec_unit.lower() == 'jy':
-                spec = np.copy(self.data) / 1e4
+                spec = np.copy(spec) / 1e4
             elif spec_unit.lower() == 'jy' and self.spec_unit.lower() == 'sfu':
-                spec = np.copy(self.data) * 1e4
+                spec = np.copy(spec) * 1e4
             else:
                 print('Spectrum unit conversion from {0:s} to {1:s} not supported'.format(self.spec_unit, spec_unit))
                 print('Use the original one.')
@@ -1118,7 +1631,7 @@ class Dspec:
             spec_name = 'Intensity'
 
         if spec.ndim == 2:
-            nfreq, ntim = len(self.freq_axis), len(self.time_axis)
+            nfreq, ntim = len(freq), len(tim_)
             npol = 1
             nbl = 1
             polnames = self.pol
@@ -1129,7 +1642,6 @@ class Dspec:
                 print('The polarization dimension in the data {0:d} does not match the names {1:d}. Abort.'.format(npol,
                                                                                                                    len(polnames)))
 
-        tim_ = self.time_axis
         tim_plt = tim_.plot_date
 
         if timerange:
@@ -3,7 +3,6 @@ import h5py
 import numpy as np
 import datetime
 from astropy.time import Time
-import itertools
 from astropy import units as u
 import pandas as pd
 from astropy.coordinates import SkyCoord, EarthLocation, get_body, AltAz
@@ -20,14 +19,63 @@ def rebin2d(arr, new_shape):
 
 
 def timestamp_to_mjd(times):
-    # This is from Ivey Davis's BeamTools.py
-    t_flat = np.array(list(itertools.chain(*times)))
-    ts_inds = np.linspace(0, len(times)-1, len(times), dtype  = int)*2
-    other_inds = ts_inds + 1
-    ts = Time(t_flat[ts_inds],format = 'unix') + t_flat[other_inds]* u.s
-    ts = ts.mjd
-    return ts
+    """
+    Convert OVRO-LWA beamforming time stamps to MJD.
 
+    :param times: the 'time' dataset of the beamforming file, i.e., (integer unix seconds, fractional seconds)
+        pairs, either as a compound array or as an array of shape (ntime, 2).
+    :return: MJD of each time stamp.
+    """
+    times = np.asarray(times)
+    if times.dtype.names:
+        t_int = times[times.dtype.names[0]]
+        t_frac = times[times.dtype.names[1]]
+    else:
+        t_int = times[:, 0]
+        t_frac = times[:, 1]
+    # unix time does not count leap seconds, so it maps linearly onto MJD (UTC)
+    return (t_int.astype(float) / 86400. + 40587.) + t_frac.astype(float) / 86400.
+
+
+def _nearest_index(arr, values):
+    """
+    Index of the element of the sorted array `arr` that is nearest to each of `values`, by binary search.
+    """
+    arr = np.asarray(arr)
+    values = np.atleast_1d(values)
+    idx = np.clip(np.searchsorted(arr, values), 1, len(arr) - 1)
+    idx -= (values - arr[idx - 1]) < (arr[idx] - values)
+    return np.clip(idx, 0, len(arr) - 1)
+
+
+def _pb_factors(times_mjd, obs, tstep=5. / 1440.):
+    """
+    Analytical primary beam factor sin(alt)**1.6 of the Sun at `times_mjd`.
+
+    The solar altitude is computed with one vectorized `get_body` call on a grid of `tstep` days
+    and interpolated to `times_mjd`. Altitudes lower than 5 degrees are clipped to 5 degrees.
+    """
+    t0, t1 = times_mjd[0], times_mjd[-1]
+    if t1 - t0 > tstep:
+        ts_ref = np.linspace(t0, t1, int((t1 - t0) / tstep))
+        print('Duration of the data is {0:.1f} hours, interpolating into {1:d} steps.'.format((t1 - t0) * 24.,
+                                                                                              len(ts_ref)))
+    else:
+        print('Duration of the data is {0:.1f} minutes, no interpolation will be done.'.format((t1 - t0) * 24. * 60.))
+        ts_ref = np.array([(t0 + t1) / 2.])
+    tref = Time(ts_ref, format='mjd')
+    sun_loc = get_body('sun', tref, location=obs)
+    alt = sun_loc.transform_to(AltAz(obstime=tref, location=obs)).alt.radian
+    if np.any(np.degrees(alt) <= 5.):
+        print('Warning! Calculated solar altitude is lower than 5 degrees. Something is wrong with the data (non-solar)?')
+    pbfacs_ref = np.sin(np.maximum(alt, np.radians(5.))) ** 1.6
+    if len(ts_ref) == 1:
+        return np.full(len(times_mjd), pbfacs_ref[0])
+    return np.interp(times_mjd, ts_ref, pbfacs_ref)
+
+
+# number of (time, freq) samples read from each dataset at a time
+_BLOCK_NELEM = 2 ** 24
 
 def read_data(filename, stokes='I', timerange=[], freqrange=[], timebin=1, freqbin=1, verbose=True, 
             flux_factor_file=None, bkg_file=None,  do_pb_correction=False, 
@@ -67,230 +115,188 @@ def read_data(filename, stokes='I', timerange=[], freqrange=[], timebin=1, freqb
         return False
     else:
         filelist.sort()
-    
-    n0 = 0 # this is the index for the first file being read successfully
-    firstset_read = False 
+
+    # select stokes
+    stokes_valid = ['XX', 'YY', 'I', 'Q', 'U', 'V', 'IV']
+    if stokes not in stokes_valid:
+        raise Exception("Provided Stokes {0:s} is not in 'XX, YY, RR, LL, I, Q, U, V'".format(stokes))
+    if verbose:
+        print('Reading dynamic spectrum for stokes {0:s}'.format(stokes))
+    stokes_out = {'XX': ['XX'], 'YY': ['YY'], 'I': ['I'], 'IV': ['I', 'V'],
+                  'Q': ['Q'], 'U': ['U'], 'V': ['V']}[stokes.upper()]
+    dsets = {'XX': ['XX'], 'YY': ['YY'], 'I': ['XX', 'YY'], 'IV': ['XX', 'YY', 'XY_imag'],
+             'Q': ['XX', 'YY'], 'U': ['XY_real'], 'V': ['XY_imag']}[stokes.upper()]
+    npol = len(stokes_out)
+
+    # First pass: read only the time and frequency axes of every file to size the output
+    selections = []
+    freqs_out = None
     for n, file in enumerate(filelist):
         if verbose:
-            print('Processing {0:d} of {1:d} files'.format(n+1, len(filelist)))
+            print('Processing {0:d} of {1:d} files'.format(n + 1, len(filelist)))
         try:
-            data = h5py.File(file, 'r',swmr=True)
+            with h5py.File(file, 'r', swmr=True) as data:
+                freqs = data['Observation1']['Tuning1']['freq'][:]
+                times_mjd = timestamp_to_mjd(data['Observation1']['time'][:])
         except:
             print('Cannot read {0:s}. Skip this file.'.format(file))
             continue
-        freqs = data['Observation1']['Tuning1']['freq'][:]
-        ts = data['Observation1']['time'][:]
-        # The following line works the same way as timestamp_to_mjd(), but a bit too slow
-        # times_mjd = np.array([(Time(t[0], format='unix') + TimeDelta(t[1], format='sec')).mjd for t in ts])
-        times_mjd = timestamp_to_mjd(ts)
-        idx0, = np.where(times_mjd > 50000.) # filter out those prior to 1995 (obviously wrong for OVRO-LWA)
-
-        # read the flux factors file if provided
-        if not (flux_factor_file is None): 
-            try:
-                out = pd.read_csv(flux_factor_file)
-                calfac_x = np.array(out['calfac_x'])
-                calfac_y = np.array(out['calfac_y'])
-            except:
-                print('Failed in reading the flux factor csv file. Setting correction factors to unity.')
-        else:
-            print('Flux factor csv file does not exist. Setting correction factors to unity.')
-            calfac_x = np.ones_like(freqs)
-            calfac_y = np.ones_like(freqs)
-
-        if not (flux_factor_calfac_x is None) and not (flux_factor_calfac_y is None):
-            # user input correction factor
-            calfac_x = calfac_x*flux_factor_calfac_x
-            calfac_y = calfac_y*flux_factor_calfac_y
-        
-        if not (bkg_flux_arr is None):
-            # add the user input background flux
-            bkg_flux += bkg_flux_arr
-
-        # read background flux file if provided
-        if not (bkg_file is None): 
-            try:
-                out = pd.read_csv(bkg_file)
-                bkg_flux = out['bkg_flux']
-                print('Using the provided raw aackground flux csv file.')
-            except:
-                print('Failed in reading the background flux csv file. Setting background flux to zero.')
-        else:
-            print('No background csv file provided. Setting background flux to zero.')
-            bkg_flux = np.zeros_like(freqs)
+        idx0, = np.where(times_mjd > 50000.)  # filter out those prior to 1995 (obviously wrong for OVRO-LWA)
+        if len(idx0) == 0:
+            print('No valid time stamps in {0:s}. Skip this file.'.format(file))
+            continue
 
         if verbose:
-            print('Data time range is from {0:s} to {1:s}'.format(Time(times_mjd[idx0][0], format='mjd').isot, 
-                Time(times_mjd[idx0][-1], format='mjd').isot))
+            print('Data time range is from {0:s} to {1:s}'.format(Time(times_mjd[idx0][0], format='mjd').isot,
+                                                                  Time(times_mjd[idx0][-1], format='mjd').isot))
             print('Data has {0:d} time stamps and {1:d} frequency channels'.format(len(times_mjd[idx0]), len(freqs)))
 
         # Select time range
+        ti0, ti1 = 0, len(times_mjd)
         if len(timerange) > 0:
             try:
                 timerange_obj = Time(timerange)
-                # Take the larger value of the supplied start time and the first time stamp of the data
-                t0 = max(timerange_obj[0].mjd, min(times_mjd[idx0]))
-                # Take the smaller value of the supplied end time and the last time stamp of the data
-                t1 = min(timerange_obj[1].mjd, max(times_mjd[idx0]))
-                ti0 = np.argmin(np.abs(times_mjd - t0))
-                ti1 = np.argmin(np.abs(times_mjd - t1)) 
+                # Clip the supplied start and end times to the first and last time stamps of the data
+                t0 = max(timerange_obj[0].mjd, times_mjd[idx0[0]])
+                t1 = min(timerange_obj[1].mjd, times_mjd[idx0[-1]])
+                ti0, ti1 = idx0[_nearest_index(times_mjd[idx0], [t0, t1])]
                 if ti1 - ti0 < timebin:
-                    print('Selected number of time samples {0:d} is less than the timebin {1:d}. Skip this file.'.format(ti1-ti0, timebin))
-                    if not firstset_read:
-                        n0 += 1
+                    print('Selected number of time samples {0:d} is less than the timebin {1:d}. '
+                          'Skip this file.'.format(ti1 - ti0, timebin))
                     continue
                 if verbose:
-                    print('Selected time range is from {0:s} to {1:s}'.format(Time(times_mjd[ti0], format='mjd').isot, 
+                    print('Selected time range is from {0:s} to {1:s}'.format(Time(times_mjd[ti0], format='mjd').isot,
                                                                               Time(times_mjd[ti1], format='mjd').isot))
             except:
                 print('timerange not parsed correctly. Use the full range in the data.')
-                ti0 = 0
-                ti1 = len(times_mjd) 
-        else:
-            ti0=0
-            ti1=len(times_mjd)
-
-        firstset_read = True
-        times_mjd = times_mjd[ti0:ti1] 
+                ti0, ti1 = 0, len(times_mjd)
 
         # Select frequency range
-        if len(freqrange) > 0:
-            if type(freqrange) == list:
-                try:
-                    f0 = freqrange[0]
-                    f1 = freqrange[1]
-                    if f0 > 100. or f1 > 100.:
-                        # I am assuming input frequency range is in Hz
-                        print('Input frequency range is greater than 100. Assuming unit in Hz.')
-                    else:
-                        # I am assuming input frequency range is in MHz
-                        print('Input frequency range is less than 100. Assuming unit in MHz.')
-                        f0 *= 1e6
-                        f1 *= 1e6
-                    fi0 = np.argmin(np.abs(freqs - f0))
-                    fi1 = np.argmin(np.abs(freqs - f1)) 
-                except:
-                    print('freqrange not parsed correctly. Use the full range.')
-                    fi0 = 0
-                    fi1 = len(freqs) 
-        else:
-            fi0=0
-            fi1=len(freqs)
+        fi0, fi1 = 0, len(freqs)
+        if len(freqrange) > 0 and type(freqrange) == list:
+            try:
+                f0 = freqrange[0]
+                f1 = freqrange[1]
+                if f0 > 100. or f1 > 100.:
+                    # I am assuming input frequency range is in Hz
+                    print('Input frequency range is greater than 100. Assuming unit in Hz.')
+                else:
+                    # I am assuming input frequency range is in MHz
+                    print('Input frequency range is less than 100. Assuming unit in MHz.')
+                    f0 *= 1e6
+                    f1 *= 1e6
+                fi0, fi1 = _nearest_index(freqs, [f0, f1])
+            except:
+                print('freqrange not parsed correctly. Use the full range.')
+                fi0, fi1 = 0, len(freqs)
 
-        freqs = freqs[fi0:fi1] 
+        # time stamps used in the output, truncated to a whole number of time bins
+        tidx = ti0 + np.where(times_mjd[ti0:ti1] > 50000.)[0]
+        nt_new = len(tidx) // timebin
+        nf_new = (fi1 - fi0) // freqbin
+        if freqs_out is None:
+            freqs_out = rebin1d(freqs[fi0:fi0 + nf_new * freqbin], nf_new)
+            freqs_all = freqs
+        elif nf_new != len(freqs_out):
+            print('Something is wrong in concatenating {}'.format(file))
+            print('Dimension of the output frequency {0:d} does not match that of the first file {1:d}'.format(
+                nf_new, len(freqs_out)))
+            continue
+        if nt_new == 0:
+            continue
+        selections.append((file, tidx[:nt_new * timebin], times_mjd[tidx[:nt_new * timebin]], fi0, fi1))
 
-        # select stokes
-        stokes_valid = ['XX', 'YY', 'I', 'Q', 'U', 'V', 'IV']
-        if verbose:
-            print('Reading dynamic spectrum for stokes {0:s}'.format(stokes))
+    if not selections:
+        return False
+
+    # The flux correction factors and the background are the same for all files
+    calfac_x = np.ones_like(freqs_all)
+    calfac_y = np.ones_like(freqs_all)
+    if not (flux_factor_file is None):
+        try:
+            out = pd.read_csv(flux_factor_file)
+            calfac_x = np.array(out['calfac_x'])
+            calfac_y = np.array(out['calfac_y'])
+        except:
+            print('Failed in reading the flux factor csv file. Setting correction factors to unity.')
+    else:
+        print('Flux factor csv file does not exist. Setting correction factors to unity.')
 
-        if stokes not in stokes_valid:
-            raise Exception("Provided Stokes {0:s} is not in 'XX, YY, RR, LL, I, Q, U, V'".format(stokes))
-        if stokes.upper() == 'XX':
-            spec = data['Observation1']['Tuning1']['XX'][ti0:ti1, fi0:fi1] / calfac_x[None, fi0:fi1]
-            stokes_out = ['XX']
-        if stokes.upper() == 'YY':
-            spec = data['Observation1']['Tuning1']['YY'][ti0:ti1, fi0:fi1] / calfac_y[None, fi0:fi1]
-            stokes_out = ['YY']
-        if stokes.upper() == 'I' or stokes.upper() == 'IV':
-            spec_I = (data['Observation1']['Tuning1']['XX'][ti0:ti1, fi0:fi1] / calfac_x[None, fi0:fi1] + \
-                   data['Observation1']['Tuning1']['YY'][ti0:ti1, fi0:fi1] / calfac_y[None, fi0:fi1]) / 2. - \
-                   bkg_flux[None, fi0:fi1] / ((calfac_x[None, fi0:fi1] + calfac_y[None, fi0:fi1]) / 2.) 
-            if verbose:
-                print('Median of the subtracted background flux (Jy)', np.median(bkg_flux[None, fi0:fi1] / ((calfac_x[None, fi0:fi1] + calfac_y[None, fi0:fi1]) / 2.)))
-                print('RMS of the subtracted background flux (Jy)', np.std(bkg_flux[None, fi0:fi1] / ((calfac_x[None, fi0:fi1] + calfac_y[None, fi0:fi1]) / 2.)))
-            if do_pb_correction:
-                pbfacs = np.ones_like(times_mjd)
-                t0 = times_mjd[0]
-                t1 = times_mjd[-1]
-                if t1-t0 > 5./1440.:
-                    nstep = int((t1-t0)/(5./1440.))
-                    ts_ref = np.linspace(t0, t1, nstep)
-                    pbfacs_ref = np.ones_like(ts_ref) 
-                    print('Duration of the file is {0:.1f} hours, interpolating into {1:d} steps.'.format((t1-t0)*24., nstep))
-                    for i, t_ref in enumerate(ts_ref):
-                        sun_loc = get_body('sun', Time(t_ref, format='mjd'), location=obs)
-                        alt = sun_loc.transform_to(AltAz(obstime=Time(t_ref, format='mjd'), location=obs)).alt.radian
-                        if np.degrees(alt) > 5.:
-                            pbfacs_ref[i]=np.sin(alt)**1.6
-                        else:
-                            print('Warning! Calculated solar altitude is lower than 5 degrees. Something is wrong with the data (non-solar)?') 
-                            pbfacs_ref[i]=np.sin(np.radians(5.))**1.6
+    if not (flux_factor_calfac_x is None) and not (flux_factor_calfac_y is None):
+        # user input correction factor
+        calfac_x = calfac_x * flux_factor_calfac_x
+        calfac_y = calfac_y * flux_factor_calfac_y
 
-                    pbfacs = np.interp(times_mjd, ts_ref, pbfacs_ref)
-                else:
-                    print('Duration of the file is {0:.1f} minutes, no interpolation will be done.'.format((t1-t0)*24.*60.))
-                    t_ref = (t0+t1)/2.
-                    sun_loc = get_body('sun', Time(t_ref, format='mjd'), location=obs)
-                    alt = sun_loc.transform_to(AltAz(obstime=Time(t_ref, format='mjd'), location=obs)).alt.radian
-                    if np.degrees(alt) > 5.:
-                        pbfacs *= np.sin(alt)**1.6
-                    else:
-                        print('Warning! Calculated solar altitude is lower than 5 degrees. Something is wrong with the data (non-solar)?') 
-                        pbfacs *= np.sin(np.radians(5.))**1.6
-                spec_I /= pbfacs[:, None]
+    bkg_flux = np.zeros_like(freqs_all)
+    if not (bkg_file is None):
+        try:
+            out = pd.read_csv(bkg_file)
+            bkg_flux = np.array(out['bkg_flux'])
+            print('Using the provided raw background flux csv file.')
+        except:
+            print('Failed in reading the background flux csv file. Setting background flux to zero.')
+    else:
+        print('No background csv file provided. Setting background flux to zero.')
 
-            if stokes.upper() == 'IV':
-                spec_V = data['Observation1']['Tuning1']['XY_imag'][ti0:ti1, fi0:fi1] / ((calfac_x[None, fi0:fi1] + calfac_y[None, fi0:fi1]) / 2.)
-                spec = np.stack((spec_I, spec_V), axis=2)
-                stokes_out = ['I', 'V']
-            else:
-                spec = spec_I
-                stokes_out = ['I'] 
-        if stokes == 'V':
-            spec = data['Observation1']['Tuning1']['XY_imag'][ti0:ti1, fi0:fi1] / ((calfac_x[None, fi0:fi1] + calfac_y[None, fi0:fi1]) / 2.)
-            stokes_out = ['V'] 
-        if stokes == 'Q':
-            spec = (data['Observation1']['Tuning1']['XX'][ti0:ti1, fi0:fi1] / calfac_x[None, fi0:fi1] - \
-                    data['Observation1']['Tuning1']['YY'][ti0:ti1, fi0:fi1] / calfac_y[None, fi0:fi1]) / 2. 
-            stokes_out = ['Q'] 
-        if stokes == 'U':
-            spec = data['Observation1']['Tuning1']['XY_real'][ti0:ti1, fi0:fi1] / ((calfac_x[None, fi0:fi1] + calfac_y[None, fi0:fi1]) / 2.)
-            stokes_out = ['U'] 
+    if not (bkg_flux_arr is None):
+        # add the user input background flux
+        bkg_flux = bkg_flux + bkg_flux_arr
 
-        idx, = np.where(times_mjd > 50000.) # filter out those prior to 1995 (obviously wrong for OVRO-LWA)
-        times_mjd = times_mjd[idx]
-        spec = spec[idx]
+    if do_pb_correction and stokes.upper() in ['I', 'IV']:
+        pbfacs_all = _pb_factors(np.hstack([sel[2] for sel in selections]), obs)
 
-        if spec.ndim == 2:
-            # TODO: for now I have just ignored the rest of the data that falls outside of the whole factor of timebin * nt_new or freqbin * nf_new 
-            nt, nf = spec.shape
-            npol = 1
-            nt_new, nf_new = (nt // timebin, nf // freqbin)
-            spec_new = rebin2d(spec[:nt_new*timebin, :nf_new*freqbin], (nt_new, nf_new))
-        if spec.ndim == 3:
-            nt, nf, npol = spec.shape
-            spec_new_ = [] 
-            for i in range(npol):
-                nt_new, nf_new = (nt // timebin, nf // freqbin)
-                spec_ = spec[:, :, i]
-                spec_new_.append(rebin2d(spec_[:nt_new*timebin, :nf_new*freqbin], (nt_new, nf_new)))
-            spec_new = np.stack(spec_new_, axis=2)
-            
-        spec_new = np.transpose(spec_new).reshape((npol, 1, nf_new, nt_new)) / 1e4
-        times_mjd_new = rebin1d(times_mjd[:nt_new * timebin], nt_new)
-        freqs_new = rebin1d(freqs[:nf_new * freqbin], nf_new)
-        if firstset_read:
-            if n == n0:
-                nfreq0 = len(freqs_new)
-                freqs_out = freqs_new
-                spec_out = spec_new
-                times_mjd_out = times_mjd_new
-            elif n > n0:
-                if len(freqs_new) != nfreq0:
-                    print('Something is wrong in concatenating {}'.format(file)) 
-                    print('Dimension of the output frequency {0:d} does not match that of the first file {1:d)'.format(len(freqs_new), nfreq0)) 
-                    continue
+    # Second pass: read each needed dataset once, block by block, and rebin into the preallocated output
+    nf_out = len(freqs_out)
+    nt_out = sum([len(sel[1]) // timebin for sel in selections])
+    spec_out = np.zeros((npol, 1, nf_out, nt_out))
+    times_mjd_out = np.zeros(nt_out)
+    tptr = 0
+    pptr = 0
+    for file, tidx, times_mjd, fi0, fi1 in selections:
+        fi1_ = fi0 + nf_out * freqbin
+        cx = calfac_x[None, fi0:fi1_]
+        cy = calfac_y[None, fi0:fi1_]
+        cxy = (cx + cy) / 2.
+        bkg = bkg_flux[None, fi0:fi1_] / cxy
+        if verbose and stokes.upper() in ['I', 'IV']:
+            print('Median of the subtracted background flux (Jy)', np.median(bkg))
+            print('RMS of the subtracted background flux (Jy)', np.std(bkg))
+        nrow_block = max(1, _BLOCK_NELEM // max(fi1_ - fi0, 1) // timebin) * timebin
+        with h5py.File(file, 'r', swmr=True) as data:
+            tuning = data['Observation1']['Tuning1']
+            for k0 in range(0, len(tidx), nrow_block):
+                bidx = tidx[k0:k0 + nrow_block]
+                r0, r1 = bidx[0], bidx[-1] + 1
+                raw = {}
+                for d in dsets:
+                    raw[d] = tuning[d][r0:r1, fi0:fi1_][bidx - r0]
+                if stokes.upper() == 'XX':
+                    specs = [raw['XX'] / cx]
+                elif stokes.upper() == 'YY':
+                    specs = [raw['YY'] / cy]
+                elif stokes.upper() in ['I', 'IV']:
+                    spec_I = (raw['XX'] / cx + raw['YY'] / cy) / 2. - bkg
+                    if do_pb_correction:
+                        spec_I /= pbfacs_all[pptr + k0:pptr + k0 + len(bidx), None]
+                    specs = [spec_I]
+                    if stokes.upper() == 'IV':
+                        specs.append(raw['XY_imag'] / cxy)
+                elif stokes.upper() == 'Q':
+                    specs = [(raw['XX'] / cx - raw['YY'] / cy) / 2.]
+                elif stokes.upper() == 'U':
+                    specs = [raw['XY_real'] / cxy]
                 else:
-                    spec_out = np.concatenate((spec_out, spec_new), axis=3)
-                    times_mjd_out = np.concatenate((times_mjd_out, times_mjd_new))
-        else:
-            continue
+                    specs = [raw['XY_imag'] / cxy]
+                nt_blk = len(bidx) // timebin
+                for i, spec in enumerate(specs):
+                    spec_out[i, 0, :, tptr:tptr + nt_blk] = rebin2d(spec, (nt_blk, nf_out)).T / 1e4
+                times_mjd_out[tptr:tptr + nt_blk] = rebin1d(times_mjd[k0:k0 + len(bidx)], nt_blk)
+                tptr += nt_blk
+        pptr += len(tidx)
 
-    if firstset_read:
-        if verbose:
-            print('Output time range is from {0:s} to {1:s}'.format(Time(times_mjd_out[0], format='mjd').isot, Time(times_mjd_out[-1], format='mjd').isot))
-            print('Output data has {0:d} time stamps and {1:d} frequency channels'.format(len(times_mjd_out), len(freqs_out)))
-        return spec_out, times_mjd_out, freqs_out, stokes_out, calfac_x, calfac_y, bkg_flux
-    else:
-        return False
+    if verbose:
+        print('Output time range is from {0:s} to {1:s}'.format(Time(times_mjd_out[0], format='mjd').isot,
+                                                                Time(times_mjd_out[-1], format='mjd').isot))
+        print('Output data has {0:d} time stamps and {1:d} frequency channels'.format(len(times_mjd_out),
+                                                                                      len(freqs_out)))
+    return spec_out, times_mjd_out, freqs_out, stokes_out, calfac_x, calfac_y, bkg_flux
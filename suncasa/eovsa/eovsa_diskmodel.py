@@ -326,7 +326,154 @@ def im2cl(imname, clname, convol=True, verbose=False):
     im2.done()
 
 
-def fit_diskmodel(out, bidx, rstn_flux, uvfitrange=[1, 150], angle_tolerance=np.pi / 2, doplot=True):
+def disk_uvdata(out, bidx, uvangle, angle_tolerance=np.pi / 2):
+    ''' Returns the channel indexes of band bidx and the uv distances (wavelengths) and amplitudes (sfu) of
+        the baselines of antennas 1-4 with antennas 1-7, separately for the points near the solar equator
+        and near the solar pole, as (fidx, uvdeq, ampeq, uvdpol, amppol).  Zero amplitudes are dropped.
+        uvangle     uv angle already rotated for the P-angle
+    '''
+    from eovsapy.util import bl2ord
+    import scipy.constants
+    mperns = scipy.constants.c / 1e9  # speed of light in m/ns
+    antmax = 7
+    at = angle_tolerance
+    fidx, = np.where(out['band'] == bidx)  # Array of frequency indexes for channels in this band
+    # Baselines of antennas 1-4 with the higher numbered antennas up to antmax
+    bls = np.concatenate([bl2ord[i, i + 1:antmax] for i in range(4)])
+    amp = out['amp'][0][fidx][:, bls] / 10000.  # Convert to sfu
+    uva = np.broadcast_to(uvangle[bls], amp.shape)
+    uvd = out['uvdist'][bls] * out['fghz'][fidx].reshape((-1,) + (1,) * (amp.ndim - 1)) / mperns  # Wavelengths
+    # Use only non-zero amplitudes
+    good = amp != 0
+    # Equatorial points are within +/- at/2 of solar equator, polar points within +/- at/2 of solar pole
+    eq = good & np.logical_or(np.abs(uva) < at / 2, np.abs(uva) >= np.pi - at / 2)
+    pol = good & np.logical_and(np.abs(uva) >= np.pi / 2 - at / 2, np.abs(uva) < np.pi / 2 + at / 2)
+    return fidx, uvd[eq], amp[eq], uvd[pol], amp[pol]
+
+
+def disk_model_grid(flux, a, solfac, zeq, ampeq, zpol, amppol):
+    ''' Compares the uniform disk model with the data for all the disk size factors in solfac at once.
+        Each band is a row of the 2-D arrays zeq, ampeq, zpol and amppol, padded with NaNs to a common length.
+        flux        disk flux density (sfu) of each band
+        a           scale of the uv distance for a disk of one photospheric radius
+        solfac      trial disk size factors
+        Returns the median absolute deviations of the data from the model with respect to unity for the
+        equatorial, polar and all points, and the flux scale factors fitted to the equatorial+polar and to all
+        points, each of shape (nband, ntry).
+    '''
+    from scipy.special import j1
+    f = np.asarray(flux, dtype=float)[:, None, None]
+    sf = np.asarray(solfac, dtype=float)[None, :, None]
+    ampeq = ampeq[:, None, :]
+    amppol = amppol[:, None, :]
+    ampall = np.concatenate((ampeq, amppol), axis=-1)
+    xeq = a * sf * zeq[:, None, :]
+    xpol = a * sf * zpol[:, None, :]
+    beq = np.abs(j1(xeq) / xeq)
+    bpol = np.abs(j1(xpol) / xpol)
+    sfac = (np.nanmedian(ampeq / (f * 2 * beq), axis=-1) + np.nanmedian(amppol / (f * 2 * bpol), axis=-1)) / 2
+    s = sfac[:, :, None]
+    eqpts = f * (2 * s) * beq
+    polpts = f * (2 * s) * bpol
+    allpts = np.concatenate((eqpts, polpts), axis=-1)
+    sfacall = np.nanmedian(ampall / allpts, axis=-1)
+    d2m_eq = np.nanmedian(abs(ampeq / eqpts - 1), axis=-1)
+    d2m_pol = np.nanmedian(abs(amppol / polpts - 1), axis=-1)
+    d2m_all = np.nanmedian(abs(ampall / allpts - 1), axis=-1)
+    return d2m_eq, d2m_pol, d2m_all, sfac, sfacall
+
+
+def refine_disksize(flux, a, z, amp, sizfac, sfac, bounds):
+    ''' Refines the disk size factor and flux scale factor from the grid search with a robust least-squares
+        fit of the ratio of the data to the model, keeping the size factor within bounds.
+    '''
+    from scipy.special import j1
+    from scipy.optimize import least_squares
+    good = np.isfinite(z) & np.isfinite(amp)
+    z, amp = z[good], amp[good]
+    if len(z) < 2:
+        return sizfac, sfac
+
+    def resid(p):
+        x = a * p[0] * z
+        return amp / (flux * (2 * p[1]) * np.abs(j1(x) / x)) - 1
+
+    res = least_squares(resid, [sizfac, sfac], bounds=([bounds[0], 0], [bounds[1], np.inf]), loss='soft_l1',
+                        f_scale=0.1)
+    if not res.success:
+        return sizfac, sfac
+    return res.x[0], res.x[1]
+
+
+def _pad_bands(arrays):
+    ''' Stacks 1-D arrays of different lengths into a NaN-padded 2-D array '''
+    res = np.full((len(arrays), max([1] + [len(v) for v in arrays])), np.nan)
+    for i, v in enumerate(arrays):
+        res[i, :len(v)] = v
+    return res
+
+
+def fit_disk_bands(out, bands, rstn_flux, uvfitranges, angle_tolerance=np.pi / 2, ntries=300, refine=False,
+                   maxmem=1024):
+    ''' Fits the uniform disk model to the bands in the list bands, with the corresponding uv-ranges of the fit
+        in uvfitranges.  The trial disk sizes of all bands are evaluated together in blocks of bands that fit
+        in maxmem MB.  Returns a list with a dictionary of the fit and the data points for each band.
+    '''
+    from eovsapy.util import lobe
+    from eovsapy import sun_pos
+    # Rotate uv angle for P-angle
+    pa, b0, r = sun_pos.get_pb0r(out['mjd'][0], arcsec=True)
+    uvangle = lobe(out['uvangle'] - pa * np.pi / 180.)
+    a = 2 * r * np.pi ** 2 / (180. * 3600.)  # Initial scale for z, uses photospheric radius of the Sun
+    # Models of solar disk size factor ranging from 1.0 to 1.3 r_Sun
+    solfac = np.linspace(1.0, 1.3, ntries)
+    fits = []
+    for bidx, (uvmin, uvmax) in zip(bands, uvfitranges):
+        fidx, uvdeq, ampeq, uvdpol, amppol = disk_uvdata(out, bidx, uvangle, angle_tolerance=angle_tolerance)
+        # These indexes are for a restricted uv-range to be fitted
+        ieq, = np.where(np.logical_and(uvdeq > uvmin, uvdeq <= uvmax))
+        ipol, = np.where(np.logical_and(uvdpol > uvmin, uvdpol <= uvmax))
+        fits.append({'band': bidx, 'fidx': fidx, 'fghz': out['fghz'][fidx[0]], 'flux': rstn_flux[fidx[0]],
+                     'uvdeq': uvdeq, 'ampeq': ampeq, 'uvdpol': uvdpol, 'amppol': amppol, 'ieq': ieq, 'ipol': ipol})
+
+    # the working arrays hold about 8 floats per band, trial and point
+    npts = max([1] + [len(v['ieq']) + len(v['ipol']) for v in fits])
+    nblk = int(max(1, maxmem * 2 ** 20 // (ntries * npts * 8 * 8)))
+    for i0 in range(0, len(fits), nblk):
+        blk = fits[i0:i0 + nblk]
+        d2m_eq, d2m_pol, d2m_all, sfac, sfacall = disk_model_grid(
+            [v['flux'] for v in blk], a, solfac,
+            _pad_bands([v['uvdeq'][v['ieq']] for v in blk]), _pad_bands([v['ampeq'][v['ieq']] for v in blk]),
+            _pad_bands([v['uvdpol'][v['ipol']] for v in blk]), _pad_bands([v['amppol'][v['ipol']] for v in blk]))
+        keq = np.argmin(d2m_eq, axis=1)
+        kpol = np.argmin(d2m_pol, axis=1)
+        kall = np.argmin(d2m_all, axis=1)
+        for j, v in enumerate(blk):
+            v['sizfac_eq'], v['sizfac_pol'], v['sizfac_all'] = solfac[keq[j]], solfac[kpol[j]], solfac[kall[j]]
+            v['sfactor'] = sfac[j, keq[j]]
+            v['sfall'] = sfacall[j, kall[j]]
+
+    for v in fits:
+        if refine:
+            zeq, zpol = v['uvdeq'][v['ieq']], v['uvdpol'][v['ipol']]
+            bounds = (solfac[0], solfac[-1])
+            v['sizfac_eq'], v['sfactor'] = refine_disksize(v['flux'], a, zeq, v['ampeq'][v['ieq']], v['sizfac_eq'],
+                                                           v['sfactor'], bounds)
+            v['sizfac_pol'], _ = refine_disksize(v['flux'], a, zpol, v['amppol'][v['ipol']], v['sizfac_pol'],
+                                                 v['sfactor'], bounds)
+            v['sizfac_all'], v['sfall'] = refine_disksize(v['flux'], a, np.concatenate((zeq, zpol)),
+                                                          np.concatenate((v['ampeq'][v['ieq']],
+                                                                          v['amppol'][v['ipol']])),
+                                                          v['sizfac_all'], v['sfall'], bounds)
+        v['a'] = a
+        v['eqradius'] = v['sizfac_eq'] * r
+        v['polradius'] = v['sizfac_pol'] * r
+        v['allradius'] = v['sizfac_all'] * r
+        v['sflux'] = v['sfall'] * v['flux']
+    return fits
+
+
+def fit_diskmodel(out, bidx, rstn_flux, uvfitrange=[1, 150], angle_tolerance=np.pi / 2, doplot=True, refine=False):
     ''' Given the result returned by read_ms(), plots the amplitude vs. uvdistance
         separately for polar and equatorial directions rotated for P-angle, then overplots
         a disk model for a disk enlarged by eqfac in the equatorial direction, and polfac
@@ -335,62 +482,25 @@ def fit_diskmodel(out, bidx, rstn_flux, uvfitrange=[1, 150], angle_tolerance=np.
            import rstn
            frq, flux = rstn.rd_rstnflux(t=Time('2019-09-01'))
            rstn_flux = rstn.rstn2ant(frq, flux, out['fghz']*1000, t=Time('2019-09-01'))
+        The disk sizes are searched on a grid of 300 size factors, optionally refined with a least-squares fit
+        if refine is True.
     '''
-    from eovsapy.util import bl2ord, lobe
     import matplotlib.pylab as plt
-    from eovsapy import sun_pos
     from scipy.special import j1
-    import scipy.constants
-    mperns = scipy.constants.c / 1e9  # speed of light in m/ns
-    # Rotate uv angle for P-angle
-    pa, b0, r = sun_pos.get_pb0r(out['mjd'][0], arcsec=True)
-    uvangle = lobe(out['uvangle'] - pa * np.pi / 180.)
-    a = 2 * r * np.pi ** 2 / (180. * 3600.)  # Initial scale for z, uses photospheric radius of the Sun
-    if doplot: f, ax = plt.subplots(3, 1)
-    uvmin, uvmax = uvfitrange
-    uvdeq = []
-    uvdpol = []
-    ampeq = []
-    amppol = []
-    zeq = []
-    zpol = []
-    # Loop over antennas 1-4
-    antmax = 7
-    at = angle_tolerance
-    for i in range(4):
-        fidx, = np.where(out['band'] == bidx)  # Array of frequency indexes for channels in this band
-        for j, fi in enumerate(fidx):
-            amp = out['amp'][0, fi, bl2ord[i, i + 1:antmax]].flatten() / 10000.  # Convert to sfu
-            # Use only non-zero amplitudes
-            good, = np.where(amp != 0)
-            amp = amp[good]
-            uva = uvangle[bl2ord[i, i + 1:antmax]].flatten()[good]
-            # Equatorial points are within +/- pi/8 of solar equator
-            eq, = np.where(np.logical_or(np.abs(uva) < at / 2, np.abs(uva) >= np.pi - at / 2))
-            # Polar points are within +/- pi/8 of solar pole
-            pol, = np.where(np.logical_and(np.abs(uva) >= np.pi / 2 - at / 2, np.abs(uva) < np.pi / 2 + at / 2))
-            uvd = out['uvdist'][bl2ord[i, i + 1:antmax]].flatten()[good] * out['fghz'][fi] / mperns  # Wavelengths
-            # Add data for this set of baselines to global arrays
-            uvdeq.append(uvd[eq])
-            uvdpol.append(uvd[pol])
-            ampeq.append(amp[eq])
-            amppol.append(amp[pol])
-            zeq.append(uvd[eq])
-            zpol.append(uvd[pol])
-    uvdeq = np.concatenate(uvdeq)
-    uvdpol = np.concatenate(uvdpol)
-    uvdall = np.concatenate((uvdeq, uvdpol))
-    ampeq = np.concatenate(ampeq)
-    amppol = np.concatenate(amppol)
-    ampall = np.concatenate((ampeq, amppol))
-    zeq = np.concatenate(zeq)
-    zpol = np.concatenate(zpol)
-    zall = np.concatenate((zeq, zpol))
-    # These indexes are for a restricted uv-range to be fitted
-    ieq, = np.where(np.logical_and(uvdeq > uvmin, uvdeq <= uvmax))
-    ipol, = np.where(np.logical_and(uvdpol > uvmin, uvdpol <= uvmax))
-    iall, = np.where(np.logical_and(uvdall > uvmin, uvdall <= uvmax))
+    v, = fit_disk_bands(out, [bidx], rstn_flux, [uvfitrange], angle_tolerance=angle_tolerance, refine=refine)
+    fidx = v['fidx']
+    eqradius, polradius, allradius = v['eqradius'], v['polradius'], v['allradius']
+    sfactor = v['sfactor']
+    sfall = v['sfall']
+    sflux = v['sflux']
     if doplot:
+        a = v['a']
+        uvdeq, ampeq, ieq = v['uvdeq'], v['ampeq'], v['ieq']
+        uvdpol, amppol, ipol = v['uvdpol'], v['amppol'], v['ipol']
+        uvdall = np.concatenate((uvdeq, uvdpol))
+        ampall = np.concatenate((ampeq, amppol))
+        iall = np.concatenate((ieq, ipol + len(uvdeq)))
+        f, ax = plt.subplots(3, 1)
         # Plot all of the data points
         ax[0].plot(uvdeq, ampeq, 'k+')
         ax[1].plot(uvdpol, amppol, 'k+')
@@ -399,49 +509,16 @@ def fit_diskmodel(out, bidx, rstn_flux, uvfitrange=[1, 150], angle_tolerance=np.
         ax[0].plot(uvdeq[ieq], ampeq[ieq], 'b+')
         ax[1].plot(uvdpol[ipol], amppol[ipol], 'b+')
         ax[2].plot(uvdall[iall], ampall[iall], 'b+')
-    # Minimize ratio of points to model
-    ntries = 300
-    solfac = np.linspace(1.0, 1.3, ntries)
-    d2m_eq = np.zeros(ntries, float)
-    d2m_pol = np.zeros(ntries, float)
-    d2m_all = np.zeros(ntries, float)
-    sfac = np.zeros(ntries, float)
-    sfacall = np.zeros(ntries, float)
-    # Loop over ntries (300) models of solar disk size factor ranging from 1.0 to 1.3 r_Sun
-    for k, sizfac in enumerate(solfac):
-        eqpts = rstn_flux[fidx][0] * 2 * np.abs(j1(a * sizfac * zeq[ieq]) / (a * sizfac * zeq[ieq]))
-        polpts = rstn_flux[fidx[0]] * 2 * np.abs(j1(a * sizfac * zpol[ipol]) / (a * sizfac * zpol[ipol]))
-        sfac[k] = (np.nanmedian(ampeq[ieq] / eqpts) + np.nanmedian(amppol[ipol] / polpts)) / 2
-        eqpts = rstn_flux[fidx[0]] * (2 * sfac[k]) * np.abs(j1(a * sizfac * zeq[ieq]) / (a * sizfac * zeq[ieq]))
-        polpts = rstn_flux[fidx[0]] * (2 * sfac[k]) * np.abs(j1(a * sizfac * zpol[ipol]) / (a * sizfac * zpol[ipol]))
-        allpts = rstn_flux[fidx[0]] * (2 * sfac[k]) * np.abs(j1(a * sizfac * zall[iall]) / (a * sizfac * zall[iall]))
-        sfacall[k] = np.nanmedian(ampall[iall] / allpts)
-        d2m_eq[k] = np.nanmedian(abs(ampeq[ieq] / eqpts - 1))
-        d2m_pol[k] = np.nanmedian(abs(amppol[ipol] / polpts - 1))
-        d2m_all[k] = np.nanmedian(abs(ampall[iall] / allpts - 1))
-    keq = np.argmin(d2m_eq)
-    kpol = np.argmin(d2m_pol)
-    kall = np.argmin(d2m_all)
-    eqradius = solfac[keq] * r
-    polradius = solfac[kpol] * r
-    allradius = solfac[kall] * r
-    sfactor = sfac[keq]
-    sfall = sfacall[kall]
-    sflux = sfall * rstn_flux[fidx[0]]
-    if doplot:
         z = np.linspace(1.0, 1000.0, 10000)
         # Overplot the best fit
-        ax[0].plot(z, rstn_flux[fidx[0]] * (2 * sfactor) * np.abs(j1(a * solfac[keq] * z) / (a * solfac[keq] * z)))
-        ax[1].plot(z, rstn_flux[fidx[0]] * (2 * sfactor) * np.abs(j1(a * solfac[kpol] * z) / (a * solfac[kpol] * z)))
-        ax[2].plot(z, rstn_flux[fidx[0]] * (2 * sfall) * np.abs(j1(a * solfac[kall] * z) / (a * solfac[kall] * z)))
-        # ax[1].plot(zpol,polpts,'y.')
+        ax[0].plot(z, rstn_flux[fidx[0]] * (2 * sfactor) * np.abs(j1(a * v['sizfac_eq'] * z) / (a * v['sizfac_eq'] * z)))
+        ax[1].plot(z, rstn_flux[fidx[0]] * (2 * sfactor) * np.abs(
+            j1(a * v['sizfac_pol'] * z) / (a * v['sizfac_pol'] * z)))
+        ax[2].plot(z, rstn_flux[fidx[0]] * (2 * sfall) * np.abs(
+            j1(a * v['sizfac_all'] * z) / (a * v['sizfac_all'] * z)))
         ax[0].set_title(
             str(out['fghz'][fidx][0])[:4] + 'GHz. R_eq:' + str(eqradius)[:6] + '". R_pol' + str(polradius)[:6]
             + '". R_all' + str(allradius)[:6] + '". Flux scl fac:' + str(sfall)[:4])
-        # ax[0].plot(uvdeq,ampeq/eqpts,'k+')
-        # ax[0].plot([0,1000],np.array([1,1])*np.nanmedian(ampeq/eqpts))
-        # ax[1].plot(uvdpol,amppol/polpts,'k+')
-        # ax[1].plot([0,1000],np.array([1,1])*np.nanmedian(amppol/polpts))
         for i in range(3):
             ax[i].set_xlim(0, 1000)
             ax[i].set_ylim(0.01, rstn_flux[fidx[0]] * 2 * sfactor)
@@ -452,35 +529,23 @@ def fit_diskmodel(out, bidx, rstn_flux, uvfitrange=[1, 150], angle_tolerance=np.
     return bidx, out['fghz'][fidx[0]], eqradius, polradius, allradius, sfall, sflux
 
 
-def fit_vs_freq(out):
+def fit_vs_freq(out, refine=False):
     import matplotlib.pylab as plt
     from eovsapy import rstn
     from astropy.time import Time
     t = Time(out['mjd'][0], format='mjd')
     frq, flux = rstn.rd_rstnflux(t=t)
     rstn_flux = rstn.rstn2ant(frq, flux, out['fghz'] * 1000, t=t)
-    band = []
-    fghz = []
-    eqrad = []
-    polrad = []
-    allrad = []
-    sfac = []
-    sflux = []
-    for i in range(50):
-        uvfitrange = np.array([10, 150]) + np.array([1, 18]) * i
-        a, b, c, d, e, f, g = fit_diskmodel(out, i, rstn_flux, uvfitrange=uvfitrange, angle_tolerance=np.pi / 2,
-                                            doplot=False)
-        band.append(a)
-        fghz.append(b)
-        eqrad.append(c)
-        polrad.append(d)
-        allrad.append(e)
-        sfac.append(f)
-        sflux.append(g)
-        if (i % 10) == 0: print(i)
-    result = {'band': np.array(band), 'fghz': np.array(fghz), 'eqradius': np.array(eqrad),
-              'polradius': np.array(polrad),
-              'radius': np.array(allrad), 'flux_correction_factor': np.array(sfac), 'disk_flux': np.array(sflux) * 2.}
+    bands = list(range(50))
+    uvfitranges = [np.array([10, 150]) + np.array([1, 18]) * i for i in bands]
+    # all the bands are fitted together
+    fits = fit_disk_bands(out, bands, rstn_flux, uvfitranges, angle_tolerance=np.pi / 2, refine=refine)
+    result = {'band': np.array([v['band'] for v in fits]), 'fghz': np.array([v['fghz'] for v in fits]),
+              'eqradius': np.array([v['eqradius'] for v in fits]),
+              'polradius': np.array([v['polradius'] for v in fits]),
+              'radius': np.array([v['allradius'] for v in fits]),
+              'flux_correction_factor': np.array([v['sfall'] for v in fits]),
+              'disk_flux': np.array([v['sflux'] for v in fits]) * 2.}
     plt.figure()
     plt.plot(result['fghz'], result['eqradius'], 'o', label='Equatorial Radius')
     plt.plot(result['fghz'], result['polradius'], 'o', label='Polar Radius')
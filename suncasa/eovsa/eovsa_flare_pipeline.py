@@ -18,6 +18,7 @@ from casatasks import imhead, listobs
 from casatools import image, ms, msmetadata, table
 from sunpy.time import parse_time
 
+from suncasa.utils import fof
 from suncasa.utils import helioimage2fits as hf
 from suncasa.utils import qlookplot
 
@@ -557,76 +558,84 @@ class FlareSelfCalib():
         return bpass, flag, success
 
     @staticmethod
-    def combine_groups(group, pos):
-        groups_com = []
-        deleted_groups = []
-
-        for g1 in range(len(group)):
-            if g1 in deleted_groups:
-                continue
-            for g2 in range(g1 + 1, len(group)):
-                combine = False
-                for mem1 in group[g1]:
-                    for mem2 in group[g2]:
-                        x1 = pos[1][mem1]
-                        x2 = pos[1][mem2]
-                        y1 = pos[0][mem1]
-                        y2 = pos[0][mem2]
-                        # if x1==x2 and y1==y2:
-                        if np.sqrt((x1 - x2) ** 2 + (y1 - y2) ** 2) < 3:
-                            combine = True
-                            break
-                    if combine == True:
-                        break
-                if combine == True:
-                    for mem2 in group[g2]:
-                        group[g1].append(mem2)
-                    deleted_groups.append(g2)
-                    continue
-            temp = []
-            for mem in group[g1]:
-                temp.append(mem)
-            groups_com.append(temp)
-        return groups_com
+    def read_amplitudes(visibility, spws, nrow_chunk=100000, reduce=None):
+        '''
+        Read the amplitudes of the first polarization of the given spws from the main table of the MS,
+        in chunks of rows, with the flagged data set to NaN
+        :param spws: spectral window ids
+        :param nrow_chunk: number of rows read at a time
+        :param reduce: function applied to the (nchan, nbaseline, ntime) amplitudes of each spw as soon as
+                       they are read, e.g., spw_power, so that only one spw is held in memory at a time
+        :return: a dictionary with the times (MJD seconds), the amplitudes of each spw as (nchan, nbaseline, ntime)
+                 arrays (or what reduce returns for them), and the start and end times of each scan from the
+                 SCAN_NUMBER and TIME columns
+        '''
+        nspws = FlareSelfCalib.get_spw_num(visibility)
+        descids = FlareSelfCalib.get_descids(visibility)
+        if len(descids) != nspws:
+            descids = np.arange(nspws)
+        tb.open(visibility)
+        ddids = tb.getcol('DATA_DESC_ID')
+        times = tb.getcol('TIME')
+        scans = tb.getcol('SCAN_NUMBER')
+        ant1 = tb.getcol('ANTENNA1')
+        ant2 = tb.getcol('ANTENNA2')
+        insel = np.isin(ddids, descids[spws])
+        utimes = np.unique(times[insel])
+        tidx = np.searchsorted(utimes, times)
+        bls = ant1 * (max(ant1.max(), ant2.max()) + 1) + ant2
+        ubls = np.unique(bls[insel])
+        blidx = np.searchsorted(ubls, bls)
+        amps = []
+        for sp in spws:
+            rows = np.flatnonzero(ddids == descids[sp])
+            subtb = tb.selectrows(rows)
+            amp = None
+            for r0 in range(0, len(rows), nrow_chunk):
+                nrow = min(nrow_chunk, len(rows) - r0)
+                data = np.abs(subtb.getcol('DATA', startrow=r0, nrow=nrow)[0])
+                data[subtb.getcol('FLAG', startrow=r0, nrow=nrow)[0]] = np.nan
+                if amp is None:
+                    amp = np.full((data.shape[0], len(ubls), len(utimes)), np.nan, dtype=np.float32)
+                rsel = rows[r0:r0 + nrow]
+                amp[:, blidx[rsel], tidx[rsel]] = data
+            subtb.close()
+            amps.append(amp if reduce is None else reduce(amp))
+            del amp
+        tb.close()
+        order = np.lexsort((times, scans))
+        uscans, sidx = np.unique(scans[order], return_index=True)
+        eidx = np.append(sidx[1:], len(order)) - 1
+        scan_mjd = {int(scan): (times[order][b], times[order][e]) for scan, b, e in zip(uscans, sidx, eidx)}
+        return {'time': utimes, 'amp': amps, 'scan_mjd': scan_mjd}
 
     @staticmethod
-    def gen_fof_groups(data3, thres):
-        pos = np.where(data3 > thres)
-        y = pos[0]
-        x = pos[1]
-        size = len(x)
-
-        groups = [[0]]
-        for i in range(1, size):
-            x0 = pos[1][i]
-            y0 = pos[0][i]
-            neighbour = False
-            for g in groups:
-                for mem in g:
-                    x1 = pos[1][mem]
-                    y1 = pos[0][mem]
-
-                    if np.sqrt((x1 - x0) ** 2 + (y1 - y0) ** 2) < 3:
-                        g.append(i)
-                        neighbour = True
-                        break
-                if neighbour == True:
-                    break
-            if neighbour == False:
-                groups.append([i])
-        # print("Combining groups")
-        # print(groups)
-        group_com = FlareSelfCalib.combine_groups(groups, pos)
-        # print("Groups combined")
-        final_groups_x = []
-        final_groups_y = []
-        for g1 in group_com:
-            # print (len(g1))
-            if len(g1) > 3:
-                for mem in g1:
-                    final_groups_x.append(pos[1][mem])
-                    final_groups_y.append(pos[0][mem])
-        return [final_groups_y, final_groups_x]
+    def spw_power(amp):
+        '''
+        Median over channels and baselines of the (nchan, nbaseline, ntime) amplitudes, after subtracting
+        and normalizing by their median over time
+        '''
+        #### first taking median over time
+        median = np.nanmedian(amp, axis=2, keepdims=True)
+        return np.nanmedian((amp - median) / median, axis=(0, 1))
+
+    @staticmethod
+    def longest_runs(mask):
+        '''
+        Length of the longest run of True along the last axis of a 2-d boolean array, for each row
+        '''
+        edges = np.diff(np.pad(mask, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+        rows, starts = np.nonzero(edges == 1)
+        ends = np.nonzero(edges == -1)[1]
+        longest = np.zeros(mask.shape[0], dtype=int)
+        np.maximum.at(longest, rows, ends - starts)
+        return longest
+
+    # the friends-of-friends grouping of the mask pixels does not need CASA and lives in suncasa.utils.fof
+    fof_links = staticmethod(fof.fof_links)
+    fof_labels = staticmethod(fof.fof_labels)
+    combine_groups = staticmethod(fof.combine_groups)
+    gen_fof_groups = staticmethod(fof.gen_fof_groups)
 
     def gen_mask(self, image1, image2, mask1, mask2, threshold, imsize, s,
                  make_shifted_mask=False, grow_threshold=0.5):  ### threshold corresponds to image1
@@ -871,88 +880,47 @@ class FlareSelfCalib():
         start_datetime = []
         end_datetime = []
 
-        if os.path.isfile(self.vis[:-3] + ".listobs") == False:
-            listobs(self.vis, listfile=self.vis[:-3] + ".listobs")
-
-        t = \
-            subprocess.check_output("grep Observed " + self.vis[:-3] + ".listobs", shell=True).decode(
-                'utf8').strip().split(
-                ' ')[4]
-        t = parse_time(t.replace('/', ' ')).value
-        hmy = t.split('T')[1].split(':')
-        hour = int(hmy[0])
-        minute = int(hmy[1])
-        second = int(float(hmy[2]))
-
-        # ymd = starttime.split(' ')[0].split('-')
-        # year = int(ymd[0])
-        # month = int(ymd[1])
-        # day = int(ymd[2])
-
-        # start = dt.datetime(year, month, day, hour, minute, second)
+        from scipy.ndimage import convolve1d
+
+        ## read the amplitudes of all the spws in one pass over the main table, each spw is reduced
+        ## to its power time series before the next one is read
+        msdata = FlareSelfCalib.read_amplitudes(self.vis, self.slfcal_spws, reduce=FlareSelfCalib.spw_power)
+        mjdseconds = msdata['time']
+        self.scan_mjd = msdata['scan_mjd']
+        ms_startmjd = mjdseconds[0]
+        ms_endmjd = mjdseconds[-1]
+        start = Time(ms_startmjd / 3600. / 24., format='mjd').datetime
+
+        powers = np.array(msdata['amp'])
+        del msdata
+        ## all the spws together, one row per spw
+        median_powers = np.nanmedian(powers, axis=1)
+        smootheds = convolve1d(powers, np.ones(5) / 5., axis=1, mode='constant')
+        mads = np.nanmedian(abs(powers - median_powers[:, None]), axis=1)
+        pos = np.isnan(smootheds)
+        smootheds[pos] = 0.0
+        powers[pos] = 0.0
+        thres = 5.0
+        y = (smootheds - median_powers[:, None]) / mads[:, None]
 
         peak = 0
         peak_time = 0
+        s, pos = np.unravel_index(np.argmax(np.where(np.isnan(y), -np.inf, y)), y.shape)
+        if y[s, pos] > peak:
+            peak = y[s, pos]
+            peak_time = mjdseconds[pos]
+
+        #### the longest run above threshold gives the event duration
+        durations = FlareSelfCalib.longest_runs(y > thres)
 
-        ms.open(self.vis)
-        # for sp in range(self.minimum_spw, self.maximum_spw + 1):
         for s, sp in enumerate(self.slfcal_spws):
-            print('processing spw ', sp)
-            ms.selectinit(datadescid=0, reset=True)
-            ms.selectinit(datadescid=sp)
-            data = ms.getdata(['amplitude', 'axis_info'], ifraxis=True)
-            flag = ms.getdata('flag', ifraxis=True)['flag'][0, :, :, :]
-            ms_startmjd = data['axis_info']['time_axis']['MJDseconds'][0]
-            # print('startmjd: ', startmjd)
-            if sp == self.minimum_spw:
-                start = Time(ms_startmjd / 3600. / 24., format='mjd').datetime
-            ms_endmjd = data['axis_info']['time_axis']['MJDseconds'][-1]
-            tot_data = data['amplitude'][0, :, :, :]
-            pos = np.where(flag == True)
-            tot_data[pos] = np.nan
-            #### first taking median over time
-            median = np.nanmedian(tot_data, axis=2)
-            median = np.expand_dims(median, axis=2)
-            med_subtracted_power = (tot_data - median) / median
-            power = np.nanmedian(med_subtracted_power, axis=(0, 1))
-            # power=data['amplitude'][0,3,0,:]
-            # print (data['axis_info']['time_axis'].keys())
-            median_power = np.nanmedian(power)
-            smoothed = np.convolve(power, np.ones(5), mode='same') * 1. / 5
-            peak_pow = np.nanmax(smoothed)
-            mad = np.nanmedian(abs(power - median_power))
-            pos = np.where(np.isnan(smoothed) == True)
-            smoothed[pos] = 0.0
-            power[pos] = 0.0
-            thres = 5.0
-            y = (smoothed - median_power) / mad
-            pos = np.argmax(y)
-            tot_times = np.size(y)
-            if y[pos] > peak:
-                peak = y[pos]
-                peak_time = data['axis_info']['time_axis']['MJDseconds'][pos]
-            del pos
-            pos = np.where(y > thres)[0]
+            power, smoothed, median_power, mad = powers[s], smootheds[s], median_powers[s], mads[s]
             duration = 60
-            if len(pos) == 0:
+            if durations[s] == 0:
                 found_flares.append(False)
             else:
                 found_flares.append(True)
-                temp = np.convolve(pos, np.array([1, -1]), mode='same')
-                #### Couting the number of continuous zeros in temp. This will give the event duration
-                counts = []
-                count = 1
-                for i in temp:
-                    if i == 1:
-                        count += 1
-                    else:
-                        if count != 1:
-                            counts.append(count)
-                            count = 0
-                counts.append(count)
-
-                counts.sort()
-                duration = counts[-1]
+                duration = durations[s]
                 print('flare duration is {0:d}s'.format(duration))
 
                 #### max integration time=60s#####
@@ -985,9 +953,9 @@ class FlareSelfCalib():
                 end_fine = False
 
             if (start_fine == True and end_fine == True) or (start_fine == False and end_fine == False):
-                start_time.append(data['axis_info']['time_axis']['MJDseconds'][int(max(0, peak_pos - duration / 2))])
+                start_time.append(mjdseconds[int(max(0, peak_pos - duration / 2))])
                 end_time.append(
-                    data['axis_info']['time_axis']['MJDseconds'][int(min(peak_pos + duration / 2, np.size(power) - 1))])
+                    mjdseconds[int(min(peak_pos + duration / 2, np.size(power) - 1))])
             elif start_fine == False:
                 diff = peak_pos - duration / 2 + 1
                 end_found = False
@@ -1002,8 +970,8 @@ class FlareSelfCalib():
 
                 distance = peak_pos - diff + 1
                 distance_left = duration - distance
-                start_time.append(data['axis_info']['time_axis']['MJDseconds'][int(diff)])
-                end_time.append(data['axis_info']['time_axis']['MJDseconds'][
+                start_time.append(mjdseconds[int(diff)])
+                end_time.append(mjdseconds[
                                     int(min(peak_pos + distance_left, np.size(power) - 1))])
 
             else:
@@ -1019,8 +987,8 @@ class FlareSelfCalib():
                         diff -= 1
                 distance = diff - peak_pos + 1
                 distance_left = duration - distance
-                start_time.append(data['axis_info']['time_axis']['MJDseconds'][int(max(0, peak_pos - distance_left))])
-                end_time.append(data['axis_info']['time_axis']['MJDseconds'][int(diff)])
+                start_time.append(mjdseconds[int(max(0, peak_pos - distance_left))])
+                end_time.append(mjdseconds[int(diff)])
             time_diff = start_time[-1] - ms_startmjd
             startstr = (start + dt.timedelta(seconds=time_diff)).strftime('%Y/%m/%d/%H:%M:%S')
             start_datetime.append(start + dt.timedelta(seconds=time_diff))
@@ -1029,8 +997,6 @@ class FlareSelfCalib():
             flare_times.append(startstr + '~' + endstr)
             print(sp, flare_times[-1])
             end_datetime.append(start + dt.timedelta(seconds=time_diff))
-            del tot_data, median, med_subtracted_power, power, smoothed
-        ms.close()
         # flare_peak_time = start + dt.timedelta(seconds=peak_time - startmjd)
         self.flare_time_available = True
         self.flare_times = flare_times
@@ -91,6 +91,13 @@ def log_print(level, message):
         logger.info(full_message)  # Default to INFO if an unsupported level is given
 
 
+def disk_mask(shape, rsun_pix, crpix1, crpix2):
+    """Boolean mask of the pixels within rsun_pix of (crpix1, crpix2) in an image of the given (height, width)."""
+    ny, nx = shape
+    y, x = np.ogrid[:ny, :nx]
+    return (x - crpix1) ** 2 + (y - crpix2) ** 2 <= rsun_pix ** 2
+
+
 def compute_snr(images, rsun_pix, crpix1, crpix2):
     """
     Compute the SNR for each image.
@@ -104,32 +111,131 @@ def compute_snr(images, rsun_pix, crpix1, crpix2):
     Returns:
         snrs: Array of SNR values for each image.
     """
-    ny, nx = images.shape[1], images.shape[2]
-    y, x = np.ogrid[:ny, :nx]
-    mask = (x - crpix1) ** 2 + (y - crpix2) ** 2 <= rsun_pix ** 2
-
-    snrs = []
-    # signal = np.percentile(images, 99.9995)
-    for img in images:
-        noise_region = img[~mask]  # Pixels outside the circle
-        noise = np.sqrt(np.nanmean(noise_region ** 2))  # RMS noise
-        signal = np.percentile(img, 99.9995)
-        snr = signal / noise if noise > 0 else np.nan
-        snrs.append(snr)
-    return np.array(snrs)
+    mask = disk_mask(images.shape[1:], rsun_pix, crpix1, crpix2)
+    noise_region = images[:, ~mask]  # Pixels outside the circle
+    noise = np.sqrt(np.nanmean(noise_region ** 2, axis=1))  # RMS noise
+    signal = np.percentile(np.reshape(images, (len(images), -1)), 99.9995, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        snrs = np.where(noise > 0, signal / noise, np.nan)
+    return np.asarray(snrs)
 
 
 def compute_standard_deviation(images):
     """Compute the standard deviation for each image."""
-    std_devs = [np.nanstd(img) for img in images]
-    return np.array(std_devs)
+    return np.asarray(np.nanstd(images, axis=(1, 2)))
 
 
 def compute_mean_residuals(images):
     """Compute residuals between each image and the mean image."""
     mean_image = np.nanmean(images, axis=0)
-    residuals = [np.nansum(np.abs(img - mean_image)) for img in images]
-    return np.array(residuals)
+    return np.asarray(np.nansum(np.abs(images - mean_image), axis=(1, 2)))
+
+
+def read_image_stack(fitsfiles):
+    """
+    Read the images of a list of FITS files into a stack.
+
+    Each file is opened once, memory-mapped, and its image is copied into a preallocated (n_images, height, width)
+    array, with NaNs set to 0 as in `ndfits.read`. Files without an image are skipped.
+
+    Args:
+        fitsfiles: List of FITS files.
+
+    Returns:
+        meta: Metadata of the last image read (without the reference map).
+        images: 3D array of images (n_images, height, width).
+        files: The files read, in the order of the images.
+    """
+    images = None
+    files = []
+    meta = None
+    for file in fitsfiles:
+        meta_, data_ = ndfits.read(file, lazy=True)
+        if data_ is None:
+            continue
+        try:
+            img = np.squeeze(data_[...])
+            if images is None:
+                images = np.empty((len(fitsfiles),) + img.shape, dtype=img.dtype)
+            images[len(files)] = img
+        finally:
+            data_.close()
+        files.append(file)
+        meta = meta_
+    if images is not None:
+        images = images[:len(files)]
+    return meta, images, files
+
+
+def stack_percentiles(pixels, q):
+    """
+    Percentiles q (in %) of each row of a 2D array, with linear interpolation as in `np.percentile`.
+    Rows without NaNs are partitioned once for all the percentiles; NaNs are ignored otherwise.
+
+    Returns:
+        Array of shape (n_rows, len(q)).
+    """
+    q = np.asarray(q, dtype=float)
+    if np.isnan(pixels).any():
+        return np.nanpercentile(pixels, q, axis=1).T
+    npix = pixels.shape[1]
+    idx = q / 100. * (npix - 1)
+    lo = np.floor(idx).astype(int)
+    hi = np.minimum(lo + 1, npix - 1)
+    part = np.partition(pixels, np.unique(np.concatenate((lo, hi))), axis=1)
+    vlo = part[:, lo].astype(np.float64)
+    vhi = part[:, hi].astype(np.float64)
+    return vlo + (vhi - vlo) * (idx - lo)
+
+
+def image_quality_metrics(images, rsun_pix, crpix1, crpix2):
+    """
+    Compute the quality metrics of a stack of images in one vectorized pass.
+
+    Args:
+        images: 3D array of images (n_images, height, width).
+        rsun_pix: Radius of the solar disk in pixels.
+        crpix1: X-coordinate of the disk center.
+        crpix2: Y-coordinate of the disk center.
+
+    Returns:
+        pandas.DataFrame with one row per image and the columns
+            std: standard deviation of the image.
+            mad, robust_std: median absolute deviation from the median, and the equivalent Gaussian std (1.4826 MAD).
+            residual: summed absolute residual from the mean image of the stack.
+            signal: 99.9995th percentile of the image.
+            rms_ondisk, rms_offdisk: RMS of the pixels on and off the disk.
+            mean_ondisk, mean_offdisk: mean of the pixels on and off the disk.
+            ondisk_offdisk_ratio: rms_ondisk / rms_offdisk.
+            snr: signal / rms_offdisk, NaN where rms_offdisk is 0.
+    """
+    nimg = len(images)
+    # The NaN-aware reductions are only needed if the stack has NaNs
+    if np.isnan(images).any():
+        mean, std, total = np.nanmean, np.nanstd, np.nansum
+    else:
+        mean, std, total = np.mean, np.std, np.sum
+    mask = disk_mask(images.shape[1:], rsun_pix, crpix1, crpix2)
+    pixels = np.reshape(images, (nimg, -1))
+    ondisk = images[:, mask]
+    offdisk = images[:, ~mask]
+    median, signal = stack_percentiles(pixels, [50., 99.9995]).T
+    mad = stack_percentiles(np.abs(pixels - median[:, np.newaxis].astype(pixels.dtype)), [50.])[:, 0]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rms_ondisk = np.sqrt(mean(ondisk ** 2, axis=1))
+        rms_offdisk = np.sqrt(mean(offdisk ** 2, axis=1))
+        table = pd.DataFrame({'std': std(pixels, axis=1),
+                              'mad': mad,
+                              'robust_std': 1.4826 * mad,
+                              'residual': total(np.abs(images - mean(images, axis=0)), axis=(1, 2)),
+                              'signal': signal,
+                              'rms_ondisk': rms_ondisk,
+                              'rms_offdisk': rms_offdisk,
+                              'mean_ondisk': mean(ondisk, axis=1),
+                              'mean_offdisk': mean(offdisk, axis=1),
+                              'ondisk_offdisk_ratio': rms_ondisk / rms_offdisk,
+                              'snr': np.where(rms_offdisk > 0, signal / rms_offdisk, np.nan)})
+    return table
 
 
 # def analyze_frequency(images):
@@ -142,34 +248,42 @@ def compute_mean_residuals(images):
 #     return np.array(high_freq_scores)
 
 def detect_noisy_images(data_stack, rsun_pix, crpix1, crpix2, std_threshold=2.0, residual_threshold=2.0,
-                        snr_threshold=80.0, showplt=False):
+                        snr_threshold=80.0, showplt=False, return_table=False):
+    """
+    Flag the noisy images of a stack from their standard deviation, residual from the mean image, and SNR.
+
+    The quality metrics are computed with `image_quality_metrics`. The standard deviation and residual scores are
+    normalized by the mean and standard deviation of the images with an SNR above snr_threshold (or half of it if
+    no image passes).
+
+    Returns:
+        noisy_indices: Number of the three criteria each image fails.
+        std_scores, residual_scores, snr_scores: The scores of the images.
+        table: The metrics and scores of the images as a pandas.DataFrame, if return_table is True.
+    """
     images = np.transpose(np.squeeze(data_stack), (2, 0, 1))
+    if ma.isMaskedArray(images):
+        images = images.filled(np.nan)
 
     # Compute scores
-    std_devs = compute_standard_deviation(images)
-    residuals = compute_mean_residuals(images)
-    snrs = compute_snr(images, rsun_pix, crpix1, crpix2)
-    msnrs = ma.masked_less(snrs, snr_threshold)
-    if msnrs.mask.all():
-        msnrs = ma.masked_less(snrs, snr_threshold / 2)
-    if msnrs.mask.all():
-        msnrs = ma.masked_less(snrs, snr_threshold / 2)
-    if msnrs.mask.all():
-        msnrs = ma.masked_less(snrs, snr_threshold / 2)
-    mstd_devs = ma.masked_array(std_devs, mask=msnrs.mask)
-    mresiduals = ma.masked_array(residuals, mask=msnrs.mask)
-
+    table = image_quality_metrics(images, rsun_pix, crpix1, crpix2)
+    snrs = table['snr'].to_numpy()
+    ref = ~(snrs < snr_threshold)
+    if not ref.any():
+        ref = ~(snrs < snr_threshold / 2)
 
     # Normalize scores for comparison
-    std_scores = (std_devs - np.nanmean(mstd_devs)) / np.nanstd(mstd_devs)
-    residual_scores = (residuals - np.nanmean(mresiduals)) / np.nanstd(mresiduals)
-
-    snr_scores = 1 / snrs
-
-    noisy_indices = np.vstack(
-        [std_scores > std_threshold, residual_scores > residual_threshold, snr_scores > 1 / snr_threshold])
-    print(noisy_indices.shape)
-    noisy_indices = np.sum(noisy_indices, axis=0)
+    for key in ['std', 'residual']:
+        ref_values = table[key][ref]
+        table[key + '_score'] = (table[key] - np.nanmean(ref_values)) / np.nanstd(ref_values)
+    table['snr_score'] = 1 / table['snr']
+    table['noisy'] = ((table['std_score'] > std_threshold).astype(int)
+                      + (table['residual_score'] > residual_threshold).astype(int)
+                      + (table['snr_score'] > 1 / snr_threshold).astype(int))
+    std_scores = table['std_score'].to_numpy()
+    residual_scores = table['residual_score'].to_numpy()
+    snr_scores = table['snr_score'].to_numpy()
+    noisy_indices = table['noisy'].to_numpy()
     print(noisy_indices)
 
     c = []
@@ -213,6 +327,8 @@ def detect_noisy_images(data_stack, rsun_pix, crpix1, crpix2, std_threshold=2.0,
         ax.set_ylabel('SNR Score')
         ax.legend()
 
+    if return_table:
+        return noisy_indices, std_scores, residual_scores, snr_scores, table
     return noisy_indices, std_scores, residual_scores, snr_scores
 
 
@@ -1810,9 +1926,10 @@ def merge_FITSfiles(fitsfilesin, outfits, exptime_weight=False, snr_weight=None,
     """
     Merges multiple FITS files into a single output file by calculating the mean of stacked data.
 
-    This function stacks the data from a list of input FITS files along a new axis, optionally applying exposure time
-    weighting and suppression of on-disk residuals based on a threshold relative to the disk brightness temperature.
-    The mean of the stacked data is then written to a specified output FITS file.
+    This function calculates the weighted mean of the data from a list of input FITS files, optionally applying
+    exposure time weighting and suppression of on-disk residuals based on a threshold relative to the disk brightness
+    temperature. The input files are read and accumulated one at a time, so the memory use does not grow with the number
+    of files. The mean is then written to a specified output FITS file.
 
     Parameters
     ----------
@@ -1857,61 +1974,65 @@ def merge_FITSfiles(fitsfilesin, outfits, exptime_weight=False, snr_weight=None,
     >>> merge_FITSfiles(['sun_01.fits', 'sun_02.fits', 'sun_03.fits'], 'sun_merged.fits',
     ...                 exptime_weight=False, suppress_ondiskres=True, suppress_thrshd=0.3, overwrite=True)
     """
-    data_stack = []
-    exptimes = []
-    for file in fitsfilesin:
-        meta_, data_ = ndfits.read(file)
-        if data_ is not None:
-            data = data_
-            meta = meta_
-            exptimes.append(meta['header']['EXPTIME'])
-            data_stack.append(np.squeeze(data))
-    data_stack = np.dstack(data_stack)
-    mdata_stack = ma.masked_invalid(data_stack)
     if suppress_ondiskres:
-        import copy
         from sunpy.map.maputils import all_coordinates_from_map, coordinate_is_on_solar_disk
         def sigmoid(x):
             return 1 / (1 + np.exp(-x))
 
-        mdata_stack_ = copy.deepcopy(mdata_stack)
-        tbdisk = meta['header']['tbdisk']
-        # Step 1: Identify the pixels in the range tbdisk to 1.1*tbdisk
-        threshd = suppress_thrshd  # 30% of the disk brightness temperature
-        mask = np.logical_and(mdata_stack_ >= tbdisk, mdata_stack_ <= (1 + threshd) * tbdisk)
-        # Step 2: Calculate the suppression factor
-        # Define the transition boundaries
-        lower_bound = tbdisk
-        upper_bound = (1 + threshd) * tbdisk
-        # Normalize the data to the range [0, 1]
-        normalized_data = (mdata_stack_ - lower_bound) / (upper_bound - lower_bound)
-        # Apply the sigmoid function to the normalized data
-        suppression_factor = sigmoid(10 * (normalized_data - 0.5))
-        # Step 3: Apply the suppression factor to the pixels
-        mdata_stack_[mask] *= suppression_factor[mask]
-        eomap = meta['refmap']
-        hpc_coords = all_coordinates_from_map(eomap)
-        mask_disk = (coordinate_is_on_solar_disk(hpc_coords))
-        # Expand mask_disk along the third axis to match the shape of mdata_stack
-        mask_disk_expanded = np.repeat(mask_disk[..., np.newaxis], mdata_stack.shape[2], axis=2)
-        mdata_stack[mask_disk_expanded] = mdata_stack_[mask_disk_expanded]
-
-
-    if snr_weight is not None:
-        weights = np.array(snr_weight)
-    else:
-        weights = np.ones(mdata_stack.shape[-1])
-    if exptime_weight:
-        ## use the exposure time as the weight to calculate the mean
-        weights = weights*np.array(exptimes)
-        # Adjust the weights of the first and last images by halving them to mitigate edge effects.
-        # weights[[0, -1]] /= 2
+    if deselect_index is None:
+        deselect_index = []
+    deselect_index = set(np.atleast_1d(deselect_index).tolist())
+    # The images are accumulated one at a time into the weighted sum, so that only one input image is held in memory.
+    # The weights are normalized by their total at the end.
+    data_sum = None
+    exptimes = []
+    weights = []
+    disk_masks = {}
+    meta = None
+    for file in fitsfilesin:
+        meta_, data_ = ndfits.read(file)
+        if data_ is None:
+            continue
+        meta = meta_
+        idx = len(exptimes)
+        exptimes.append(meta['header']['EXPTIME'])
+        weight = 1.0 if snr_weight is None else snr_weight[idx]
+        if exptime_weight:
+            ## use the exposure time as the weight to calculate the mean
+            weight = weight * exptimes[-1]
+        weights.append(weight)
+        data = np.squeeze(data_)
+        if data_sum is None:
+            data_sum = np.zeros(data.shape, dtype=np.float64)
+        if idx in deselect_index:
+            continue
+        if suppress_ondiskres:
+            header = meta['header']
+            # The on-disk mask depends only on the geometry of the image, and is computed once for each geometry
+            geom = (data.shape,) + tuple(header.get(k) for k in
+                                         ('CRPIX1', 'CRPIX2', 'CRVAL1', 'CRVAL2', 'CDELT1', 'CDELT2', 'RSUN_OBS'))
+            if geom not in disk_masks:
+                hpc_coords = all_coordinates_from_map(meta['refmap'])
+                disk_masks[geom] = np.asarray(coordinate_is_on_solar_disk(hpc_coords))
+            mask_disk = disk_masks[geom]
+            tbdisk = header['tbdisk']
+            # Identify the on-disk pixels in the range tbdisk to (1 + suppress_thrshd) * tbdisk
+            lower_bound = tbdisk
+            upper_bound = (1 + suppress_thrshd) * tbdisk
+            mask = mask_disk & (data >= lower_bound) & (data <= upper_bound)
+            # Normalize the data to the range [0, 1], and apply the sigmoid suppression factor to the pixels
+            normalized_data = (data[mask] - lower_bound) / (upper_bound - lower_bound)
+            data = np.array(data, dtype=np.float64)
+            data[mask] *= sigmoid(10 * (normalized_data - 0.5))
+        valid = np.isfinite(data)
+        data_sum[valid] += weight * data[valid]
+
+    weights = np.array(weights, dtype=np.float64)
+    data_stack = data_sum / np.sum(weights)
     weights = weights / np.sum(weights)
-    weights[deselect_index] = 0
+    weights[list(deselect_index)] = 0
     for w, f in zip(weights, fitsfilesin):
         log_print('INFO', f'Weight: {w:.2f} for {os.path.basename(f)}')
-    weights = weights[np.newaxis, np.newaxis, :]
-    data_stack = np.nansum(mdata_stack * weights, axis=-1)
     meta['header']['EXPTIME'] = np.nansum(exptimes)
     date_obs = Time(meta['header']['date-obs']).datetime.replace(hour=20, minute=0, second=0) - timedelta(
         seconds=meta['header']['EXPTIME'] / 2.0)
@@ -2499,22 +2620,14 @@ with open({repr(result_path)}, 'w') as result_file:
     for sidx, spw in enumerate(spws_imaging):
         spwstr = format_spw(spw)
         eofiles_rot = sorted(glob(f"{subdir}/eovsa_{date_str}T*_??min.s{spwstr}.tb.fits"))
-        data_stack = []
-        for file in eofiles_rot:
-            meta_, data_ = ndfits.read(file)
-            if data_ is not None:
-                data = data_
-                meta = meta_
-                data_stack.append(np.squeeze(data))
+        meta, images, _ = read_image_stack(eofiles_rot)
         rsun_pix = meta['header']['RSUN_OBS'] / meta['header']['CDELT1']
-        data_stack = np.dstack(data_stack)
-        mdata_stack = ma.masked_invalid(data_stack)
         # Add SNR parameters and compute SNR
         crpix1 = meta['header']['CRPIX1']
         crpix2 = meta['header']['CRPIX2']
 
         noisy_indices, std_scores, residual_scores, snr_scores = detect_noisy_images(
-            mdata_stack, rsun_pix, crpix1, crpix2, std_threshold=5.0, residual_threshold=5.0, snr_threshold=10,
+            np.moveaxis(images, 0, -1), rsun_pix, crpix1, crpix2, std_threshold=5.0, residual_threshold=5.0, snr_threshold=10,
             showplt=False)
 
         snr = 1 / snr_scores
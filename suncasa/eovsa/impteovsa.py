@@ -232,3 +232,85 @@ def creatms(idbfile, outpath, timebin=None, width=None):
     #     os.system('rm -rf {}'.format(msname))
 
     return modelms
+
+
+def mscache_dir():
+    '''Directory of the template MS cache. Set with the environment variable SUNCASA_MSCACHE_DIR.'''
+    return os.getenv('SUNCASA_MSCACHE_DIR') or os.path.join(os.path.expanduser('~'), '.suncasa', 'mscache')
+
+
+def mscache_size():
+    '''Maximum number of template MSs kept in the cache. Set with SUNCASA_MSCACHE_SIZE; 0 disables the cache.'''
+    try:
+        return int(os.getenv('SUNCASA_MSCACHE_SIZE', 10))
+    except ValueError:
+        return 10
+
+
+def mscache_key(uv, antlist, chan_band, inttime, nintegrations):
+    ''' Returns a content hash of everything the empty MS made by creatms depends on:
+        the antenna layout, the band and channel setup, the integration time (in seconds)
+        and the number of integrations.
+    '''
+    import hashlib
+    h = hashlib.sha1()
+    h.update(np.asarray(uv['antpos'], dtype=float).tobytes())
+    h.update(np.asarray(list(antlist), dtype=int).tobytes())
+    h.update(uv['telescop'].replace('\x00', '').encode())
+    for cband in chan_band:
+        h.update(str(cband['band']).encode())
+        h.update(np.asarray(cband['freq'], dtype=float).tobytes())
+        h.update(np.float64(cband['df']).tobytes())
+    h.update('{:.3f}'.format(inttime).encode())
+    h.update(str(int(nintegrations)).encode())
+    return h.hexdigest()
+
+
+def get_cached_ms(idbfile, key, cachedir=None, maxsize=None):
+    ''' Returns the path of the template MS for key in the cache, creating it with creatms on a miss.
+        The cache keeps at most maxsize entries and evicts the least recently used ones.
+        Entries are created under a temporary name and renamed into place, so parallel
+        importeovsa workers can share the cache.
+    '''
+    import shutil
+    if cachedir is None:
+        cachedir = mscache_dir()
+    if maxsize is None:
+        maxsize = mscache_size()
+    if not os.path.exists(cachedir):
+        os.makedirs(cachedir, exist_ok=True)
+    cachems = os.path.join(cachedir, key + '.ms')
+    if os.path.exists(cachems):
+        casalog.post('Using the cached template MS {}'.format(cachems))
+    else:
+        tmppath = os.path.join(cachedir, '{}.tmp{}/'.format(key, os.getpid()))
+        os.makedirs(tmppath, exist_ok=True)
+        try:
+            modelms = creatms(idbfile, tmppath)
+            os.rename(modelms, cachems)
+        except OSError:
+            # another worker has put the same template in place in the meantime
+            if not os.path.exists(cachems):
+                raise
+        finally:
+            shutil.rmtree(tmppath, ignore_errors=True)
+    # the modification time of an entry records its last use
+    os.utime(cachems, None)
+    entries = sorted([os.path.join(cachedir, l) for l in os.listdir(cachedir) if l.endswith('.ms')],
+                     key=os.path.getmtime)
+    for l in entries[:max(len(entries) - maxsize, 0)]:
+        if l != cachems:
+            shutil.rmtree(l, ignore_errors=True)
+    return cachems
+
+
+def copy_cached_ms(idbfile, msname, key, cachedir=None, maxsize=None):
+    ''' Copies the template MS for key from the cache to msname.
+        The MS is modified in place by the importer, so the table files are copied rather than hard-linked.
+    '''
+    import shutil
+    cachems = get_cached_ms(idbfile, key, cachedir=cachedir, maxsize=maxsize)
+    if os.path.exists(msname):
+        shutil.rmtree(msname)
+    shutil.copytree(cachems, msname)
+    return msname
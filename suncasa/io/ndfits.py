@@ -1,5 +1,6 @@
 import copy
 import os
+from functools import partial
 import numpy as np
 from astropy.io import fits
 from sunpy import map as smap
@@ -169,7 +170,55 @@ def get_bdinfo(freq, bw):
     return fbounds
 
 
-def read(filepath, hdus=None, verbose=False, **kwargs):
+class FitsSection(object):
+    """
+    Array-like view of the image of a fits HDU that reads only the slices that are indexed.
+    An uncompressed image is indexed on the memory-mapped data, without a copy, and a compressed image
+    through its section, which only decompresses the tiles overlapping the slice.
+
+    Parameters
+    ----------
+    hdulist : `~astropy.io.fits.HDUList`
+        The opened fits file. It is kept open until `close` is called.
+    hdu : `int` or `~astropy.io.fits.ImageHDU`
+        The image HDU, or its index in hdulist.
+    nan_value : `float` or None
+        NaNs in each slice read are replaced by this value. None to keep the NaNs.
+    """
+
+    def __init__(self, hdulist, hdu, nan_value=0.0):
+        self.hdulist = hdulist
+        self.hdu = hdulist[hdu] if isinstance(hdu, int) else hdu
+        self.nan_value = nan_value
+        self.shape = tuple(self.hdu.shape)
+        self.ndim = len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(self.hdu, fits.CompImageHDU):
+            data = self.hdu.section[key]
+        else:
+            data = self.hdu.data[key]
+        if self.nan_value is not None:
+            nans = np.isnan(data)
+            if np.any(nans):
+                data = np.where(nans, self.nan_value, data)
+        return data
+
+    def __array__(self, dtype=None, copy=None):
+        data = np.asarray(self[...])
+        return data if dtype is None else data.astype(dtype)
+
+    def close(self):
+        # drop the reference to the memory-mapped data as well, or the mmap keeps the file open
+        if 'data' in self.hdu.__dict__:
+            del self.hdu.data
+        self.hdulist.close()
+
+
+def read(filepath, hdus=None, verbose=False, lazy=False, nan_value=0.0, **kwargs):
     """
     Read a fits file.
 
@@ -181,6 +230,12 @@ def read(filepath, hdus=None, verbose=False, **kwargs):
         The HDU indexes to read from the file.
     verbose: `bool`
         if verbose
+    lazy: `bool`
+        If True, return a `FitsSection` view of the image instead of a copy of the data, and skip the reference
+        map. Only the slices that are indexed are read (and decompressed), e.g., data[0, 10] for one plane of a
+        4D cube. The file stays open until data.close() is called.
+    nan_value: `float` or None
+        Value of the NaNs in the lazy view, replaced in each slice read. None to keep the NaNs.
 
     Returns
     -------
@@ -195,13 +250,17 @@ def read(filepath, hdus=None, verbose=False, **kwargs):
     Also all comments in the original file are concatenated into a single
     "comment" key in the returned FileHeader.
     """
-    import collections
+    import collections.abc
 
-    with fits.open(filepath, ignore_blank=True) as hdulist:
+    hdulist_ = fits.open(filepath, ignore_blank=True, memmap=True)
+    hdulist = hdulist_
+    data = None
+    keep_open = False
+    try:
         if hdus is not None:
             if isinstance(hdus, int):
                 hdulist = hdulist[hdus]
-            elif isinstance(hdus, collections.Iterable):
+            elif isinstance(hdus, collections.abc.Iterable):
                 hdulist = [hdulist[i] for i in hdus]
 
         hdulist = fits.hdu.HDUList(hdulist)
@@ -211,7 +270,13 @@ def read(filepath, hdus=None, verbose=False, **kwargs):
         meta = {}
         for i, hdu in enumerate(hdulist):
             try:
-                ndim = hdu.data.ndim
+                if lazy:
+                    # the image dimensions from the header, without reading the data
+                    ndim = hdu.header['NAXIS'] if hdu.is_image else 0
+                    if ndim == 0:
+                        raise ValueError('HDU {} contains no image'.format(i))
+                else:
+                    ndim = hdu.data.ndim
                 header = hdu.header
                 slc = [slice(None)] * ndim
                 freq_axis = None
@@ -245,11 +310,15 @@ def read(filepath, hdus=None, verbose=False, **kwargs):
                     meta['pol_names'] = [stokesval['{0:d}'.format(int(p))] for p in meta['pol_idxs']]
                 if _ is not None:
                     slc[_] = slice(0, 1)
-                hdu.data[np.isnan(hdu.data)] = 0.0
-                rmap = smap.Map(np.squeeze(hdu.data[tuple(slc)]), hdu.header)
-                data = hdu.data.copy()
+                if lazy:
+                    # the section keeps the opened file, not the HDUList of the selected hdus built above
+                    data = FitsSection(hdulist_, hdu, nan_value=nan_value)
+                else:
+                    hdu.data[np.isnan(hdu.data)] = 0.0
+                    rmap = smap.Map(np.squeeze(hdu.data[tuple(slc)]), hdu.header)
+                    data = hdu.data.copy()
+                    meta['refmap'] = rmap  # this is a sunpy map of the first slice
                 meta['header'] = hdu.header.copy()
-                meta['refmap'] = rmap  # this is a sunpy map of the first slice
                 meta['naxis'] = ndim
                 meta['hgln_axis'] = ndim - 1  # solar X
                 meta['nx'] = header['NAXIS1']
@@ -270,35 +339,41 @@ def read(filepath, hdus=None, verbose=False, **kwargs):
                 meta, data = {}, None
 
         # Check if an additional frequency axis exists. If so, they should be in the last hdu.
-        if hasattr(hdulist[-1].data, 'cfreqs'):
+        # Only a table is read here, so that the image of a lazy read is not loaded.
+        tbdata = hdulist[-1].data if isinstance(hdulist[-1], fits.BinTableHDU) else None
+        if hasattr(tbdata, 'cfreqs'):
             if verbose:
                 print('FITS file contains an additional frequency axis. '
                       'Update the frequency information in cfreqs and cdelts. '
                       'Ignore the original version with equal spacings.')
-            meta['ref_cfreqs'] = np.array(hdulist[-1].data['cfreqs'])
-            meta['ref_freqdelts'] = np.array(hdulist[-1].data['cdelts'])
+            meta['ref_cfreqs'] = np.array(tbdata['cfreqs'])
+            meta['ref_freqdelts'] = np.array(tbdata['cdelts'])
 
-        if hasattr(hdulist[-1].data, 'bmaj'):
-            meta['bmaj'] = np.array(hdulist[-1].data['bmaj'])
-            meta['bmin'] = np.array(hdulist[-1].data['bmin'])
-            meta['bpa'] = np.array(hdulist[-1].data['bpa'])
+        if hasattr(tbdata, 'bmaj'):
+            meta['bmaj'] = np.array(tbdata['bmaj'])
+            meta['bmin'] = np.array(tbdata['bmin'])
+            meta['bpa'] = np.array(tbdata['bpa'])
 
-        if hasattr(hdulist[-1].data, 'cbmaj'):
-            meta['bmaj'] = np.array(hdulist[-1].data['cbmaj'])
-            meta['bmin'] = np.array(hdulist[-1].data['cbmin'])
-            meta['bpa'] = np.array(hdulist[-1].data['cbpa'])
+        if hasattr(tbdata, 'cbmaj'):
+            meta['bmaj'] = np.array(tbdata['cbmaj'])
+            meta['bmin'] = np.array(tbdata['cbmin'])
+            meta['bpa'] = np.array(tbdata['cbpa'])
 
-        if hasattr(hdulist[-1].data, 'refra_shift_x'):
-            meta['refra_shift_x'] = np.array(hdulist[-1].data['refra_shift_x'])
-            meta['refra_shift_y'] = np.array(hdulist[-1].data['refra_shift_y'])
+        if hasattr(tbdata, 'refra_shift_x'):
+            meta['refra_shift_x'] = np.array(tbdata['refra_shift_x'])
+            meta['refra_shift_y'] = np.array(tbdata['refra_shift_y'])
 
         else:
             if verbose:
                 print('FITS file does not have an additional frequency axis. '
                       'Use the original version with equal spacings.')
-        hdulist.close()
+        # a lazy read keeps the file open for the returned section only
+        keep_open = lazy and isinstance(data, FitsSection)
+    finally:
+        if not keep_open:
+            hdulist_.close()
 
-        return meta, data
+    return meta, data
 
 
 def write(fname, data, header, mask=None, fix_invalid=True, filled_value=0.0, overwrite=True, **kwargs):
@@ -430,50 +505,91 @@ def write_j2000_image(fname, data, header):
     return True
 
 
+def _wrap_header(fitsf):
+    '''
+    header of the image HDU of a single frequency fits file, None if the file does not exist
+    '''
+    if not os.path.exists(fitsf):
+        return None
+    with fits.open(fitsf) as hdu:
+        return hdu[-1].header.copy()
+
+
+def _wrap_fill(data, npol, item):
+    '''
+    copy the polarization planes of a single frequency fits file into the frequency slot of data
+    '''
+    fitsf, slot = item
+    with fits.open(fitsf) as hdu:
+        d = hdu[-1].data
+        for pidx in range(npol):
+            if d.ndim == 2:
+                data[pidx, slot, :, :] = d
+            elif d.ndim == 3:
+                data[pidx, slot, :, :] = d[pidx, :, :]
+            else:
+                data[pidx, slot, :, :] = d[pidx, 0, :, :]
+
+
+def _tile_kwargs(shape):
+    '''
+    compression tiles of one image plane, in the keyword of the installed astropy
+    '''
+    import inspect
+    tile = (1,) * (len(shape) - 2) + tuple(shape[-2:])
+    if 'tile_shape' in inspect.signature(fits.CompImageHDU).parameters:
+        return {'tile_shape': tile}
+    return {'tile_size': tile[::-1]}
+
+
 def wrap(fitsfiles, outfitsfile=None, docompress=False, mask=None, fix_invalid=True, filled_value=0.0, observatory=None,
-         imres=None, verbose=False, **kwargs):
+         imres=None, verbose=False, nthreads=None, **kwargs):
     '''
     wrap single frequency fits files into a multiple frequencies fits file
+    The files are read by a pool of nthreads threads (default: the number of cpus, at most 8), which write
+    the image planes straight into the output array. Without compression, the output array is the memory-mapped
+    data of the output file. 4D images are compressed with tiles of one (pol, freq) plane.
     '''
     from astropy.time import Time
+    from multiprocessing.pool import ThreadPool
     if len(fitsfiles) <= 1:
         print('There is only one files in the fits file list. wrap is aborted!')
         return ''
     else:
+        if nthreads is None:
+            nthreads = min(8, os.cpu_count() or 1)
+        pool = ThreadPool(max(1, nthreads))
+        fitsfiles = np.array(fitsfiles)
+        headers = pool.map(_wrap_header, fitsfiles)
         try:
-            fitsfiles = np.array(fitsfiles)
-            num_files = len(fitsfiles)
-            freqs = np.zeros(num_files)
-            for i in range(num_files):
-                head = fits.getheader(fitsfiles[i])
-                freqs[i] = head['CRVAL3']
-                del head
+            freqs = np.array([head['CRVAL3'] for head in headers])
             pos = np.argsort(freqs)
-            fitsfiles = fitsfiles[pos]
         except:
-            fitsfiles = sorted(fitsfiles)
+            pos = np.argsort(fitsfiles)
+        fitsfiles = fitsfiles[pos]
+        headers = [headers[p] for p in pos]
         nband = len(fitsfiles)
         fits_exist = []
         idx_fits_exist = []
+        headers_exist = []
         for sidx, fitsf in enumerate(fitsfiles):
-            if os.path.exists(fitsf):
+            if headers[sidx] is not None:
                 fits_exist.append(fitsf)
                 idx_fits_exist.append(sidx)
-        if len(fits_exist) == 0: raise ValueError('None of the input fitsfiles exists!')
+                headers_exist.append(headers[sidx])
+        if len(fits_exist) == 0:
+            pool.close()
+            raise ValueError('None of the input fitsfiles exists!')
         if outfitsfile is None:
-            hdu = fits.open(fits_exist[0])
             if observatory is None:
                 try:
-                    observatory = hdu[-1].header['TELESCOP']
+                    observatory = headers_exist[0]['TELESCOP']
                 except:
                     observatory = 'RADIO'
                     print('Failed to acquire telescope information. set as RADIO')
-            outfitsfile = Time(hdu[-1].header['DATE-OBS']).strftime(
+            outfitsfile = Time(headers_exist[0]['DATE-OBS']).strftime(
                 '{}.%Y%m%dT%H%M%S.%f.allbd.fits'.format(observatory))
-            hdu.close()
-        os.system('cp {} {}'.format(fits_exist[0], outfitsfile))
-        hdu0 = fits.open(outfitsfile, mode='update')
-        header = hdu0[-1].header
+        header = headers_exist[0].copy()
 
         if header['NAXIS'] != 4:
             if verbose:
@@ -493,37 +609,20 @@ def wrap(fitsfiles, outfitsfile=None, docompress=False, mask=None, fix_invalid=T
             ny = int(header['NAXIS2'])
             nx = int(header['NAXIS1'])
 
-            data = np.zeros((npol, nbd, ny, nx))
-            cfreqs = []
-            cbmaj = []
-            cbmin = []
-            cbpa = []
-            for sidx, fitsf in enumerate(fits_exist):
-                hdu = fits.open(fitsf)
-                cfreqs.append(hdu[-1].header['RESTFRQ'])
-                cbmaj.append(hdu[-1].header['BMAJ'])
-                cbmin.append(hdu[-1].header['BMIN'])
-                cbpa.append(hdu[-1].header['BPA'])
-                for pidx in range(npol):
-                    if hdu[-1].data.ndim == 2:
-                        data[pidx, idx_fits_exist[sidx], :, :] = hdu[-1].data
-                    elif hdu[-1].data.ndim == 3:
-                        data[pidx, idx_fits_exist[sidx], :, :] = hdu[-1].data[pidx, :, :]
-                    else:
-                        data[pidx, idx_fits_exist[sidx], :, :] = hdu[-1].data[pidx, 0, :, :]
-            cfreqs = np.array(cfreqs)
+            cfreqs = np.array([head['RESTFRQ'] for head in headers_exist])
+            cbmaj = np.array([head['BMAJ'] for head in headers_exist])
+            cbmin = np.array([head['BMIN'] for head in headers_exist])
+            cbpa = np.array([head['BPA'] for head in headers_exist])
             cdelts = np.array(cdelts)
-            cbmaj = np.array(cbmaj)
-            cbmin = np.array(cbmin)
-            cbpa = np.array(cbpa)
             indfreq = np.argsort(cfreqs)
             cfreqs = cfreqs[indfreq]
             cdelts = cdelts[indfreq]
             cbmaj = cbmaj[indfreq]
             cbmin = cbmin[indfreq]
             cbpa = cbpa[indfreq]
-            for pidx in range(npol):
-                data[pidx, ...] = data[pidx, indfreq]
+            # the images are placed in the order of their rest frequencies
+            slots = np.zeros(len(fits_exist), dtype=int)
+            slots[indfreq] = idx_fits_exist
 
             df = np.nanmean(np.diff(cfreqs) / np.diff(idx_fits_exist))  ## in case some of the band is missing
             header['NAXIS'] = 4
@@ -552,32 +651,12 @@ def wrap(fitsfiles, outfitsfile=None, docompress=False, mask=None, fix_invalid=T
             ny = int(header['NAXIS2'])
             nx = int(header['NAXIS1'])
 
-            data = np.zeros((npol, nbd, ny, nx))
-            cdelts = []
-            cfreqs = []
-            cbmaj = []
-            cbmin = []
-            cbpa = []
-            for sidx, fitsf in enumerate(fits_exist):
-                hdu = fits.open(fitsf)
-
-                cdelts.append(hdu[-1].header['CDELT3'])
-                cfreqs.append(hdu[-1].header['CRVAL3'])
-                cbmaj.append(hdu[-1].header['BMAJ'])
-                cbmin.append(hdu[-1].header['BMIN'])
-                cbpa.append(hdu[-1].header['BPA'])
-
-                for pidx in range(npol):
-                    if hdu[-1].data.ndim == 2:
-                        data[pidx, idx_fits_exist[sidx], :, :] = hdu[-1].data
-                    else:
-                        data[pidx, idx_fits_exist[sidx], :, :] = hdu[-1].data[pidx, 0, :, :]
-
-            cfreqs = np.array(cfreqs)
-            cdelts = np.array(cdelts)
-            cbmaj = np.array(cbmaj)
-            cbmin = np.array(cbmin)
-            cbpa = np.array(cbpa)
+            cdelts = np.array([head['CDELT3'] for head in headers_exist])
+            cfreqs = np.array([head['CRVAL3'] for head in headers_exist])
+            cbmaj = np.array([head['BMAJ'] for head in headers_exist])
+            cbmin = np.array([head['BMIN'] for head in headers_exist])
+            cbpa = np.array([head['BPA'] for head in headers_exist])
+            slots = np.array(idx_fits_exist)
 
             df = np.nanmean(np.diff(cfreqs) / np.diff(idx_fits_exist))  ## in case some of the band is missing
             header['cdelt3'] = df
@@ -593,6 +672,8 @@ def wrap(fitsfiles, outfitsfile=None, docompress=False, mask=None, fix_invalid=T
                 else:
                     header[k] = 0.0
 
+        if isinstance(outfitsfile, str):
+            outfitsfile = os.path.expanduser(outfitsfile)
         if os.path.exists(outfitsfile):
             os.system('rm -rf {}'.format(outfitsfile))
 
@@ -603,30 +684,44 @@ def wrap(fitsfiles, outfitsfile=None, docompress=False, mask=None, fix_invalid=T
         col5 = fits.Column(name='bpa', format='E', array=cbpa)
         tbhdu = fits.BinTableHDU.from_columns([col1, col2, col3, col4, col5])
 
+        shape = (npol, nbd, ny, nx)
         if docompress:
+            data = np.zeros(shape)
+            pool.map(partial(_wrap_fill, data, npol), zip(fits_exist, slots))
+            pool.close()
             if fix_invalid:
                 data[np.isnan(data)] = filled_value
             if kwargs is {}:
                 kwargs.update({'compression_type': 'RICE_1', 'quantize_level': 4.0})
-            if isinstance(outfitsfile, str):
-                outfitsfile = os.path.expanduser(outfitsfile)
 
             header, data = headersqueeze(header, data)
-            if data.ndim == 4:
-                print('only 1D, 2D, or 3D images are currently supported for compression. Aborting compression...')
+            tilekw = {}
+            if data.ndim >= 3 and 'tile_shape' not in kwargs and 'tile_size' not in kwargs:
+                # one tile per image plane, so that a single (pol, freq) plane can be decompressed on its own
+                tilekw = _tile_kwargs(data.shape)
+            hdunew = fits.CompImageHDU(data=data, header=header, **kwargs, **tilekw)
+
+            if mask is None:
+                hdulnew = fits.HDUList([fits.PrimaryHDU(), hdunew, tbhdu])
             else:
-                hdunew = fits.CompImageHDU(data=data, header=header, **kwargs)
-
-                if mask is None:
-                    hdulnew = fits.HDUList([fits.PrimaryHDU(), hdunew, tbhdu])
-                else:
-                    hdumask = fits.CompImageHDU(data=mask.astype(np.uint8), **kwargs)
-                    hdulnew = fits.HDUList([fits.PrimaryHDU(), hdunew, tbhdu, hdumask])
-                hdulnew.writeto(outfitsfile, output_verify='fix')
-                return outfitsfile
-
-        hdulnew = fits.HDUList([fits.PrimaryHDU(data=data, header=header), tbhdu])
-        hdulnew.writeto(outfitsfile)
+                hdumask = fits.CompImageHDU(data=mask.astype(np.uint8), **kwargs)
+                hdulnew = fits.HDUList([fits.PrimaryHDU(), hdunew, tbhdu, hdumask])
+            hdulnew.writeto(outfitsfile, output_verify='fix')
+            return outfitsfile
+
+        # write the header of the output file with the full data size, then fill the memory-mapped data in place
+        header = fits.PrimaryHDU(data=np.zeros((1, 1, 1, 1)), header=header).header
+        for idx, n in enumerate(shape[::-1]):
+            header['NAXIS{}'.format(idx + 1)] = n
+        header.tofile(outfitsfile)
+        nbytes = int(np.prod(shape)) * 8
+        with open(outfitsfile, 'rb+') as fobj:
+            fobj.seek(len(header.tostring()) + int(np.ceil(nbytes / 2880.)) * 2880 - 1)
+            fobj.write(b'\0')
+        with fits.open(outfitsfile, mode='update', memmap=True) as hdulnew:
+            pool.map(partial(_wrap_fill, hdulnew[0].data, npol), zip(fits_exist, slots))
+            pool.close()
+        fits.append(outfitsfile, tbhdu.data, tbhdu.header)
         print('wrapped fits written as ' + outfitsfile)
         return outfitsfile
 
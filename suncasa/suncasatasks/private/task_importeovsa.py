@@ -205,29 +205,60 @@ def importeovsa_iter(filelist, timebin, width, visprefix, nocreatms, modelms, do
     bl2ord = ipe.bl_list2(nants)
     npairs = int(nbl + nants)
 
-    timesall = []
+    # Count the time stamps on the autocorrelations only, so that the record arrays are allocated once
+    # from the header counts, npairs x npol records per time stamp, instead of stacking python lists.
+    uv.rewind()
+    uv.select('auto', 0, 0, include=True)
+    ntimes = len(set(preamble[1] for preamble, data in uv.all()))
+    uv.select('clear', -1, -1, include=True)
+    nrec = ntimes * npairs * npol
+    nchan = uv['nchan']
+    trec = np.empty(nrec, dtype=float)
+    krec = np.empty(nrec, dtype=int)
+    blrec = np.empty(nrec, dtype=int)
+    uvwrec = np.empty((nrec, 3), dtype=float)
+    datrec = np.empty((nrec, nchan), dtype=np.complex64)
+    flgrec = np.empty((nrec, nchan), dtype=bool)
+
+    # Read the file once. Keep the per-record time, polarization and baseline index and the data;
+    # the records are scattered into the (pol, chan, time, baseline) grid in one go below.
+    n = 0
     uv.rewind()
     for preamble, data in uv.all():
-        uvw, t, (i, j) = preamble
-        timesall.append(t)
-    timesjd = np.unique(timesall)
+        if n == len(trec):
+            # a time stamp without autocorrelations was not counted, make room for one more
+            trec, krec, blrec, uvwrec, datrec, flgrec = [
+                np.concatenate([a, np.empty((npairs * npol,) + a.shape[1:], dtype=a.dtype)])
+                for a in (trec, krec, blrec, uvwrec, datrec, flgrec)]
+        uvw, t, (i0, j0) = preamble
+        trec[n] = t
+        # Assumes uv['pol'] is one of -5, -6, -7, -8
+        krec[n] = -5 - uv['pol']
+        blrec[n] = bl2ord[i0, j0]
+        uvwrec[n] = uvw
+        datrec[n] = data.data
+        flgrec[n] = ma.getmaskarray(data)
+        n += 1
+    trec, krec, blrec, uvwrec, datrec, flgrec = trec[:n], krec[:n], blrec[:n], uvwrec[:n], datrec[:n], flgrec[:n]
+    flgrec |= ~np.isfinite(datrec)
+    timesjd = np.unique(trec)
     # except:
     #     pass
 
-    uv.select('clear', -1, -1, include=True)
     times = ipe.jd2mjds(np.asarray(timesjd))
     inttime = np.median((times - np.roll(times, 1))[1:]) / 60  ## time in minutes
-    inttimed = inttime / (24 * 60)  ## time in days
 
     time_steps = np.round((times[-1] - times[0]) / inttime / 60).astype(int) + 1
     # time_steps = len(timesall) / (npairs * npol)
+    tgrid = np.arange(len(times))
     if len(times) != time_steps:
         ### This is to solve the timestamp glitch in idb files.
         ### The timestamps are supposed to be evenly spaced
         ### However, some idb files may miss a few timestamps in the evenly-spaced time grid.
         ### The step will map the the data to the evenly-spaced time grid.
         timesnew = np.linspace(times[0], times[-1], time_steps)
-        timesnew[np.hstack([[0], np.cumsum(np.round(np.diff(times) / 60 / inttime))]).astype(int)] = times
+        tgrid = np.hstack([[0], np.cumsum(np.round(np.diff(times) / 60 / inttime))]).astype(int)
+        timesnew[tgrid] = times
         times = timesnew
     durtim = int(np.round((times[-1] - times[0]) / 60 + inttime))  ## time in minutes
     time0 = time.time()
@@ -238,40 +269,23 @@ def importeovsa_iter(filelist, timebin, width, visprefix, nocreatms, modelms, do
     chan_band = ipe.get_band(sfreq=sfreq, sdf=sdf, date=Time(uv['time'], format='jd'))
     nband = len(chan_band)
 
-    uv.rewind()
-    l = -1
-    for preamble, data in uv.all():
-        uvw, t, (i0, j0) = preamble
-        i = antlist.index(i0 + 1)
-        j = antlist.index(j0 + 1)
-        if i > j:
-            # Reverse order of indices
-            j = antlist.index(i0 + 1)
-            i = antlist.index(j0 + 1)
-        # Assumes uv['pol'] is one of -5, -6, -7, -8
-        k = -5 - uv['pol']
-        l += 1
-        mask0 = data.mask
-        data = ma.masked_array(ma.masked_invalid(data), fill_value=0.0)
-        try:
-            tidx = np.where(np.abs(timesjd - t) < inttimed)[0][0]
-        except:
-            tidx = l / (npairs * npol)
-        out[k, :, tidx, bl2ord[i0, j0]] = data.data
-        flag[k, :, tidx, bl2ord[i0, j0]] = np.logical_or(data.mask, mask0)
-        # if i != j:
-        if k == 3:
-            uvwarray[:, tidx, bl2ord[i0, j0]] = -uvw * constants.speed_of_light / 1e9
+    # time index of every record on the evenly-spaced grid, from the sorted unique time stamps
+    tidx = tgrid[np.searchsorted(timesjd, trec)]
+    out[krec, :, tidx, blrec] = datrec
+    flag[krec, :, tidx, blrec] = flgrec
+    k3, = np.where(krec == 3)
+    uvwarray[:, tidx[k3], blrec[k3]] = -uvwrec[k3].T * constants.speed_of_light / 1e9
+    del datrec, flgrec, uvwrec
 
     nrows = time_steps * npairs
     if doscaling:
+        # normalize every cross-correlation by the geometric mean of its two autocorrelations
         out2 = out.copy()
-        for i0 in antlist:
-            for j0 in antlist:
-                if i0 < j0:
-                    i, j = i0 - 1, j0 - 1
-                    out2[:, :, :, bl2ord[i, j]] = out[:, :, :, bl2ord[i, j]] / np.sqrt(
-                        np.abs(out[:, :, :, bl2ord[i, i]]) * np.abs(out[:, :, :, bl2ord[j, j]]))
+        ants = np.asarray(antlist) - 1
+        ai, aj = [a.ravel() for a in np.meshgrid(ants, ants, indexing='ij')]
+        ai, aj = ai[ai < aj], aj[ai < aj]
+        out2[..., bl2ord[ai, aj]] = out[..., bl2ord[ai, aj]] / np.sqrt(
+            np.abs(out[..., bl2ord[ai, ai]]) * np.abs(out[..., bl2ord[aj, aj]]))
         out2 = out2.reshape(npol, nf, nrows)
         out2[np.isnan(out2)] = 0
         out2[np.isinf(out2)] = 0
@@ -286,8 +300,15 @@ def importeovsa_iter(filelist, timebin, width, visprefix, nocreatms, modelms, do
     casalog.post('IDB File {0} is readed in --- {1:10.2f} seconds ---'.format(filename, (time.time() - time0)))
 
     if not nocreatms:
-        modelms = ipe.creatms(filename, visprefix)
-        os.system('mv {} {}'.format(modelms, msname))
+        if ipe.mscache_size() > 0:
+            # IDB files with the same setup share one empty template MS from the cache
+            mskey = ipe.mscache_key(uv, antlist, chan_band, inttime * 60, time_steps)
+            ipe.copy_cached_ms(filename, msname, mskey)
+            casalog.post('Template MS is copied to {0} in --- {1:10.2f} seconds ---'.format(msname,
+                                                                                           (time.time() - time0)))
+        else:
+            modelms = ipe.creatms(filename, visprefix)
+            os.system('mv {} {}'.format(modelms, msname))
     else:
         casalog.post('----------------------------------------')
         casalog.post('copying standard MS to {0}'.format(msname, (time.time() - time0)))
@@ -303,12 +324,10 @@ def importeovsa_iter(filelist, timebin, width, visprefix, nocreatms, modelms, do
     for l, cband in enumerate(chan_band):
         time1 = time.time()
         # nchannels = len(cband['cidx'])
-        for row in range(nrows):
-            if not doscaling or keep_nsclms:
-                datacell = out[:, cband['cidx'][0]:cband['cidx'][-1] + 1, row]
-                rownr = int(row + l * nrows)
-                tb.putcell('DATA', rownr, datacell)
-            tb.putcell('FLAG', rownr, flag[:, cband['cidx'][0]:cband['cidx'][-1] + 1, row])
+        cslc = slice(cband['cidx'][0], cband['cidx'][-1] + 1)
+        if not doscaling or keep_nsclms:
+            tb.putcol('DATA', out[:, cslc, :], l * nrows, nrows)
+        tb.putcol('FLAG', flag[:, cslc, :], l * nrows, nrows)
         casalog.post('---spw {0:02d} is updated in --- {1:10.2f} seconds ---'.format((l + 1), time.time() - time1))
     tb.putcol('UVW', uvwarray)
     tb.putcol('SIGMA', sigma)
@@ -419,9 +438,7 @@ def importeovsa_iter(filelist, timebin, width, visprefix, nocreatms, modelms, do
         casalog.post('----------------------------------------')
         for l, cband in enumerate(chan_band):
             time1 = time.time()
-            for row in range(nrows):
-                rownr = int(row + l * nrows)
-                tb.putcell('DATA', rownr, out2[:, cband['cidx'][0]:cband['cidx'][-1] + 1, row])
+            tb.putcol('DATA', out2[:, cband['cidx'][0]:cband['cidx'][-1] + 1, :], l * nrows, nrows)
             casalog.post('---spw {0:02d} is updated in --- {1:10.2f} seconds ---'.format((l + 1), time.time() - time1))
         tb.close()
 
@@ -4,6 +4,7 @@ import os, struct
 from time import time
 import multiprocessing as mprocs
 from suncasa.utils import DButil
+from suncasa.utils import imgmaxfit
 
 from ...casa_compat import import_casatools, import_casatasks
 tasks = import_casatasks('casalog')
@@ -13,6 +14,26 @@ tools = import_casatools(['iatool', 'rgtool'])
 iatool = tools['iatool']
 rgtool = tools['rgtool']
 
+def _maxfit_engine():
+    # 'numpy' (default) fits all planes of an image in one batch. 'casa' uses iatool.maxfit plane by plane
+    return os.environ.get('SUNCASA_MAXFIT_ENGINE', 'numpy').lower()
+
+
+def maxfit_iter_np(imgfiles, box, width, imidx):
+    """
+    NumPy counterpart of maxfit_iter, see suncasa.utils.imgmaxfit.maxfit_image.
+    """
+    img = imgfiles[imidx]
+    timstr = ''
+    try:
+        print('Processing image: ' + img)
+        timstr, results = imgmaxfit.maxfit_image(img, box=box, width=width)
+        return [True, timstr, img, results]
+    except Exception as instance:
+        casalog.post(str('*** Error in maxfit ***') + str(instance))
+        return [False, timstr, img, {}]
+
+
 def maxfit_iter(imgfiles, box, width, imidx):
     myia = iatool()
     myrg = rgtool()
@@ -32,7 +53,7 @@ def maxfit_iter(imgfiles, box, width, imidx):
         hdulist = pyfits.open(img)
         hdu = hdulist[0]
         hdr = pyfits.getheader(img)
-        pols = DButil.polsfromfitsheader(hdr)
+        pols = list(DButil.polsfromfitsheader(hdr))
         freqs = DButil.freqsfromfitsheader(hdr)
         ndx, ndy, nchans, npols = myia.shape()
         blc, trc = [0, 0], [ndx, ndy]
@@ -102,7 +123,10 @@ def pmaxfit(imagefiles, ncpu, box, width):
         ncpu = 8
 
     # partition
-    maxfit_part = partial(maxfit_iter, imgfiles, box, width)
+    if _maxfit_engine() == 'casa':
+        maxfit_part = partial(maxfit_iter, imgfiles, box, width)
+    else:
+        maxfit_part = partial(maxfit_iter_np, imgfiles, box, width)
 
     # parallelization
     para = 1
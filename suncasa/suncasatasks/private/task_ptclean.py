@@ -9,6 +9,7 @@ from time import time
 import glob
 import sys
 from ...utils import helioimage2fits as hf
+from .task_ptclean6 import failed_slice, run_slices, slice_names
 from ...casa_compat import import_casatools, import_casatasks
 
 tasks = import_casatasks('split', 'tclean', 'casalog')
@@ -28,7 +29,7 @@ c_external = False
 
 
 def clean_iter(tim, vis, imageprefix, imagesuffix,
-               twidth, doreg, docompress, usephacenter, reftime, ephem, msinfo, toTb, sclfactor, overwrite,
+               twidth, doreg, docompress, usephacenter, reftime, msmetafile, toTb, sclfactor, overwrite,
                selectdata, field, spw,
                uvrange, antenna, scan, observation, intent, datacolumn, imsize, cell, phasecenter, stokes,
                projection, startmodel, specmode, reffreq, nchan, start, width, outframe, veltype, restfreq,
@@ -38,30 +39,14 @@ def clean_iter(tim, vis, imageprefix, imagesuffix,
                niter, gain, threshold, nsigma, cycleniter, cyclefactor, minpsffraction, maxpsffraction, interactive,
                usemask, mask, pbmask, sidelobethreshold, noisethreshold, lownoisethreshold, negativethreshold,
                smoothfactor, minbeamfrac, cutthreshold, growiterations, dogrowprune, minpercentchange, verbose, restart,
-               savemodel, calcres, calcpsf, parallel, subregion, tmpdir, btidx):
-    bt = btidx  # 0
-    if bt + twidth < len(tim) - 1:
-        et = btidx + twidth - 1
-    else:
-        et = len(tim) - 1
-
-    if bt == 0:
-        bt_d = tim[bt] - ((tim[bt + 1] - tim[bt]) / 2)
-    else:
-        bt_d = tim[bt] - ((tim[bt] - tim[bt - 1]) / 2)
-    if et == (len(tim) - 1) or et == -1:
-        et_d = tim[et] + ((tim[et] - tim[et - 1]) / 2)
-    else:
-        et_d = tim[et] + ((tim[et + 1] - tim[et]) / 2)
-
-    timerange = qa.time(qa.quantity(bt_d, 's'), prec=9, form='ymd')[0] + '~' + \
-                qa.time(qa.quantity(et_d, 's'), prec=9, form='ymd')[0]
-    btstr = qa.time(qa.quantity(bt_d, 's'), prec=9, form='fits')[0]
-    etstr = qa.time(qa.quantity(et_d, 's'), prec=9, form='fits')[0]
+               savemodel, calcres, calcpsf, parallel, subregion, tmpdir, btidx, clearslice=False):
+    timerange, btstr, etstr, imname = slice_names(tim, imageprefix, imagesuffix, twidth, btidx)
     print('cleaning timerange: ' + timerange)
 
-    image0 = btstr.replace(':', '').replace('-', '')
-    imname = imageprefix + image0 + imagesuffix
+    if clearslice:
+        # remove the partial products (.psf, .residual, .model, .image ...) left by an earlier attempt
+        # of this slice that was interrupted, so that they are neither kept nor registered
+        os.system('rm -rf {}*'.format(imname))
 
     if overwrite or (len(glob.glob(imname + '*')) == 0):
         os.system('rm -rf {}*'.format(imname))
@@ -108,13 +93,11 @@ def clean_iter(tim, vis, imageprefix, imagesuffix,
             return [True, btstr, etstr, imname + '.fits']
         else:
             try:
-                # check if ephemfile and msinfofile exist
-                if not ephem:
-                    print("ephemeris info does not exist, querying from JPL Horizons on the fly")
-                    ephem = hf.read_horizons(vis=vis)
-                if not msinfo:
-                    print("ms info not provided, generating one on the fly")
-                    msinfo = hf.read_msinfo(vis)
+                # ephem and msinfo are loaded (read-only) from the metadata sidecar written by the parent process.
+                # They are only generated on the fly if the sidecar is missing or outdated
+                msmeta = hf.read_msmeta(vis, metafile=msmetafile)
+                ephem = msmeta['ephem']
+                msinfo = msmeta['msinfo']
                 hf.imreg(vis=vis, ephem=ephem, msinfo=msinfo, timerange=timerange, reftime=reftime,
                          imagefile=imname + '.image', fitsfile=imname + '.fits', overwrite=True,
                          toTb=toTb, sclfactor=sclfactor, usephacenter=usephacenter, subregion=subregion,
@@ -154,19 +137,14 @@ def ptclean(vis, imageprefix, imagesuffix, ncpu, twidth, doreg, usephacenter, re
         casalog.post('ncpu should be an integer')
         ncpu = 8
 
-    if doreg:
-        # check if ephem and msinfo exist. If not, generate one on the fly
-        try:
-            ephem = hf.read_horizons(vis=vis)
-        except ValueError:
-            print("error in obtaining ephemeris")
-        try:
-            msinfo = hf.read_msinfo(vis)
-        except ValueError:
-            print("error in getting ms info")
-    else:
-        ephem = None
-        msinfo = None
+    # time stamps, ephemeris and ms info are computed once and saved to a sidecar file next to the MS.
+    # Workers only receive the path of the sidecar. Later runs against an unchanged MS reuse it.
+    msmetafile = hf.msmeta_file(vis)
+    try:
+        msmeta = hf.read_msmeta(vis, metafile=msmetafile, doephem=doreg)
+    except ValueError:
+        print("error in obtaining ephemeris or ms info")
+        msmeta = hf.read_msmeta(vis, metafile=msmetafile, doephem=False)
 
     if imageprefix:
         workdir = os.path.dirname(imageprefix)
@@ -176,11 +154,7 @@ def ptclean(vis, imageprefix, imagesuffix, ncpu, twidth, doreg, usephacenter, re
     if not os.path.exists(tmpdir):
         os.makedirs(tmpdir)
     # get number of time pixels
-    ms.open(vis)
-    ms.selectinit()
-    timfreq = ms.getdata(['time', 'axis_info'], ifraxis=True)
-    tim = timfreq['time']
-    ms.close()
+    tim = msmeta['times']
 
     if twidth < 1:
         casalog.post('twidth less than 1. Change to 1')
@@ -227,10 +201,9 @@ def ptclean(vis, imageprefix, imagesuffix, ncpu, twidth, doreg, usephacenter, re
     print('Last time pixel: ' + etstr)
     print(str(len(iterable)) + ' images to clean...')
 
-    res = []
     # partition
     clnpart = partial(clean_iter, tim, vis, imageprefix, imagesuffix,
-                      twidth, doreg, docompress, usephacenter, reftime, ephem, msinfo, toTb, sclfactor, overwrite,
+                      twidth, doreg, docompress, usephacenter, reftime, msmetafile, toTb, sclfactor, overwrite,
                       selectdata,
                       field, spw,
                       uvrange, antenna, scan, observation, intent, datacolumn, imsize, cell, phasecenter, stokes,
@@ -245,31 +218,26 @@ def ptclean(vis, imageprefix, imagesuffix, ncpu, twidth, doreg, usephacenter, re
                       tmpdir)
     timelapse = 0
     t0 = time()
-    # parallelization
+    # time slices are scheduled one at a time, failed slices are retried and the progress is recorded in a manifest
     if ncpu > 1:
-        import multiprocessing as mprocs
         casalog.post('Perform clean in parallel ...')
         print('Perform clean in parallel ...')
-        pool = mprocs.Pool(ncpu)
-        res = pool.map(clnpart, iterable)
-        pool.close()
-        pool.join()
     else:
         casalog.post('Perform clean in single process ...')
         print('Perform clean in single process ...')
-        for i in iterable:
-            res.append(clnpart(i))
+    manifest = '{}ptclean{}.manifest.json'.format(imageprefix, imagesuffix)
+    slices = run_slices(clnpart, iterable, ncpu=ncpu, manifest=manifest, vis=vis, twidth=twidth, overwrite=overwrite,
+                        failslice=partial(failed_slice, tim, imageprefix, imagesuffix, twidth, doreg))
+    res = [slices[btidx] for btidx in iterable]
 
     t1 = time()
     timelapse = t1 - t0
     print('It took %f secs to complete' % timelapse)
     # repackage this into a single dictionary
-    results = {'Succeeded': [], 'BeginTime': [], 'EndTime': [], 'ImageName': []}
+    results = {'Succeeded': [], 'BeginTime': [], 'EndTime': [], 'ImageName': [], 'ElapsedTime': [], 'Attempts': []}
     for r in res:
-        results['Succeeded'].append(r[0])
-        results['BeginTime'].append(r[1])
-        results['EndTime'].append(r[2])
-        results['ImageName'].append(r[3])
+        for k in results.keys():
+            results[k].append(r[k])
 
     if os.path.exists(tmpdir):
         os.system('rm -rf ' + tmpdir)
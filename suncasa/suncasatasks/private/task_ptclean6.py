@@ -4,6 +4,7 @@ import shutil
 from functools import partial
 from time import time
 import glob
+import json
 import sys
 from ...utils import helioimage2fits as hf
 from ...casa_compat import import_casatools, import_casatasks
@@ -24,26 +25,11 @@ qa = qatool()
 c_external = False
 
 
-def clean_iter(tim, vis, imageprefix, imagesuffix,
-               twidth, doreg, docompress, usephacenter, reftime, ephem, msinfo, toTb, sclfactor, subregion, overwrite,
-               selectdata, field, spw, timerange, uvrange, antenna, scan, observation, intent, datacolumn,
-               imagename, imsize, cell, phasecenter, stokes, projection, startmodel, specmode, reffreq, nchan,
-               start,
-               width, outframe, veltype, restfreq, interpolation, perchanweightdensity, gridder, facets,
-               psfphasecenter,
-               wprojplanes, vptable, mosweight, aterm, psterm, wbawp, conjbeams, cfcache, usepointing,
-               computepastep,
-               rotatepastep, pointingoffsetsigdev, pblimit, normtype, deconvolver, scales, nterms,
-               smallscalebias,
-               restoration, restoringbeam, pbcor, outlierfile, weighting, robust, noise, npixels, uvtaper, niter,
-               gain,
-               threshold, nsigma, cycleniter, cyclefactor, minpsffraction, maxpsffraction, interactive, usemask,
-               mask,
-               pbmask, sidelobethreshold, noisethreshold, lownoisethreshold, negativethreshold, smoothfactor,
-               minbeamfrac,
-               cutthreshold, growiterations, dogrowprune, minpercentchange, verbose, fastnoise, restart,
-               savemodel,
-               calcres, calcpsf, psfcutoff, parallel, btidx):
+def slice_names(tim, imageprefix, imagesuffix, twidth, btidx):
+    '''
+    :return: the timerange, begin and end time strings and the image name (without extension)
+             of the time slice starting at the time index btidx
+    '''
     bt = btidx  # 0
     if bt + twidth < len(tim) - 1:
         et = btidx + twidth - 1
@@ -63,10 +49,48 @@ def clean_iter(tim, vis, imageprefix, imagesuffix,
                 qa.time(qa.quantity(et_d, 's'), prec=9, form='ymd')[0]
     btstr = qa.time(qa.quantity(bt_d, 's'), prec=9, form='fits')[0]
     etstr = qa.time(qa.quantity(et_d, 's'), prec=9, form='fits')[0]
-    print('cleaning timerange: ' + timerange)
 
     image0 = btstr.replace(':', '').replace('-', '')
     imname = imageprefix + image0 + imagesuffix
+    return timerange, btstr, etstr, imname
+
+
+def failed_slice(tim, imageprefix, imagesuffix, twidth, doreg, btidx):
+    '''
+    The result of a time slice that raised, timed out or whose worker died, with the same times and
+    image name as clean_iter returns, so that the slice can still be listed by the callers
+    '''
+    timerange, btstr, etstr, imname = slice_names(tim, imageprefix, imagesuffix, twidth, btidx)
+    return [False, btstr, etstr, imname + ('.fits' if doreg else '.image')]
+
+
+def clean_iter(tim, vis, imageprefix, imagesuffix,
+               twidth, doreg, docompress, usephacenter, reftime, msmetafile, toTb, sclfactor, subregion, overwrite,
+               selectdata, field, spw, timerange, uvrange, antenna, scan, observation, intent, datacolumn,
+               imagename, imsize, cell, phasecenter, stokes, projection, startmodel, specmode, reffreq, nchan,
+               start,
+               width, outframe, veltype, restfreq, interpolation, perchanweightdensity, gridder, facets,
+               psfphasecenter,
+               wprojplanes, vptable, mosweight, aterm, psterm, wbawp, conjbeams, cfcache, usepointing,
+               computepastep,
+               rotatepastep, pointingoffsetsigdev, pblimit, normtype, deconvolver, scales, nterms,
+               smallscalebias,
+               restoration, restoringbeam, pbcor, outlierfile, weighting, robust, noise, npixels, uvtaper, niter,
+               gain,
+               threshold, nsigma, cycleniter, cyclefactor, minpsffraction, maxpsffraction, interactive, usemask,
+               mask,
+               pbmask, sidelobethreshold, noisethreshold, lownoisethreshold, negativethreshold, smoothfactor,
+               minbeamfrac,
+               cutthreshold, growiterations, dogrowprune, minpercentchange, verbose, fastnoise, restart,
+               savemodel,
+               calcres, calcpsf, psfcutoff, parallel, btidx, clearslice=False):
+    timerange, btstr, etstr, imname = slice_names(tim, imageprefix, imagesuffix, twidth, btidx)
+    print('cleaning timerange: ' + timerange)
+
+    if clearslice:
+        # remove the partial products (.psf, .residual, .model, .image ...) left by an earlier attempt
+        # of this slice that was interrupted, so that they are neither kept nor registered
+        os.system('rm -rf {}*'.format(imname))
 
     if overwrite or (len(glob.glob(imname + '*')) == 0):
         os.system('rm -rf {}*'.format(imname))
@@ -113,13 +137,11 @@ def clean_iter(tim, vis, imageprefix, imagesuffix,
             return [True, btstr, etstr, imname + '.fits']
         else:
             try:
-                # check if ephemfile and msinfofile exist
-                if not ephem:
-                    print("ephemeris info does not exist, querying from JPL Horizons on the fly")
-                    ephem = hf.read_horizons(vis=vis)
-                if not msinfo:
-                    print("ms info not provided, generating one on the fly")
-                    msinfo = hf.read_msinfo(vis)
+                # ephem and msinfo are loaded (read-only) from the metadata sidecar written by the parent process.
+                # They are only generated on the fly if the sidecar is missing or outdated
+                msmeta = hf.read_msmeta(vis, metafile=msmetafile)
+                ephem = msmeta['ephem']
+                msinfo = msmeta['msinfo']
                 hf.imreg(vis=vis, ephem=ephem, msinfo=msinfo, timerange=timerange, reftime=reftime,
                          imagefile=imname + '.image', fitsfile=imname + '.fits', overwrite=True,
                          toTb=toTb, sclfactor=sclfactor, usephacenter=usephacenter, subregion=subregion,
@@ -143,6 +165,198 @@ def clean_iter(tim, vis, imageprefix, imagesuffix,
             return [False, btstr, etstr, imname + '.image']
 
 
+# per-task timeout (in seconds, 0 for no limit) and number of retries of the failed time slices.
+# Set through the environment since the task interface is generated from the xml.
+def _sched_timeout():
+    return float(os.environ.get('SUNCASA_PTCLEAN_TIMEOUT', 0))
+
+
+def _sched_maxretry():
+    return int(os.environ.get('SUNCASA_PTCLEAN_MAXRETRY', 2))
+
+
+# interval (in seconds) at which the scheduler checks for started, timed out and dead workers
+_SCHED_POLL = 1.
+
+_worker_clnpart = None
+_worker_starts = None
+_worker_pids = None
+
+
+def _init_clean_worker(clnpart, starts, pids):
+    # the bound clean_iter is handed to each worker once, rather than pickled with every task
+    global _worker_clnpart, _worker_starts, _worker_pids
+    _worker_clnpart = clnpart
+    _worker_starts = starts
+    _worker_pids = pids
+
+
+def _clean_slice(args):
+    k, btidx, clearslice = args
+    if _worker_starts is not None:
+        _worker_pids[k] = os.getpid()
+        _worker_starts[k] = time()
+    t0 = time()
+    try:
+        r = list(_worker_clnpart(btidx, clearslice=clearslice))
+    except Exception as e:
+        print('error in cleaning time slice {}: {}'.format(btidx, e))
+        r = None
+    return k, r, time() - t0
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+def _load_manifest(manifest, vis, twidth):
+    if not manifest or not os.path.exists(manifest):
+        return {}
+    try:
+        with open(manifest, 'r') as fp:
+            data = json.load(fp)
+    except ValueError:
+        return {}
+    if data.get('vis') != os.path.abspath(vis) or data.get('twidth') != twidth:
+        return {}
+    return {int(k): v for k, v in data['slices'].items()}
+
+
+def _write_manifest(manifest, vis, twidth, slices):
+    if not manifest:
+        return
+    data = {'vis': os.path.abspath(vis), 'twidth': twidth, 'slices': {str(k): v for k, v in slices.items()}}
+    with open(manifest + '.tmp', 'w') as fp:
+        json.dump(data, fp, indent=1)
+    os.rename(manifest + '.tmp', manifest)
+
+
+def run_slices(clnpart, iterable, ncpu=1, manifest=None, vis='', twidth=1, overwrite=False, timeout=None,
+               maxretry=None, failslice=None):
+    '''
+    Schedule the cleaning of time slices.
+    Slices are handed out one at a time (imap_unordered with chunksize 1), so a slow slice does not hold back
+    the others. A slice that fails, raises, runs longer than timeout or whose worker process dies is retried up
+    to maxretry times, the slices that succeeded are not imaged again. A slice is recorded in a json manifest
+    when it starts and when it ends, so that a restarted job only images the missing time slices, and only
+    clears the partial products of the slices that were started but did not succeed. Images found on disk for
+    the other slices are kept unless overwrite is set, as clean_iter does.
+
+    :param clnpart: clean_iter with everything but the starting time index bound
+    :param iterable: starting time indices of the slices
+    :param ncpu: number of worker processes
+    :param manifest: path of the progress/resume manifest. No manifest is written if None
+    :param overwrite: if True, ignore the slices recorded in an existing manifest
+    :param timeout: per-slice timeout in seconds. Default from $SUNCASA_PTCLEAN_TIMEOUT, 0 for no limit
+    :param maxretry: number of retries of the failed slices. Default from $SUNCASA_PTCLEAN_MAXRETRY (2)
+    :param failslice: function of the starting time index that gives the [False, BeginTime, EndTime, ImageName]
+                      recorded for a slice that raised, timed out or whose worker died
+    :return: a dictionary keyed by the starting time index with
+             [Succeeded, BeginTime, EndTime, ImageName, ElapsedTime, Attempts]
+    '''
+    if timeout is None:
+        timeout = _sched_timeout()
+    if maxretry is None:
+        maxretry = _sched_maxretry()
+    iterable = list(iterable)
+    slices = {} if overwrite else _load_manifest(manifest, vis, twidth)
+    done = {}
+    for btidx in iterable:
+        s = slices.get(btidx)
+        if s and s['Succeeded'] and os.path.exists(s['ImageName']):
+            done[btidx] = s
+    if done:
+        print('{} of {} time slices are found in {}. Skipping them.'.format(len(done), len(iterable), manifest))
+    # the slices recorded as started by an earlier run that did not succeed, their products are partial
+    started = set(btidx for btidx in iterable if btidx in slices and btidx not in done)
+    slices = dict(done)
+    attempts = {btidx: 0 for btidx in iterable}
+    todo = [btidx for btidx in iterable if btidx not in done]
+
+    def failed(btidx):
+        return failslice(btidx) if failslice is not None else [False, '', '', '']
+
+    def mark_started(btidx):
+        started.add(btidx)
+        r = failed(btidx)
+        slices[btidx] = {'Succeeded': False, 'BeginTime': r[1], 'EndTime': r[2], 'ImageName': r[3],
+                         'ElapsedTime': 0., 'Attempts': attempts[btidx], 'Started': True}
+        _write_manifest(manifest, vis, twidth, slices)
+
+    def record(btidx, r, elapsed):
+        if r is None:
+            r = failed(btidx)
+        attempts[btidx] += 1
+        slices[btidx] = {'Succeeded': bool(r[0]), 'BeginTime': r[1], 'EndTime': r[2], 'ImageName': r[3],
+                         'ElapsedTime': elapsed, 'Attempts': attempts[btidx]}
+        _write_manifest(manifest, vis, twidth, slices)
+
+    nround = 0
+    while todo:
+        if nround > 0:
+            print('{} time slices are not imaged. Trying to image them again.... round #{}'.format(len(todo), nround))
+        tasks = [(k, btidx, btidx in started) for k, btidx in enumerate(todo)]
+        if ncpu > 1 and len(todo) > 1:
+            import multiprocessing as mprocs
+            starts = mprocs.Array('d', len(todo), lock=False)
+            pids = mprocs.Array('i', len(todo), lock=False)
+            pool = mprocs.Pool(min(ncpu, len(todo)), initializer=_init_clean_worker,
+                               initargs=(clnpart, starts, pids))
+            try:
+                it = pool.imap_unordered(_clean_slice, tasks, chunksize=1)
+                pending = set(range(len(todo)))
+                poll = min(timeout, _SCHED_POLL) if timeout > 0 else _SCHED_POLL
+                while pending:
+                    try:
+                        k, r, elapsed = it.next(poll)
+                        pending.discard(k)
+                        record(todo[k], r, elapsed)
+                    except mprocs.TimeoutError:
+                        pass
+                    now = time()
+                    running = [k for k in pending if starts[k] > 0]
+                    for k in running:
+                        if todo[k] not in started:
+                            mark_started(todo[k])
+                    # a worker killed by the system (e.g., out of memory) is replaced by the pool, but the
+                    # result of its slice never comes back
+                    for k in running:
+                        if not _pid_alive(pids[k]):
+                            print('the worker of time slice {} died'.format(todo[k]))
+                            pending.discard(k)
+                            record(todo[k], None, now - starts[k])
+                    expired = [k for k in running if k in pending and 0 < timeout < now - starts[k]]
+                    if expired:
+                        # a hung tclean can not be interrupted from within the worker. Stop the pool,
+                        # the slices that have not finished yet are rescheduled in the next round
+                        for k in expired:
+                            print('time slice {} timed out after {:.0f} s'.format(todo[k], now - starts[k]))
+                            record(todo[k], None, now - starts[k])
+                        break
+                # the slices started but not finished when the pool is stopped are cleared before their retry
+                started.update(todo[k] for k in range(len(todo)) if starts[k] > 0)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            _init_clean_worker(clnpart, None, None)
+            for k, btidx, clearslice in tasks:
+                mark_started(btidx)
+                k, r, elapsed = _clean_slice((k, btidx, clearslice))
+                record(btidx, r, elapsed)
+        todo = [btidx for btidx in iterable if
+                not (btidx in slices and slices[btidx]['Succeeded']) and attempts[btidx] <= maxretry]
+        nround += 1
+    nfailed = len([btidx for btidx in iterable if not slices.get(btidx, {}).get('Succeeded')])
+    if nfailed:
+        print('{} time slices can not be imaged after {} retries.'.format(nfailed, maxretry))
+    return slices
+
+
 def ptclean6(vis, imageprefix, imagesuffix, ncpu, twidth, doreg, usephacenter, reftime, toTb, sclfactor, subregion,
              docompress, overwrite,
              selectdata, field, spw, timerange, uvrange, antenna, scan, observation, intent, datacolumn,
@@ -159,30 +373,21 @@ def ptclean6(vis, imageprefix, imagesuffix, ncpu, twidth, doreg, usephacenter, r
         casalog.post('ncpu should be an integer')
         ncpu = 1
 
-    if doreg:
-        # check if ephem and msinfo exist. If not, generate one on the fly
-        try:
-            ephem = hf.read_horizons(vis=vis)
-        except ValueError:
-            print("error in obtaining ephemeris")
-        try:
-            msinfo = hf.read_msinfo(vis)
-        except ValueError:
-            print("error in getting ms info")
-    else:
-        ephem = None
-        msinfo = None
+    # time stamps, ephemeris and ms info are computed once and saved to a sidecar file next to the MS.
+    # Workers only receive the path of the sidecar. Later runs against an unchanged MS reuse it.
+    msmetafile = hf.msmeta_file(vis)
+    try:
+        msmeta = hf.read_msmeta(vis, metafile=msmetafile, doephem=doreg)
+    except ValueError:
+        print("error in obtaining ephemeris or ms info")
+        msmeta = hf.read_msmeta(vis, metafile=msmetafile, doephem=False)
 
     if imageprefix:
         workdir = os.path.dirname(imageprefix)
     else:
         workdir = './'
     # get number of time pixels
-    ms.open(vis)
-    ms.selectinit()
-    timfreq = ms.getdata(['time', 'axis_info'], ifraxis=True)
-    tim = timfreq['time']
-    ms.close()
+    tim = msmeta['times']
 
     if twidth < 1:
         casalog.post('twidth less than 1. Change to 1')
@@ -230,10 +435,9 @@ def ptclean6(vis, imageprefix, imagesuffix, ncpu, twidth, doreg, usephacenter, r
     print('Last time pixel: ' + etstr)
     print(str(len(iterable)) + ' images to clean...')
 
-    res = []
     # partition
     clnpart = partial(clean_iter, tim, vis, imageprefix, imagesuffix,
-                      twidth, doreg, docompress, usephacenter, reftime, ephem, msinfo, toTb, sclfactor, subregion,
+                      twidth, doreg, docompress, usephacenter, reftime, msmetafile, toTb, sclfactor, subregion,
                       overwrite,
                       selectdata, field, spw, timerange, uvrange, antenna, scan, observation, intent, datacolumn,
                       imagename, imsize, cell, phasecenter, stokes, projection, startmodel, specmode, reffreq, nchan,
@@ -255,30 +459,25 @@ def ptclean6(vis, imageprefix, imagesuffix, ncpu, twidth, doreg, usephacenter, r
                       calcres, calcpsf, psfcutoff, parallel)
     timelapse = 0
     t0 = time()
-    # parallelization
+    # time slices are scheduled one at a time, failed slices are retried and the progress is recorded in a manifest
     if ncpu > 1:
-        import multiprocessing as mprocs
         casalog.post('Perform clean in parallel ...')
         print('Perform clean in parallel ...')
-        pool = mprocs.Pool(ncpu)
-        res = pool.map(clnpart, iterable)
-        pool.close()
-        pool.join()
     else:
         casalog.post('Perform clean in single process ...')
         print('Perform clean in single process ...')
-        for i in iterable:
-            res.append(clnpart(i))
+    manifest = '{}ptclean{}.manifest.json'.format(imageprefix, imagesuffix)
+    slices = run_slices(clnpart, iterable, ncpu=ncpu, manifest=manifest, vis=vis, twidth=twidth, overwrite=overwrite,
+                        failslice=partial(failed_slice, tim, imageprefix, imagesuffix, twidth, doreg))
+    res = [slices[btidx] for btidx in iterable]
 
     t1 = time()
     timelapse = t1 - t0
     print('It took %f secs to complete' % timelapse)
     # repackage this into a single dictionary
-    results = {'Succeeded': [], 'BeginTime': [], 'EndTime': [], 'ImageName': []}
+    results = {'Succeeded': [], 'BeginTime': [], 'EndTime': [], 'ImageName': [], 'ElapsedTime': [], 'Attempts': []}
     for r in res:
-        results['Succeeded'].append(r[0])
-        results['BeginTime'].append(r[1])
-        results['EndTime'].append(r[2])
-        results['ImageName'].append(r[3])
+        for k in results.keys():
+            results[k].append(r[k])
 
     return results
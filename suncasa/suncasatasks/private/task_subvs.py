@@ -18,6 +18,24 @@ ms_in = mstool()
 datamsmd = msmdtool()
 qa = qatool()
 
+# maximum size of the visibilities read at once, in MB
+def _chunk_mb():
+    return float(os.environ.get('SUNCASA_SUBVS_CHUNK_MB', 1024))
+
+
+def _timerange_str(times, b, e):
+    """
+    CASA time selection string that covers the time pixels times[b:e], bounded halfway to the neighbouring pixels
+    """
+    dt = np.diff(times)
+    if len(dt) == 0:
+        dt = np.array([1.0])
+    bt = times[b] - (dt[b - 1] if b > 0 else dt[0]) / 2.
+    et = times[e - 1] + (dt[e - 1] if e < len(times) else dt[-1]) / 2.
+    return qa.time(qa.quantity(bt, 's'), prec=9, form='ymd')[0] + '~' + \
+           qa.time(qa.quantity(et, 's'), prec=9, form='ymd')[0]
+
+
 def subvs(vis=None, outputvis=None, timerange='', spw='',
            mode='linear', subtime1='', subtime2='',
            smoothaxis='time', smoothtype='flat', smoothwidth='5',
@@ -151,11 +169,13 @@ def subvs(vis=None, outputvis=None, timerange='', spw='',
             print('split the selected spws and times')
             staql['spw'] = str(spi['SpectralWindowId'])
         datams.msselect(staql)
-        orec = datams.getdata(['data', 'time', 'axis_info'], ifraxis=True)
-        npol, nchan, nbl, ntim = orec['data'].shape
-        print('dimension of output data', orec['data'].shape)
-        casalog.post('Number of baselines: ' + str(nbl))
-        casalog.post('Number of spectral channels: ' + str(nchan))
+        # only the time stamps are read up front. The visibilities are read, processed and written back in
+        # time chunks so that long measurement sets fit in memory
+        touts = datams.getdata(['time'], ifraxis=True)['time']
+        ntim = len(touts)
+        nchan_max = spi['NumChan']
+        nbl_max = datamsmd.nantennas() * (datamsmd.nantennas() + 1) // 2
+        ntchunk = max(int(_chunk_mb() * 1024. ** 2 / (4 * nchan_max * nbl_max * 16)), 1)
         casalog.post('Number of time pixels: ' + str(ntim))
 
         try:
@@ -204,6 +224,8 @@ def subvs(vis=None, outputvis=None, timerange='', spw='',
                 rec1avg = np.average(rec1['data'], axis=3)
                 casalog.post('Averaging the visibilities in subtime1: ' + subtime1)
                 ms_in.close()
+                t1 = (np.amax(rec1['time']) + np.amin(rec1['time'])) / 2.
+                print('t1: ', qa.time(qa.quantity(t1, 's'), form='ymd', prec=10))
                 if subtime2 and (type(subtime2) == str):
                     ms_in.open(vis, nomodify=True)
                     # Select the spw id
@@ -221,101 +243,65 @@ def subvs(vis=None, outputvis=None, timerange='', spw='',
                     rec2avg = np.average(rec2['data'], axis=3)
                     ms_in.close()
                     casalog.post('Averaged the visibilities in subtime2: ' + subtime2)
-                if subtime1 and (not subtime2):
-                    casalog.post('Only "subtime1" is defined, subtracting background defined in subtime1: ' + subtime1)
-                    t1 = (np.amax(rec1['time']) + np.amin(rec1['time'])) / 2.
-                    print('t1: ', qa.time(qa.quantity(t1, 's'), form='ymd', prec=10))
-                    for i in range(ntim):
-                        orec['data'][:, :, :, i] -= rec1avg
-                        if reverse:
-                            orec['data'][:, :, :, i] = -orec['data'][:, :, :, i]
-                if subtime1 and subtime2 and (type(subtime2) == str):
-                    casalog.post(
-                        'Both subtime1 and subtime2 are specified, doing linear interpolation between "subtime1" and "subtime2"')
-                    t1 = (np.amax(rec1['time']) + np.amin(rec1['time'])) / 2.
                     t2 = (np.amax(rec2['time']) + np.amin(rec2['time'])) / 2.
-                    touts = orec['time']
-                    print('t1: ', qa.time(qa.quantity(t1, 's'), form='ymd', prec=10))
                     print('t2: ', qa.time(qa.quantity(t2, 's'), form='ymd', prec=10))
-                    for i in range(ntim):
-                        tout = touts[i]
-                        if tout > np.amax([t1, t2]):
-                            tout = np.amax([t1, t2])
-                        elif tout < np.amin([t1, t2]):
-                            tout = np.amin([t1, t2])
-                        orec['data'][:, :, :, i] -= (rec2avg - rec1avg) * (tout - t1) / (t2 - t1) + rec1avg
-                        if reverse:
-                            orec['data'][:, :, :, i] = -orec['data'][:, :, :, i]
-            elif mode == 'highpass':
-                if smoothtype != 'flat' and smoothtype != 'hanning' and smoothtype != 'hamming' and smoothtype != 'bartlett' and smoothtype != 'blackman':
-                    raise Exception('Unknown smoothtype ' + str(smoothtype))
-                if smoothaxis == 'time':
-                    if smoothwidth <= 0 or smoothwidth >= ntim:
-                        raise Exception('Specified smooth width is <=0 or >= the total number of ' + smoothaxis)
-                    else:
-                        for i in range(orec['data'].shape[0]):
-                            for j in range(nchan):
-                                for k in range(nbl):
-                                    orec['data'][i, j, k, :] -= su.smooth(orec['data'][i, j, k, :],
-                                                                          smoothwidth,
-                                                                          smoothtype)
-                if smoothaxis == 'freq':
-                    if smoothwidth <= 0 or smoothwidth >= nchan:
-                        raise Exception('Specified smooth width is <=0 or >= the total number of ' + smoothaxis)
-                    else:
-                        for i in range(orec['data'].shape[0]):
-                            for j in range(nbl):
-                                for k in range(ntim):
-                                    orec['data'][i, :, j, k] -= su.smooth(orec['data'][i, :, j, k],
-                                                                          smoothwidth,
-                                                                          smoothtype)
-            elif mode == 'lowpass':
-                if smoothtype != 'flat' and smoothtype != 'hanning' and smoothtype != 'hamming' and smoothtype != 'bartlett' and smoothtype != 'blackman':
+                    casalog.post(
+                        'Both subtime1 and subtime2 are specified, doing linear interpolation between "subtime1" and "subtime2"')
+                else:
+                    casalog.post('Only "subtime1" is defined, subtracting background defined in subtime1: ' + subtime1)
+            elif mode in ['highpass', 'lowpass']:
+                if smoothtype not in ['flat', 'hanning', 'hamming', 'bartlett', 'blackman']:
                     raise Exception('Unknown smoothtype ' + str(smoothtype))
-                if smoothaxis == 'time':
-                    if smoothwidth <= 0 or smoothwidth >= ntim:
+                if smoothaxis == 'time' and (smoothwidth <= 0 or smoothwidth >= ntim):
+                    raise Exception('Specified smooth width is <=0 or >= the total number of ' + smoothaxis)
+            else:
+                raise Exception('Unknown mode' + str(mode))
+
+            # smoothing along time needs a margin of neighbouring time pixels on both sides of each chunk
+            if mode in ['highpass', 'lowpass'] and smoothaxis == 'time':
+                halo = int(smoothwidth)
+            else:
+                halo = 0
+            for c0 in range(0, ntim, ntchunk):
+                c1 = min(c0 + ntchunk, ntim)
+                b0, b1 = max(c0 - halo, 0), min(c1 + halo, ntim)
+                datams.selectinit(reset=True)
+                datams.msselect(dict(staql, time=_timerange_str(touts, b0, b1)))
+                orec = datams.getdata(['data'], ifraxis=True)
+                data = orec['data']
+                if data.shape[-1] != b1 - b0:
+                    raise Exception('Time chunk {}~{} selected {} time pixels, expected {}'.format(
+                        b0, b1, data.shape[-1], b1 - b0))
+                if c0 == 0:
+                    npol, nchan, nbl = data.shape[:3]
+                    print('dimension of output data', (npol, nchan, nbl, ntim))
+                    casalog.post('Number of baselines: ' + str(nbl))
+                    casalog.post('Number of spectral channels: ' + str(nchan))
+                    if mode != 'linear' and smoothaxis == 'freq' and (smoothwidth <= 0 or smoothwidth >= nchan):
                         raise Exception('Specified smooth width is <=0 or >= the total number of ' + smoothaxis)
+
+                if mode == 'linear':
+                    if subtime2 and (type(subtime2) == str):
+                        tout = np.clip(touts[b0:b1], min(t1, t2), max(t1, t2))
+                        data -= (rec2avg - rec1avg)[..., None] * ((tout - t1) / (t2 - t1)) + rec1avg[..., None]
                     else:
-                        for i in range(orec['data'].shape[0]):
-                            for j in range(nchan):
-                                for k in range(nbl):
-                                    orec['data'][i, j, k, :] = su.smooth(orec['data'][i, j, k, :],
-                                                                         smoothwidth,
-                                                                         smoothtype)
-                if smoothaxis == 'freq':
-                    if smoothwidth <= 0 or smoothwidth >= nchan:
-                        raise Exception('Specified smooth width is <=0 or >= the total number of ' + smoothaxis)
+                        data -= rec1avg[..., None]
+                    if reverse:
+                        data = -data
+                else:
+                    axis = 3 if smoothaxis == 'time' else 1
+                    if mode == 'highpass':
+                        data -= su.smooth_nd(data, smoothwidth, smoothtype, axis=axis)
                     else:
-                        for i in range(orec['data'].shape[0]):
-                            for j in range(nbl):
-                                for k in range(ntim):
-                                    orec['data'][i, :, j, k] = su.smooth(orec['data'][i, :, j, k],
-                                                                         smoothwidth,
-                                                                         smoothtype)
-            else:
-                raise Exception('Unknown mode' + str(mode))
+                        data = su.smooth_nd(data, smoothwidth, smoothtype, axis=axis)
+
+                # put the modified data back into the output visibility set
+                if (b0, b1) != (c0, c1):
+                    datams.selectinit(reset=True)
+                    datams.msselect(dict(staql, time=_timerange_str(touts, c0, c1)))
+                    datams.getdata(['time'], ifraxis=True)
+                datams.putdata({'data': data[..., c0 - b0:c1 - b0]})
         except Exception as instance:
             print('*** Error ***', instance)
-
-        # orec['data']=orec['data'].reshape(szo[0],szo[1],szo[2],szo[3],order='F')
-        # put the modified data back into the output visibility set
-        del orec['time']
-        del orec['axis_info']
-        # ms_in.open(outputvis,nomodify=False)
-        # if not splitsel:
-        # outputvis is identical to input visibility, do the selection
-        #    if timerange and (type(timerange==str)):
-        #        datams.msselect({'time':timerange})
-        #    if spw and (type(spw)==str):
-        #        datams.selectinit(datadescid=int(spwid))
-        #        nchan=int(echan)-int(bchan)+1
-        #        datams.selectchannel(nchan,int(bchan),1,1)
-        #    if not spw and not timerange:
-        # data selection is not made
-        #        datams.selectinit(datadescid=0)
-        # else:
-        # outputvis is splitted, selections have already applied, select all the data
-        #    datams.selectinit(datadescid=0)
-        datams.putdata(orec)
     datams.close()
     datamsmd.done()
@@ -1560,7 +1560,7 @@ def transfitdict2DF(datain, gaussfit=True, getcentroid=False):
                     dspecDF = dspecDFlist[0]
                 else:
                     dspecDF = pd.merge(dspecDF.copy(), DFit, how='outer', on=['freqstr', 'fits_local'])
-            dspecDF0 = dspecDF0.append(dspecDF, ignore_index=True)
+            dspecDF0 = pd.concat([dspecDF0, dspecDF], ignore_index=True)
 
     return dspecDF0
 
@@ -1897,30 +1897,91 @@ def c_correlateX(a, v, returnx=False, returnav=False, s=0):
         return np.correlate(a_, v_, mode='same')
 
 
+def c_correlate_batch(a, v=None, subsample=True, blocksize=None):
+    '''
+    Cross correlation of many pairs of signals at once, with the normalisation of c_correlate.
+    Every row of a is correlated with every row of v through one zero-padded FFT along the last axis.
+    The lag of the correlation peak is refined by parabolic sub-sample interpolation.
+    :param a: 2-D array of shape (na, n)
+    :param v: 2-D array of shape (nv, n). If None, the rows of a are correlated with each other, and only
+            one half of the pairs is computed
+    :param subsample: if True, refine the lag and the value of the correlation peak by parabolic interpolation
+    :param blocksize: number of rows of a correlated at once. Default to a block of about 256 MB
+    :return: ccmax, cclag, both of shape (na, nv). cclag is in pixels, positive if the row of a lags behind
+            the row of v, i.e., the same as np.argmax(c_correlate(a, v)) - n // 2 without sub-sample refinement.
+    '''
+    a = np.atleast_2d(np.asarray(a, dtype=np.float64))
+    symmetric = v is None
+    v = a if symmetric else np.atleast_2d(np.asarray(v, dtype=np.float64))
+    n = a.shape[-1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        a_ = (a - np.mean(a, axis=-1, keepdims=True)) / (np.std(a, axis=-1, keepdims=True) * n)
+        v_ = (v - np.mean(v, axis=-1, keepdims=True)) / np.std(v, axis=-1, keepdims=True)
+    a_[~np.isfinite(a_)] = 0
+    v_[~np.isfinite(v_)] = 0
+    # zero-pad to avoid the wrap-around of the circular correlation
+    nfft = int(2 ** np.ceil(np.log2(2 * n - 1)))
+    fa = np.fft.rfft(a_, nfft)
+    # the phase ramp shifts the lags covered by np.correlate(mode='same'), -(n // 2) ... n - n // 2 - 1,
+    # to the first n samples of the inverse transform
+    lag0 = n // 2
+    fv = np.conj(np.fft.rfft(v_, nfft)) * np.exp(-2j * np.pi * np.arange(nfft // 2 + 1) * lag0 / nfft)
+    na, nv = a.shape[0], v.shape[0]
+    if blocksize is None:
+        blocksize = max(int(2 ** 28 / (8 * nv * nfft)), 1)
+    ccmax = np.zeros((na, nv))
+    cclag = np.zeros((na, nv))
+    for b0 in range(0, na, blocksize):
+        b1 = min(b0 + blocksize, na)
+        # for the correlation of a with itself, only the pairs below the diagonal are computed
+        nv_ = b1 if symmetric else nv
+        cc = np.fft.irfft(fa[b0:b1, None, :] * fv[None, :nv_, :], nfft)[..., :n]
+        ipk = np.argmax(cc, axis=-1)[..., None]
+        c0 = np.take_along_axis(cc, ipk, axis=-1)[..., 0]
+        delta = np.zeros_like(c0)
+        if subsample and n > 2:
+            cm1 = np.take_along_axis(cc, np.clip(ipk - 1, 0, n - 1), axis=-1)[..., 0]
+            cp1 = np.take_along_axis(cc, np.clip(ipk + 1, 0, n - 1), axis=-1)[..., 0]
+            denom = cm1 - 2 * c0 + cp1
+            inner = (ipk[..., 0] > 0) & (ipk[..., 0] < n - 1) & (denom < 0)
+            delta[inner] = 0.5 * (cm1 - cp1)[inner] / denom[inner]
+            c0 = c0 - 0.25 * (cm1 - cp1) * delta
+        ccmax[b0:b1, :nv_] = c0
+        cclag[b0:b1, :nv_] = ipk[..., 0] - lag0 + delta
+    if symmetric:
+        il = np.tril_indices(na, -1)
+        ccmax.T[il] = ccmax[il]
+        cclag.T[il] = -cclag[il]
+    return ccmax, cclag
+
+
 def XCorrMap(z, x, y, doxscale=True):
     '''
     get the cross correlation map along y axis
     :param z: data
     :param x: x axis
     :param y: y axis
+    :param doxscale: if True, the lags are refined to sub-pixel precision and given in pixels of xfit,
+            a 10 times finer grid of x. Otherwise in pixels of x.
     :return:
     '''
-    from tqdm import tqdm
-    from scipy.interpolate import splev, splrep
+    y = np.asarray(y)
+    ny, nx = z.shape
     if doxscale:
         xfit = np.linspace(x[0], x[-1], 10 * len(x) + 1)
-        zfit = np.zeros((len(y), len(xfit)))
-        for yidx1, yq in enumerate(y):
-            xx = x
-            yy = z[yidx1, :]
-            s = len(yy)  # (len(yy) - np.sqrt(2 * len(yy)))*2
-            tck = splrep(xx, yy, s=s)
-            ys = splev(xfit, tck)
-            zfit[yidx1, :] = ys
     else:
         xfit = x
-        zfit = z
-    ny, nxfit = zfit.shape
+    nxfit = len(xfit)
+    # all pairs of rows are correlated in one batch, the lag peaks are located by parabolic interpolation
+    # rather than by correlating the 10 times spline-upsampled rows
+    cm, lag = c_correlate_batch(z, subsample=doxscale)
+    cpeak = lag * (nxfit - 1.) / (nx - 1.) + (nxfit // 2 - (nxfit - 1) / 2.)
+    empty = np.sum(z, axis=1) == 0
+    idx1, idx2 = np.tril_indices(ny, -1)
+    valid = ~(empty[idx1] | empty[idx2])
+    cmax = np.where(valid, cm[idx1, idx2], 0)
+    cpeak = np.where(valid, cpeak[idx1, idx2], 0)
+
     ccpeak = np.empty((ny - 1, ny - 1))
     ccpeak[:] = np.nan
     ccmax = ccpeak.copy()
@@ -1928,32 +1989,22 @@ def XCorrMap(z, x, y, doxscale=True):
     yv = ccpeak.copy()
     yidxa = ccpeak.copy()
     yidxv = ccpeak.copy()
-    for idx1 in tqdm(range(1, ny)):
-        for idx2 in range(0, idx1):
-            lightcurve1 = zfit[idx1, :]
-            lightcurve2 = zfit[idx2, :]
-            ccval = c_correlate(lightcurve1, lightcurve2)
-            if sum(lightcurve1) != 0 and sum(lightcurve2) != 0:
-                cmax = np.amax(ccval)
-                cpeak = np.argmax(ccval) - (nxfit - 1) / 2
-            else:
-                cmax = 0
-                cpeak = 0
-            ccmax[idx2, idx1 - 1] = cmax
-            ccpeak[idx2, idx1 - 1] = cpeak
-            ya[idx2, idx1 - 1] = y[idx1 - 1]
-            yv[idx2, idx1 - 1] = y[idx2]
-            yidxa[idx2, idx1 - 1] = idx1 - 1
-            yidxv[idx2, idx1 - 1] = idx2
-            if idx1 - 1 != idx2:
-                ccmax[idx1 - 1, idx2] = cmax
-                ccpeak[idx1 - 1, idx2] = cpeak
-                ya[idx1 - 1, idx2] = y[idx2]
-                yv[idx1 - 1, idx2] = y[idx1 - 1]
-                yidxa[idx1 - 1, idx2] = idx2
-                yidxv[idx1 - 1, idx2] = idx1 - 1
-
-    return {'zfit': zfit, 'ccmax': ccmax, 'ccpeak': ccpeak, 'x': x, 'nx': len(x), 'xfit': xfit, 'nxfit': nxfit, 'y': y,
+    ccmax[idx2, idx1 - 1] = cmax
+    ccpeak[idx2, idx1 - 1] = cpeak
+    ya[idx2, idx1 - 1] = y[idx1 - 1]
+    yv[idx2, idx1 - 1] = y[idx2]
+    yidxa[idx2, idx1 - 1] = idx1 - 1
+    yidxv[idx2, idx1 - 1] = idx2
+    off = idx1 - 1 != idx2
+    idx1, idx2, cmax, cpeak = idx1[off], idx2[off], cmax[off], cpeak[off]
+    ccmax[idx1 - 1, idx2] = cmax
+    ccpeak[idx1 - 1, idx2] = cpeak
+    ya[idx1 - 1, idx2] = y[idx2]
+    yv[idx1 - 1, idx2] = y[idx1 - 1]
+    yidxa[idx1 - 1, idx2] = idx2
+    yidxv[idx1 - 1, idx2] = idx1 - 1
+
+    return {'zfit': z, 'ccmax': ccmax, 'ccpeak': ccpeak, 'x': x, 'nx': len(x), 'xfit': xfit, 'nxfit': nxfit, 'y': y,
             'ny': ny, 'yv': yv, 'ya': ya,
             'yidxv': yidxv, 'yidxa': yidxa}
 
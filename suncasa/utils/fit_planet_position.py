@@ -26,6 +26,10 @@ import numpy as np
 # make the fixes there as well.  also, you don't need the bisect import
 # here, because searchsorted does it for you.
 #
+# the fits in fit_planet_positions now use the batched numpy solver
+# (polyfit_batch, fit_polynomials).  the pure python routines below are
+# kept as the reference implementation.
+#
 
 import bisect
 
@@ -369,7 +373,93 @@ def svdvar(vv, ww, ma):
     return cvm
 
 
-def fit_planet_positions(times, ras, decs, start_time=None, end_time=None, distances=None, allowed_error=0.01):
+def polyfit_batch(x, y, npoly, sig=None):
+    '''
+    Weighted least-squares polynomial fits of a batch of series, the NumPy counterpart of svdfit and svdvar.
+    The design matrices of all series are decomposed with one batched SVD, and the singular values below
+    2e-12 of the largest are zeroed as in svdfit.
+
+    inputs:
+        x = abscissae, (nt,) shared by all series or (nt, nseries).
+        y = ordinates, (nt,) or (nt, nseries).
+        npoly = number of coefficients, in ascending powers of x.
+        sig = uncertainties, broadcastable to y (default 1).
+
+    returns (coef, cvm, chisq) of shapes (npoly, nseries), (npoly, npoly, nseries)
+    and (nseries,), without the series axis for a 1-d y.
+    '''
+    y = np.asarray(y, dtype=float)
+    squeeze = y.ndim == 1
+    y = y.reshape(len(y), -1)
+    x = np.broadcast_to(np.asarray(x, dtype=float).reshape(len(y), -1), y.shape)
+    if sig is None:
+        sig = np.ones_like(y)
+    sig = np.abs(np.broadcast_to(np.asarray(sig, dtype=float), y.shape))
+
+    afunc = x.T[:, :, None] ** np.arange(npoly)
+    aa = afunc / sig.T[:, :, None]
+    bb = y.T / sig.T
+    uu, ww, vt = np.linalg.svd(aa, full_matrices=False)
+    keep = ww >= 2.0e-12 * ww.max(axis=-1, keepdims=True)
+    winv = np.divide(1.0, ww, out=np.zeros_like(ww), where=keep & (ww > 0))
+    coef = np.einsum('skj,sk->sj', vt, np.einsum('sik,si->sk', uu, bb) * winv)
+    cvm = np.einsum('ski,sk,skj->sij', vt, winv ** 2, vt)
+    chisq = np.sum(((y.T - np.einsum('sij,sj->si', afunc, coef)) / sig.T) ** 2, axis=-1)
+
+    coef, cvm = coef.T, cvm.transpose(1, 2, 0)
+    if squeeze:
+        return coef[:, 0], cvm[:, :, 0], chisq[0]
+    return coef, cvm, chisq
+
+
+def fit_polynomials(x, y, sig=None, allowed_error=0.0, npoly_min=1, npoly_max=7):
+    '''
+    Fits each series with the fewest polynomial coefficients, from npoly_min up to npoly_max,
+    for which the fit deviates from the series by no more than allowed_error.  At each number
+    of coefficients, all the series not yet fitted are solved at once with polyfit_batch, so
+    e.g. the ra and dec of several planets or time windows of the same length are fitted together.
+
+    inputs:
+        x, y, sig = as in polyfit_batch.
+        allowed_error, npoly_min = scalars or one value per series.
+        npoly_max = maximum number of coefficients.
+
+    returns (status, coefs, cvms): status is a boolean array, False where the fit
+    did not reach allowed_error (the npoly_max fit is then returned); coefs and
+    cvms are lists of the coefficients (ascending powers) and their covariance matrices.
+    '''
+    y = np.asarray(y, dtype=float)
+    y = y.reshape(len(y), -1)
+    nseries = y.shape[1]
+    x = np.broadcast_to(np.asarray(x, dtype=float).reshape(len(y), -1), y.shape)
+    sig = np.ones_like(y) if sig is None else np.broadcast_to(np.asarray(sig, dtype=float), y.shape)
+    allowed_error = np.broadcast_to(allowed_error, (nseries,))
+    npoly_min = np.broadcast_to(npoly_min, (nseries,))
+
+    status = np.zeros(nseries, dtype=bool)
+    coefs = [None] * nseries
+    cvms = [None] * nseries
+    todo = np.arange(nseries)
+    for npoly in range(min(np.min(npoly_min), npoly_max), npoly_max + 1):
+        idx = todo[npoly_min[todo] <= npoly]
+        if len(idx) == 0:
+            continue
+        coef, cvm, chisq = polyfit_batch(x[:, idx], y[:, idx], npoly, sig[:, idx])
+        model = np.polynomial.polynomial.polyval(x[:, idx], coef, tensor=False)
+        ok = np.max(np.abs(model - y[:, idx]), axis=0) <= allowed_error[idx]
+        for j, i in enumerate(idx):
+            if ok[j] or npoly == npoly_max:
+                status[i] = ok[j]
+                coefs[i] = coef[:, j]
+                cvms[i] = cvm[:, :, j]
+        todo = np.array([i for i in todo if coefs[i] is None], dtype=int)
+        if len(todo) == 0:
+            break
+    return status, coefs, cvms
+
+
+def fit_planet_positions(times, ras, decs, start_time=None, end_time=None, distances=None, allowed_error=0.01,
+                         return_covariance=False):
     '''
     find a fitting polynomial for an ephemeris table.
 
@@ -386,6 +476,9 @@ def fit_planet_positions(times, ras, decs, start_time=None, end_time=None, dista
         allowed_error = the allowed error in the fitting polynomials
                         for ra and dec from the tabulated values
                         (asec).
+        return_covariance = if True, append the list of covariance
+                            matrices of the ra, dec (and distance)
+                            coefficients to the returned list.
 
     returned is a list, first element is the return status:
         0 -> success
@@ -407,6 +500,8 @@ def fit_planet_positions(times, ras, decs, start_time=None, end_time=None, dista
     third element is the list of right ascension coefficients.
     fourth element is the list of declination coefficients.
     fifth element is the list of distance coefficients.
+    last element (with return_covariance) is the list of covariance
+        matrices of the coefficients.
 
     bjb
     nrao
@@ -490,122 +585,27 @@ def fit_planet_positions(times, ras, decs, start_time=None, end_time=None, dista
         distance_array = distances_slice
 
     #
-    # right ascension fit
-    #
-    #
-    # for non-numpy version, need errors.  just take them all equal.
-    #
-    sig = []
-    for ii in range(len(ra_array)):
-        sig.append(ra_array[0] / 1000.0)
-    max_ra_difn = allowed_error + 1.0
-    npoly_ra = 2
-    while max_ra_difn > allowed_error and npoly_ra <= NPOLYMAX:
-        #
-        # if numpy ever gets into jython...
-        #
-        #       a_ra = polyfit (time_array, ra_array, npoly_ra)
-        #       ra_fit = poly1d(a_ra)
-        #
-        # polyfit returns the coefficients in reverse order from normal,
-        # so reverse them back...
-        #
-        #       a_ra = a_ra[::-1]
-        #       max_ra_difn = 0.0
-        #       for ii in range(len(time_array)):
-        #           model_ra = ra_fit(time_array[ii])
-        #           max_ra_difn = max (max_ra_difn, fabs(model_ra-ra_array[ii]))
-        #
-        # this is the numpy replacement, done by hand...
-        #
-        (a_ra, uu, vt, ww, chisq) = svdfit(time_array, ra_array, sig, npoly_ra)
-        #
-        # i never use the covariance matrix, so could comment this out,
-        # but i leave it in, in case i ever want to check on the significance
-        # of the coefficients (compare them against their error) to see whether
-        # there is a problem.
-        #
-        cvm = svdvar(vt, ww, npoly_ra)
-        max_ra_difn = 0.0
-        for ii in range(len(time_array)):
-            model_ra = 0.0
-            for jj in range(npoly_ra):
-                model_ra += a_ra[jj] * pow(time_array[ii], jj)
-            max_ra_difn = max(max_ra_difn, fabs(model_ra - ra_array[ii]))
-        npoly_ra += 1
-    npoly_ra -= 1
-    if npoly_ra == NPOLYMAX and max_ra_difn > allowed_error:
-        result[0] = 1
-    #
-    # the numpy version - have to convert from numpy array to list
+    # fit right ascension, declination and distance together.  for distance,
+    # set the allowed error to ~1.5 km...
     #
-    #   result.append(a_ra.tolist())
-    result.append(a_ra)
-
-    #
-    # declination fit
+    # for the weighted fits, need errors.  just take them all equal.
     #
-    sig = []
-    for ii in range(len(dec_array)):
-        sig.append(dec_array[0] / 1000.0)
-    max_dec_difn = allowed_error + 1.0
-    npoly_dec = 1
-    while max_dec_difn > allowed_error and npoly_dec <= NPOLYMAX:
-        # numpy
-        #       a_dec = polyfit (time_array, dec_array, npoly_dec)
-        #       dec_fit = poly1d(a_dec)
-        #       a_dec = a_dec[::-1]
-        #       max_dec_difn = 0.0
-        #       for ii in range(len(time_array)):
-        #           model_dec = dec_fit(time_array[ii])
-        #           max_dec_difn = max (max_dec_difn, fabs(model_dec-dec_array[ii]))
-        (a_dec, uu, vt, ww, chisq) = svdfit(time_array, dec_array, sig, npoly_dec)
-        cvm = svdvar(vt, ww, npoly_dec)
-        max_dec_difn = 0.0
-        for ii in range(len(time_array)):
-            model_dec = 0.0
-            for jj in range(npoly_dec):
-                model_dec += a_dec[jj] * pow(time_array[ii], jj)
-            max_dec_difn = max(max_dec_difn, fabs(model_dec - dec_array[ii]))
-        npoly_dec += 1
-    npoly_dec -= 1
-    if npoly_dec == NPOLYMAX and max_dec_difn > allowed_error:
-        result[0] += 2
-    #   result.append(a_dec.tolist())
-    result.append(a_dec)
-
+    series = [ra_array, dec_array]
+    errors = [allowed_error, allowed_error]
+    npoly_min = [2, 1]
+    if distances:
+        series.append(distance_array)
+        errors.append(1.0e-8)
+        npoly_min.append(1)
+    series = np.stack(series, axis=-1)
+    status, coefs, cvms = fit_polynomials(time_array, series, sig=series[0] / 1000.0, allowed_error=errors,
+                                          npoly_min=npoly_min, npoly_max=NPOLYMAX)
     #
-    # distance fit.  for distance, set the allowed error to ~1.5 km...
+    # 1 -> ra, 2 -> dec, 4 -> distance didn't converge
     #
-    if distances:
-        sig = []
-        for ii in range(len(distance_array)):
-            sig.append(distance_array[0] / 1000.0)
-        allowed_error = 1.0e-8
-        max_distance_difn = allowed_error + 1.0
-        npoly_distance = 1
-        while max_distance_difn > allowed_error and npoly_distance <= NPOLYMAX:
-            # numpy
-            #       a_distance = polyfit (time_array, distance_array, npoly_distance)
-            #       distance_fit = poly1d(a_distance)
-            #       a_distance = a_distance[::-1]
-            #       max_distance_difn = 0.0
-            #       for ii in range(len(time_array)):
-            #           model_distance = distance_fit(time_array[ii])
-            #           max_distance_difn = max (max_distance_difn, fabs(model_distance-distance_array[ii]))
-            (a_distance, uu, vt, ww, chisq) = svdfit(time_array, distance_array, sig, npoly_distance)
-            cvm = svdvar(vt, ww, npoly_distance)
-            max_distance_difn = 0.0
-            for ii in range(len(time_array)):
-                model_distance = 0.0
-                for jj in range(npoly_distance):
-                    model_distance += a_distance[jj] * pow(time_array[ii], jj)
-                max_distance_difn = max(max_distance_difn, fabs(model_distance - distance_array[ii]))
-            npoly_distance += 1
-        npoly_distance -= 1
-        if npoly_distance == NPOLYMAX and max_distance_difn > allowed_error:
-            result[0] += 4
-        #   result.append(a_distance.tolist())
-        result.append(a_distance)
+    result[0] = int(np.sum((~status) * 2 ** np.arange(len(status))))
+    result.extend([coef.tolist() for coef in coefs])
+    if return_covariance:
+        result.append(cvms)
 
     return result
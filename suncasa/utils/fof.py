@@ -0,0 +1,91 @@
+"""
+Friends-of-friends grouping of image pixels, used to build the self-calibration masks of the EOVSA flare
+pipeline (suncasa.eovsa.eovsa_flare_pipeline.FlareSelfCalib).
+"""
+import numpy as np
+
+
+def fof_links(y, x, linklen=3):
+    '''
+    Pairs of pixels closer than linklen, found by looking up the neighbouring offsets of each pixel
+    in an index image instead of comparing all the pairs
+    :param y, x: pixel coordinates (integers, no duplicates)
+    :return: two arrays of the indices of the linked pixels
+    '''
+    y = np.asarray(y, dtype=int)
+    x = np.asarray(x, dtype=int)
+    if len(x) == 0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    r = int(np.ceil(linklen)) - 1
+    offsets = [(dy, dx) for dy in range(0, r + 1) for dx in range(-r, r + 1)
+               if (dy > 0 or dx > 0) and dy ** 2 + dx ** 2 < linklen ** 2]
+    yp = y - y.min() + r
+    xp = x - x.min() + r
+    index = np.full((yp.max() + r + 1, xp.max() + r + 1), -1, dtype=int)
+    index[yp, xp] = np.arange(len(x))
+    links_i = []
+    links_j = []
+    for dy, dx in offsets:
+        nb = index[yp + dy, xp + dx]
+        linked = nb >= 0
+        links_i.append(np.nonzero(linked)[0])
+        links_j.append(nb[linked])
+    return np.concatenate(links_i), np.concatenate(links_j)
+
+
+def fof_labels(n, links_i, links_j):
+    '''
+    Friends-of-friends group label of each of the n members, given the linked pairs
+    '''
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+    graph = coo_matrix((np.ones(len(links_i), dtype=bool), (links_i, links_j)), shape=(n, n))
+    return connected_components(graph, directed=False)[1]
+
+
+def combine_groups(group, pos):
+    '''
+    Merge the groups that have members closer than 3 pixels, and the groups linked through other groups
+    :param group: list of groups, each a list of indices into pos
+    :param pos: pixel coordinates (y, x), as returned by np.where
+    '''
+    if len(group) == 0:
+        return []
+    members = np.concatenate([np.asarray(g, dtype=int) for g in group])
+    n = len(pos[0])
+    ingroup = np.zeros(n, dtype=bool)
+    ingroup[members] = True
+    links_i, links_j = fof_links(pos[0], pos[1])
+    inlink = ingroup[links_i] & ingroup[links_j]
+    links_i, links_j = links_i[inlink], links_j[inlink]
+    # link the members of each group to its first member, so that a group is never split
+    first = np.repeat([g[0] for g in group], [len(g) for g in group])
+    labels = fof_labels(n, np.concatenate([links_i, first]), np.concatenate([links_j, members]))
+    order = np.flatnonzero(ingroup)
+    # groups in the order of their first member
+    _, first_idx, inverse = np.unique(labels[order], return_index=True, return_inverse=True)
+    rank = np.argsort(np.argsort(first_idx))
+    groups_com = [[] for _ in range(len(first_idx))]
+    for i, g in zip(order, rank[inverse]):
+        groups_com[g].append(i)
+    return groups_com
+
+
+def gen_fof_groups(data3, thres):
+    '''
+    Friends-of-friends grouping of the pixels of data3 above thres, with a linking length of 3 pixels.
+    :return: [y, x] of the pixels in the groups with more than 3 members
+    '''
+    pos = np.where(data3 > thres)
+    size = len(pos[0])
+    if size == 0:
+        return [[], []]
+    links_i, links_j = fof_links(pos[0], pos[1])
+    labels = fof_labels(size, links_i, links_j)
+    nmem = np.bincount(labels)
+    sel = nmem[labels] > 3
+    # pixels grouped together, the groups in the order of their first pixel
+    order = np.argsort(labels[sel], kind='stable')
+    final_groups_y = list(pos[0][sel][order])
+    final_groups_x = list(pos[1][sel][order])
+    return [final_groups_y, final_groups_x]
@@ -7,6 +7,7 @@ from astropy.time import Time
 import astropy.units as u
 import warnings
 from suncasa.io import ndfits
+from suncasa.utils.imgrotate import rotate_image
 import ssl
 from scipy.interpolate import interp1d
 
@@ -86,7 +87,100 @@ def ms_restorehistory(msfile):
     os.system('mv {0}_bk {0}'.format(tb_history))
 
 
-def read_horizons(t0=None, dur=None, vis=None, observatory="OVRO", verbose=False, use_astropy=True):
+# geodetic longitude, latitude (deg) and height (m) of the observatories, so that no site registry is downloaded
+obs_locations = {'OVRO': (-118.286952892965, 37.2331698901026, 1207.1339),
+                 'VLA': (-107.6177275, 34.0787491666667, 2124.),
+                 'ALMA': (-67.754929, -23.022886, 5050.),
+                 'GMRT': (74.0497, 19.0965, 650.)}
+obs_aliases = {'EOVSA': 'OVRO', 'FASR': 'OVRO', 'OVRO_MMA': 'OVRO', 'OVRO-LWA': 'OVRO', '-81': 'OVRO',
+               'EVLA': 'VLA', '-5': 'VLA', 'UGMRT': 'GMRT', '399': 'GMRT', '-7': 'ALMA',
+               '500': 'GEOCENTRIC', 'GEOCENTRIC': 'GEOCENTRIC'}
+
+
+def obs_location(observatory):
+    '''
+    Returns the observatory name used for the ephemeris and its EarthLocation (None for geocentric)
+    observatory: observatory name or JPL Horizons code, e.g., 'EOVSA', 'OVRO', '-81', 'VLA', '500'
+    '''
+    from astropy.coordinates import EarthLocation
+    name = str(observatory).upper()
+    name = obs_aliases.get(name, name)
+    if name == 'GEOCENTRIC':
+        return name, None
+    if name in obs_locations:
+        lon, lat, height = obs_locations[name]
+        return name, EarthLocation.from_geodetic(lon * u.deg, lat * u.deg, height * u.m)
+    try:
+        return name, EarthLocation.of_site(name)
+    except Exception:
+        print('Observatory {} not recognized. Assume geocentric.'.format(observatory))
+        return 'GEOCENTRIC', None
+
+
+def solar_ephem(times, observatory='OVRO'):
+    '''
+    Topocentric (or geocentric) RA and DEC of the solar disk center and the solar P angle at the given times,
+    computed with a single astropy get_body call
+    times: astropy Time array
+    returns a dictionary of arrays in the format of read_horizons, with time in mjd, ra and dec in radians,
+        p0 in degrees and delta (Sun-observer distance) in AU
+    '''
+    from astropy.coordinates import get_body
+    from sunpy.coordinates import sun
+    name, location = obs_location(observatory)
+    phasecentre = get_body('sun', times, location)
+    return {'time': times.mjd, 'ra': phasecentre.ra.to(u.rad).value, 'dec': phasecentre.dec.to(u.rad).value,
+            'p0': sun.P(times).to(u.deg).value, 'delta': phasecentre.distance.to(u.au).value}
+
+
+def ephem_cachedir():
+    '''Directory of the ephemeris cache. Set with the environment variable SUNCASA_EPHEM_CACHE.'''
+    return os.getenv('SUNCASA_EPHEM_CACHE') or os.path.join(os.path.expanduser('~'), '.suncasa', 'ephem')
+
+
+def read_ephem_cache(bmjd, emjd, observatory='OVRO', cachedir=None, verbose=False):
+    '''
+    Returns the solar ephemeris between bmjd and emjd (in days) from the cache, on a one-minute grid that
+    includes a sample on each side of the interval. The ephemeris of a day missing in the cache is computed
+    with solar_ephem and saved to <cachedir>/<observatory>_<yyyymmdd>.npz.
+    '''
+    if cachedir is None:
+        cachedir = ephem_cachedir()
+    name, _ = obs_location(observatory)
+    days = []
+    for day in range(int(np.floor(bmjd)), int(np.floor(emjd)) + 1):
+        cachefile = os.path.join(cachedir, '{}_{}.npz'.format(name, Time(day, format='mjd').strftime('%Y%m%d')))
+        ephem = None
+        if os.path.exists(cachefile):
+            try:
+                with np.load(cachefile) as f:
+                    ephem = {k: f[k] for k in f.files}
+            except Exception:
+                ephem = None
+        if ephem is None:
+            if verbose:
+                print('Computing the solar ephemeris of {} for {}'.format(name, Time(day, format='mjd').iso[:10]))
+            ephem = solar_ephem(Time(day + np.arange(24 * 60 + 1) / 24. / 60., format='mjd'), name)
+            try:
+                if not os.path.exists(cachedir):
+                    os.makedirs(cachedir)
+                # written under a temporary name, so that concurrent readers never see a partial file
+                tmpfile = '{}.{}.tmp'.format(cachefile, os.getpid())
+                with open(tmpfile, 'wb') as f:
+                    np.savez(f, **ephem)
+                os.replace(tmpfile, cachefile)
+            except OSError as e:
+                print('Failed to write the ephemeris cache {}: {}'.format(cachefile, e))
+        days.append(ephem)
+    ephem = {k: np.concatenate([d[k] for d in days]) for k in days[0]}
+    # the days share their midnight sample
+    _, idx = np.unique(np.round(ephem['time'] * 24 * 60).astype(int), return_index=True)
+    dt = 1. / 24. / 60.
+    idx = idx[(ephem['time'][idx] >= bmjd - dt) & (ephem['time'][idx] <= emjd + dt)]
+    return {k: v[idx] for k, v in ephem.items()}
+
+
+def read_horizons(t0=None, dur=None, vis=None, observatory="OVRO", verbose=False, use_astropy=True, use_cache=True):
     """
     This function visits JPL Horizons to retrieve J2000 topocentric RA and DEC of the solar disk center
     as a function of time.
@@ -99,6 +193,9 @@ def read_horizons(t0=None, dur=None, vis=None, observatory="OVRO", verbose=False
     observatory: observatory code (from JPL Horizons). If not provided, use information from visibility.
          if no visibility found, use earth center (code=500)
     verbose: True to provide extra information
+    use_astropy: compute the ephemeris with astropy instead of querying JPL Horizons
+    use_cache: with use_astropy, interpolate from the one-minute ephemeris of each day kept in the cache
+         directory (see ephem_cachedir), which are computed once for each observatory and day
 
     Usage:
     >>> from astropy.time import Time
@@ -118,12 +215,6 @@ def read_horizons(t0=None, dur=None, vis=None, observatory="OVRO", verbose=False
     observatory = observatory.upper()
 
     if use_astropy:
-
-        from sunpy.coordinates import sun
-        from astropy.time import Time
-        from astropy import units as u
-        from astropy.coordinates import get_body, EarthLocation
-
         if not t0 and not vis:
             t0 = Time.now()
         if not dur:
@@ -131,46 +222,31 @@ def read_horizons(t0=None, dur=None, vis=None, observatory="OVRO", verbose=False
         if t0:
             try:
                 btime = Time(t0)
-                
+
             except:
                 print('input time ' + str(t0) + ' not recognized')
                 return -1
-
-        JPL_AU = 149597870700.0  # meters
-        JPL_RSUN = 696000000.0   # meters
-
-        obstime = btime
-
+        elif vis:
+            if not os.path.exists(vis):
+                print('Input ms data ' + vis + ' does not exist! ')
+                return -1
+            tb.open(vis)
+            btime_vis = Time(tb.getcell('TIME', 0) / 24. / 3600., format='mjd')
+            etime_vis = Time(tb.getcell('TIME', tb.nrows() - 1) / 24. / 3600., format='mjd')
+            tb.close()
+            # extend the start and end time by 0.5 hr on each end
+            btime = Time(btime_vis.mjd - 0.5 / 24., format='mjd')
+            dur = etime_vis.mjd - btime_vis.mjd + 1.0 / 24.
 
         if dur<=1e-6/3600/24: # robust for wild input of dur<=0
             dur = 1e-6/3600/24
 
-        etime = Time(btime.mjd + dur, format='mjd')
-        times = Time(np.linspace(btime.mjd, etime.mjd, int(np.ceil(dur*24*60))), format='mjd')
-
-        time_set = []
-        ra_set = []
-        dec_set = []
-        p0_set = []
-        delta_set = []
-        for time in times:
-            # Get coordinates using astropy
-            location = EarthLocation.of_site(observatory)
-            phasecentre = get_body('sun', time, location)
-            ra = phasecentre.ra.to(u.rad).value
-            dec = phasecentre.dec.to(u.rad).value
-
-            # Get solar angles from sunpy
-            P = sun.P(time).to(u.deg).value
-            B0 = sun.B0(time).to(u.deg).value
-            L0 = sun.L0(time).to(u.deg).value
-            time_set.append(time)
-            ra_set.append(ra)
-            dec_set.append(dec)
-            p0_set.append(P)
-            delta_set.append(0)
-
-        ephem = {'time': time_set, 'ra': ra_set, 'dec': dec_set, 'p0': p0_set, 'delta': delta_set} 
+        if use_cache:
+            ephem = read_ephem_cache(btime.mjd, btime.mjd + dur, observatory, verbose=verbose)
+        else:
+            times = Time(np.linspace(btime.mjd, btime.mjd + dur, max(2, int(np.ceil(dur * 24 * 60)) + 1)), format='mjd')
+            ephem = solar_ephem(times, observatory)
+        ephem = {k: list(v) for k, v in ephem.items()}
 
 
     else:
@@ -479,6 +555,106 @@ def read_msinfo(vis=None, msinfofile=None, interp_to_scan=False, verbose=False):
     return msinfo
 
 
+_msmeta_cache = {}
+
+
+def _ms_signature(vis):
+    """
+    Size and full-precision modification time of the table description (table.dat) and data (table.f*) files of the
+    main table and its FIELD subtable. Used to tell whether a metadata sidecar was written against the current
+    state of the MS. table.lock and table.info are left out, since opening or locking the MS, e.g., by tclean
+    in other workers, touches them without changing the data.
+    """
+    sig = []
+    for d in [vis, os.path.join(vis, 'FIELD')]:
+        if not os.path.isdir(d):
+            continue
+        for f in sorted(os.listdir(d)):
+            if f == 'table.dat' or f.startswith('table.f'):
+                st = os.stat(os.path.join(d, f))
+                sig.append((os.path.relpath(os.path.join(d, f), vis), st.st_size, st.st_mtime))
+    return sig
+
+
+def msmeta_file(vis):
+    """
+    Default path of the metadata sidecar of a measurement set, placed next to the MS
+    """
+    return os.path.normpath(vis) + '.msmeta.pkl'
+
+
+def read_msmeta(vis, metafile=None, doephem=True, overwrite=False, verbose=False):
+    """
+    Read the per-MS metadata used by ptclean workers (time stamps, solar ephemeris, and phase centers
+    from read_msinfo) from a small sidecar file next to the MS. The metadata is computed once and saved to the
+    sidecar; later calls against an unchanged MS, including those from worker processes, only load the file.
+    The sidecar is rewritten if the MS has been modified since.
+
+    Parameters
+    ----------
+    vis: path to the input CASA measurement set
+    metafile: (optional) path of the sidecar file. Default to <vis>.msmeta.pkl
+    doephem: if True (default), also obtain the ephemeris (read_horizons) and ms info (read_msinfo)
+    overwrite: if True, recompute the metadata even if a valid sidecar exists
+    Returns
+    -------
+    msmeta: A dictionary with
+        vis: CASA measurement set
+        times: unique time stamps of the MS, in CASA seconds (mjd * 86400)
+        ephem: output of read_horizons, or None if not requested
+        msinfo: output of read_msinfo, or None if not requested
+    """
+    import pickle
+    if not metafile:
+        metafile = msmeta_file(vis)
+    sig = _ms_signature(vis)
+    msmeta = None
+    if not overwrite:
+        cached = _msmeta_cache.get(metafile)
+        if cached is not None and cached['signature'] == sig:
+            msmeta = cached
+        elif os.path.exists(metafile):
+            try:
+                with open(metafile, 'rb') as f:
+                    msmeta = pickle.load(f)
+            except Exception as e:
+                print('Failed to read {}: {}. Recomputing the ms metadata.'.format(metafile, e))
+                msmeta = None
+            if msmeta is not None and msmeta.get('signature') != sig:
+                if verbose:
+                    print('{} is outdated. Recomputing the ms metadata.'.format(metafile))
+                msmeta = None
+    if msmeta is not None and (not doephem or msmeta['ephem'] is not None):
+        _msmeta_cache[metafile] = msmeta
+        return msmeta
+
+    if msmeta is None:
+        # the unique time stamps are read from the TIME column directly,
+        # rather than with ms.getdata(ifraxis=True), which reads the full time axis of the data
+        tb.open(vis)
+        times = np.unique(tb.getcol('TIME'))
+        tb.close()
+        msmeta = {'vis': vis, 'signature': sig, 'times': times, 'ephem': None, 'msinfo': None}
+    if doephem:
+        times = msmeta['times']
+        t0 = Time(times[0] / 24. / 3600. - 0.5 / 24., format='mjd')
+        dur = (times[-1] - times[0]) / 24. / 3600. + 1. / 24.
+        msmeta['ephem'] = read_horizons(t0=t0, dur=dur, vis=vis, verbose=verbose)
+        msmeta['msinfo'] = read_msinfo(vis, verbose=verbose)
+    try:
+        # written under a per-process temporary name, so that concurrent writers never interleave
+        tmpfile = '{}.{}.tmp'.format(metafile, os.getpid())
+        with open(tmpfile, 'wb') as f:
+            pickle.dump(msmeta, f, protocol=2)
+        os.replace(tmpfile, metafile)
+        if verbose:
+            print('ms metadata saved to {}'.format(metafile))
+    except (IOError, OSError) as e:
+        print('Failed to write {}: {}'.format(metafile, e))
+    _msmeta_cache[metafile] = msmeta
+    return msmeta
+
+
 def ephem_to_helio(vis=None, ephem=None, msinfo=None, reftime=None, dopolyfit=True,
                    usephacenter=True, geocentric=False, verbose=False):
     '''
@@ -618,6 +794,9 @@ def ephem_to_helio(vis=None, ephem=None, msinfo=None, reftime=None, dopolyfit=Tr
 
     nreftime = len(reftime)
     helio = []
+    # the ephemeris interpolation and the field directions are set up once for all the reference times
+    f_ephem = None
+    fielddirs = {}
     for reftime0 in reftime:
         helio0 = dict.fromkeys(
             ['reftimestr', 'reftime', 'ra', 'dec', 'ra_fld', 'dec_fld', 'raoff', 'decoff', 'refx', 'refy', 'p0'])
@@ -750,12 +929,9 @@ def ephem_to_helio(vis=None, ephem=None, msinfo=None, reftime=None, dopolyfit=Tr
             num_p0s_ephem=len(p0s_ephem)
             if len(times_ephem)>1 and num_times_ephem==num_ras_ephem\
                     and num_times_ephem==num_decs_ephem and num_times_ephem==num_p0s_ephem:
-                f_ra = interp1d(times_ephem, ras_ephem, kind='linear')
-                f_dec = interp1d(times_ephem, decs_ephem, kind='linear')
-                f_p0 = interp1d(times_ephem, p0s_ephem, kind='linear')
-                ra0 = f_ra([tref_d])[0]
-                dec0 = f_dec([tref_d])[0]
-                p0 = f_p0([tref_d])[0]
+                if f_ephem is None:
+                    f_ephem = interp1d(times_ephem, np.array([ras_ephem, decs_ephem, p0s_ephem]), kind='linear')
+                ra0, dec0, p0 = [float(v) for v in f_ephem(tref_d)]
             else:
                 try:
                     ra0 = ras_ephem[0]
@@ -796,13 +972,16 @@ def ephem_to_helio(vis=None, ephem=None, msinfo=None, reftime=None, dopolyfit=Tr
             dt = tref_d - scan_start_times[ind - 1]
             if ind < len(scan_start_times):
                 fieldid = fieldids[ind]
-                ms.open(vis)
-                dir = ms.getfielddirmeas('PHASE_DIR', fieldid)
-                ra_b = dir['m0']['value']
-                dec_b = dir['m1']['value']
-                if ra_b < 0:
-                    ra_b += 2. * np.pi
-                ms.close()
+                if fieldid not in fielddirs:
+                    ms.open(vis)
+                    dir = ms.getfielddirmeas('PHASE_DIR', fieldid)
+                    ra_b = dir['m0']['value']
+                    dec_b = dir['m1']['value']
+                    if ra_b < 0:
+                        ra_b += 2. * np.pi
+                    ms.close()
+                    fielddirs[fieldid] = (ra_b, dec_b)
+                (ra_b, dec_b) = fielddirs[fieldid]
             if ind >= len(btimes):
                 (ra_b, ra_e) = (ra_rads[ind - 2], ra_rads[ind - 1])
                 (dec_b, dec_e) = (dec_rads[ind - 2], dec_rads[ind - 1])
@@ -1050,11 +1229,17 @@ def imreg(vis=None, imagefile=None, timerange=None,
                     tb.removerows([i + 1 for i in range(nobs - 1)])
                     tb.close()
                 ia.open(img)
-                imr = ia.rotate(pa=str(-p0) + 'deg')
                 if subregion != '':
+                    # the sub-region is selected by CASA on the rotated image
+                    imr = ia.rotate(pa=str(-p0) + 'deg')
                     imr = imr.subimage(region=subregion)
-                imr.tofits(fitsf, history=False, overwrite=overwrite)
-                imr.close()
+                    imr.tofits(fitsf, history=False, overwrite=overwrite)
+                    imr.close()
+                    rotated = True
+                else:
+                    # export the image as is, it is rotated below together with the other header and data updates
+                    ia.tofits(fitsf, history=False, overwrite=overwrite)
+                    rotated = False
                 imsum = ia.summary()
                 ia.close()
                 ia.done()
@@ -1128,11 +1313,16 @@ def imreg(vis=None, imagefile=None, timerange=None,
                 (crval1, crval2) = (xoff + dx_fld, yoff + dy_fld)
             # update the fits header to heliocentric coordinates
 
-            hdu = pyfits.open(fitsf, mode='update')
+            # the data is read in memory, the fits file is written once at the end
+            hdu = pyfits.open(fitsf, memmap=False)
             hdu[0].verify('fix')
             header = hdu[0].header
-            dshape = hdu[0].data.shape
-            ndim = hdu[0].data.ndim
+            data = hdu[0].data  # remember the data order is reversed due to the FITS convension
+            hdu.close()
+            if not rotated:
+                data = rotate_image(data, -hel['p0'], (header['crpix2'] - 1., header['crpix1'] - 1.))
+            dshape = data.shape
+            ndim = data.ndim
             (cdelt1, cdelt2) = (
                 -header['cdelt1'] * 3600., header['cdelt2'] * 3600.)  # Original CDELT1, 2 are for RA and DEC in degrees
             header['cdelt1'] = cdelt1
@@ -1213,7 +1403,6 @@ def imreg(vis=None, imagefile=None, timerange=None,
             header['DLTFRQ'] = header['CDELT' + faxis]
             header['FQUNIT'] = header['CUNIT' + faxis]
 
-            data = hdu[0].data  # remember the data order is reversed due to the FITS convension
             # intensity units to brightness temperature
             if toTb:
                 # get restoring beam info
@@ -1232,40 +1421,27 @@ def imreg(vis=None, imagefile=None, timerange=None,
                 if header['BUNIT'].lower() == 'jy/beam':
                     header['BUNIT'] = 'K'
                     header['BTYPE'] = 'Brightness Temperature'
-                    for i in range(dshape[faxis_ind]):
-                        nu = header['CRVAL' + faxis] + header['CDELT' + faxis] * (i + 1 - header['CRPIX' + faxis])
-                        if header['CUNIT' + faxis] == 'KHz':
-                            nu *= 1e3
-                        if header['CUNIT' + faxis] == 'MHz':
-                            nu *= 1e6
-                        if header['CUNIT' + faxis] == 'GHz':
-                            nu *= 1e9
-                        if len(bmaj) > 1:  # multiple (per-plane) beams
-                            bmajtmp = bmaj[i]
-                            bmintmp = bmin[i]
-                        else:  # one single beam
-                            bmajtmp = bmaj[0]
-                            bmintmp = bmin[0]
-                        if beamunit == 'arcsec':
-                            bmaj0 = np.radians(bmajtmp / 3600.)
-                            bmin0 = np.radians(bmintmp / 3600.)
-                        if beamunit == 'arcmin':
-                            bmaj0 = np.radians(bmajtmp / 60.)
-                            bmin0 = np.radians(bmintmp / 60.)
-                        if beamunit == 'deg':
-                            bmaj0 = np.radians(bmajtmp)
-                            bmin0 = np.radians(bmintmp)
-                        if beamunit == 'rad':
-                            bmaj0 = bmajtmp
-                            bmin0 = bmintmp
-                        beam_area = bmaj0 * bmin0 * np.pi / (4. * log(2.))
-                        factor = const * nu ** 2  # SI unit
-                        jy_to_si = 1e-26
-                        # print(nu/1e9, beam_area, factor)
-                        if faxis == '3':
-                            data[:, i, :, :] *= jy_to_si / beam_area / factor
-                        if faxis == '4':
-                            data[i, :, :, :] *= jy_to_si / beam_area / factor
+                    # conversion factors of all the channels, broadcast along the frequency axis
+                    nchan = dshape[faxis_ind]
+                    nu = header['CRVAL' + faxis] + header['CDELT' + faxis] * (
+                            np.arange(nchan) + 1 - header['CRPIX' + faxis])
+                    nu = nu * {'KHz': 1e3, 'MHz': 1e6, 'GHz': 1e9}.get(header['CUNIT' + faxis], 1.)
+                    if len(bmaj) > 1:  # multiple (per-plane) beams
+                        bmajtmp = np.array(bmaj[:nchan])
+                        bmintmp = np.array(bmin[:nchan])
+                    else:  # one single beam
+                        bmajtmp = np.array(bmaj[0])
+                        bmintmp = np.array(bmin[0])
+                    beamscl = {'arcsec': np.pi / 180. / 3600., 'arcmin': np.pi / 180. / 60., 'deg': np.pi / 180.,
+                               'rad': 1.}[beamunit]
+                    bmaj0 = bmajtmp * beamscl
+                    bmin0 = bmintmp * beamscl
+                    beam_area = bmaj0 * bmin0 * np.pi / (4. * log(2.))
+                    factor = const * nu ** 2  # SI unit
+                    jy_to_si = 1e-26
+                    tbscl = np.ones(ndim, dtype=int)
+                    tbscl[faxis_ind] = nchan
+                    data = (data * (jy_to_si / beam_area / factor).reshape(tbscl)).astype(data.dtype)
 
             try:
                 header.append(('hel_reg', True))
@@ -1276,8 +1452,6 @@ def imreg(vis=None, imagefile=None, timerange=None,
 
             data *= sclfactor
             header = ndfits.headerfix(header)
-            hdu.flush()
-            hdu.close()
 
             if ndim - np.count_nonzero(np.array(dshape) == 1) > 3:
                 docompress = False
@@ -1291,15 +1465,10 @@ def imreg(vis=None, imagefile=None, timerange=None,
                 print(
                     'warning: The fits data contains more than 3 non squeezable dimensions. Skipping fits compression..')
             if docompress:
-                fitsftmp = fitsf + ".tmp.fits"
-                os.system("mv {} {}".format(fitsf, fitsftmp))
-                hdu = pyfits.open(fitsftmp)
-                hdu[0].verify('fix')
-                header = hdu[0].header
-                data = hdu[0].data
                 ndfits.write(fitsf, data, header, compression_type='RICE_1',
                              quantize_level=4.0)
-                os.system("rm -rf {}".format(fitsftmp))
+            else:
+                pyfits.writeto(fitsf, data, header, overwrite=True)
     if deletehistory:
         ms_restorehistory(vis)
     return fitsfile
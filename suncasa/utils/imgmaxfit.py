@@ -0,0 +1,139 @@
+"""
+NumPy maxfit of radio images: the peak of each (pol, chan) plane refined by a quadratic fit, and the
+thresholded centroid, with the results laid out as the component records of iatool.maxfit.
+Used by the pmaxfit task, and does not need CASA.
+"""
+import numpy as np
+
+from suncasa.utils import DButil
+
+
+def parabolic_peak(cube, width):
+    """
+    Locate the maximum of each plane of cube and refine it with a least-squares 2-D quadratic fit
+    over the (2 * width + 1) x (2 * width + 1) grid around the peak pixel. All planes are fitted at once.
+    :param cube: array of shape (nplane, ny, nx)
+    :param width: half-width of the fit grid
+    :return: x, y (pixel), peak value, and a boolean array telling if the plane has a valid maximum
+    """
+    nplane, ny, nx = cube.shape
+    flat = cube.reshape(nplane, -1)
+    valid = np.isfinite(flat).any(axis=1)
+    ipk = np.nanargmax(np.where(valid[:, None], flat, 0.), axis=1)
+    ypk, xpk = np.unravel_index(ipk, (ny, nx))
+    xpk = xpk.astype(np.float64)
+    ypk = ypk.astype(np.float64)
+    fpk = flat[np.arange(nplane), ipk].astype(np.float64)
+    width = int(width)
+    if width < 1:
+        return xpk, ypk, fpk, valid
+    off = np.arange(-width, width + 1)
+    dy, dx = [a.ravel() for a in np.meshgrid(off, off, indexing='ij')]
+    yy = ypk.astype(int)[:, None] + dy[None, :]
+    xx = xpk.astype(int)[:, None] + dx[None, :]
+    inside = ((yy >= 0) & (yy < ny) & (xx >= 0) & (xx < nx)).all(axis=1)
+    patch = cube[np.arange(nplane)[:, None], np.clip(yy, 0, ny - 1), np.clip(xx, 0, nx - 1)].astype(np.float64)
+    usefit = inside & np.isfinite(patch).all(axis=1)
+    # z = a + b x + c y + d x^2 + e x y + f y^2, the design matrix is the same for every plane
+    amat = np.stack([np.ones_like(dx), dx, dy, dx ** 2, dx * dy, dy ** 2], axis=1).astype(np.float64)
+    a, b, c, d, e, f = np.dot(np.where(usefit[:, None], patch, 0.), np.linalg.pinv(amat).T).T
+    det = 4. * d * f - e ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x0 = (e * c - 2. * f * b) / det
+        y0 = (e * b - 2. * d * c) / det
+    usefit &= (det > 0) & (d < 0) & (np.abs(x0) <= width) & (np.abs(y0) <= width)
+    x0 = np.where(usefit, x0, 0.)
+    y0 = np.where(usefit, y0, 0.)
+    ffit = a + b * x0 + c * y0 + d * x0 ** 2 + e * x0 * y0 + f * y0 ** 2
+    return xpk + x0, ypk + y0, np.where(usefit, ffit, fpk), valid
+
+
+def centroid(cube, thresh=0.5):
+    """
+    Intensity-weighted centroid of the pixels above thresh times the maximum of each plane.
+    :param cube: array of shape (nplane, ny, nx)
+    :return: x, y (pixel)
+    """
+    nplane, ny, nx = cube.shape
+    with np.errstate(invalid='ignore'):
+        pmax = np.nanmax(cube.reshape(nplane, -1), axis=1)
+        w = np.where(cube >= thresh * pmax[:, None, None], cube, 0.)
+        wsum = w.sum(axis=(1, 2))
+        wx = np.dot(w.sum(axis=1), np.arange(nx)) / wsum
+        wy = np.dot(w.sum(axis=2), np.arange(ny)) / wsum
+    return wx, wy
+
+
+def direction(lon, lat, refer):
+    return {'type': 'direction', 'refer': refer, 'm0': {'unit': 'rad', 'value': lon},
+            'm1': {'unit': 'rad', 'value': lat}}
+
+
+def maxfit_image(img, box='', width=5):
+    """
+    NumPy counterpart of iatool.maxfit over all planes of a FITS image. The (pol, chan, y, x) cube is read once
+    (memory-mapped if possible), peak positions, thresholded centroids and fluxes are computed for all planes
+    in one batch, and pixel coordinates are converted to world coordinates with the FITS WCS.
+    :param img: FITS image file
+    :param box: 'blcx,blcy,trcx,trcy' region in pixels, '' for the whole image
+    :param width: half-width of the grid of the quadratic fit around the peak pixel
+    :return: the date-obs of the image, and a dictionary keyed by polarization with the component records
+             laid out as pmaxfit returns them with the CASA image tool
+    """
+    from astropy.io import fits
+    from astropy.wcs import WCS
+    with fits.open(img, memmap=True) as hdulist:
+        hdr = hdulist[0].header
+        timstr = hdr['date-obs']
+        pols = list(DButil.polsfromfitsheader(hdr))
+        freqs = DButil.freqsfromfitsheader(hdr)
+        data = hdulist[0].data
+        npols, nchans, ndy, ndx = data.shape
+        blc, trc = [0, 0], [ndx, ndy]
+        if box != '':
+            blc[0], blc[1], trc[0], trc[1] = [int(ll) for ll in box.split(',')]
+        cube = np.asarray(data[:, :, blc[1]:trc[1] + 1, blc[0]:trc[0] + 1], dtype=np.float64)
+    ny, nx = cube.shape[-2:]
+    cube = cube.reshape(npols * nchans, ny, nx)
+    xfit, yfit, flux, valid = parabolic_peak(cube, width)
+    wx, wy = centroid(cube)
+
+    wcs = WCS(hdr)
+    refer = hdr.get('RADESYS', 'J2000')
+    if refer in ['FK5', 'ICRS'] and hdr.get('EQUINOX', 2000.) == 2000.:
+        refer = 'J2000' if refer == 'FK5' else refer
+    pp, ll = np.meshgrid(np.arange(npols), np.arange(nchans), indexing='ij')
+    pp = pp.ravel()
+    ll = ll.ravel()
+    lon, lat = wcs.wcs_pix2world(xfit + blc[0], yfit + blc[1], ll, pp, 0)[:2]
+    clon, clat = wcs.wcs_pix2world(wx + blc[0], wy + blc[1], ll, pp, 0)[:2]
+    lon, lat, clon, clat = [np.radians(v) for v in [lon, lat, clon, clat]]
+    bunit = hdr.get('BUNIT', 'Jy/beam')
+
+    results = {}
+    for itpp in pols:
+        results[itpp] = {'results': {}, 'converged': []}
+    for k in range(npols * nchans):
+        itpp = pols[pp[k]]
+        if not valid[k]:
+            results[itpp]['converged'].append(False)
+            continue
+        comp = 'component{}'.format(ll[k])
+        results[itpp]['results'][comp] = {
+            'shape': {'type': 'Point',
+                      'direction': dict(direction(lon[k], lat[k], refer),
+                                        error={'longitude': {'unit': 'arcsec', 'value': 0.0},
+                                               'latitude': {'unit': 'arcsec', 'value': 0.0}})},
+            'flux': {'value': np.array([flux[k], 0., 0., 0.]), 'error': np.zeros(4), 'unit': bunit,
+                     'polarisation': itpp},
+            'spectrum': {'type': 'Constant',
+                         'frequency': {'type': 'frequency', 'refer': 'LSRK',
+                                       'm0': {'unit': 'Hz', 'value': float(freqs[ll[k]])}}},
+            'centroid': {'direction': direction(clon[k], clat[k], refer)},
+            'pixelcoords': np.array([xfit[k] + blc[0], yfit[k] + blc[1]]),
+            'label': '',
+            'converged': True}
+        results[itpp]['converged'].append(True)
+    for itpp in pols:
+        results[itpp]['results']['nelements'] = results[itpp]['results'].keys()
+    return timstr, results
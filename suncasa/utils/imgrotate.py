@@ -0,0 +1,29 @@
+"""
+NumPy rotation of the image planes of a data cube, in place of iatool.rotate. Used by imreg of helioimage2fits
+to rotate the images to solar north up, and does not need CASA.
+"""
+import numpy as np
+
+
+def rotate_image(data, angle, center, order=3):
+    '''
+    Rotate the images in the last two axes of data counterclockwise by angle (in degrees) about center,
+    as ia.rotate does. The same affine transform is applied to all the planes of the leading axes (stokes, frequency).
+    Pixels from outside the input image or from NaN pixels are set to NaN.
+           data: array with the image in the last two axes (y, x)
+           center: (y, x) pixel of the rotation center, 0-based
+    '''
+    from scipy import ndimage
+    ang = np.radians(angle)
+    # output pixel p samples the input at R (p - center) + center, with R in (y, x) order
+    matrix = np.array([[np.cos(ang), -np.sin(ang)], [np.sin(ang), np.cos(ang)]])
+    offset = np.array(center) - matrix.dot(center)
+    planes = data.reshape((-1,) + data.shape[-2:])
+    out = np.empty(planes.shape, dtype=data.dtype)
+    for i, plane in enumerate(planes):
+        nans = np.isnan(plane)
+        out[i] = ndimage.affine_transform(np.where(nans, 0., plane), matrix, offset=offset, order=order,
+                                          mode='constant', cval=np.nan)
+        if np.any(nans):
+            out[i][ndimage.affine_transform(nans, matrix, offset=offset, order=0, mode='constant')] = np.nan
+    return out.reshape(data.shape)
@@ -907,43 +907,9 @@ def mk_qlook_image(vis, ncpu=1, timerange='', twidth=12, stokes='I,V', antenna='
                           subregion=subregion,
                           weighting='briggs',
                           robust=robust)
-            ## perform a sanity check if all intended images are created.
-            ntrial = 0
-            while np.count_nonzero(np.array(res['Succeeded']) == False) > 0 and ntrial < 2:
-                print('some intended images are not created. Trying to create them again.... trial #{}'.format(ntrial))
-                res = ptclean(vis=msfile,
-                              imageprefix=imdir,
-                              imagesuffix=imagesuffix,
-                              timerange=timerange,
-                              twidth=twidth,
-                              spw=spw,
-                              uvrange=uvrange,
-                              restoringbeam=restoringbm,
-                              mask=mask,
-                              ncpu=ncpu,
-                              niter=niter,
-                              gain=gain,
-                              antenna=antenna,
-                              imsize=imsize,
-                              cell=cell,
-                              stokes=sto,
-                              doreg=True,
-                              usephacenter=True,
-                              phasecenter=phasecenter,
-                              docompress=docompress,
-                              reftime=reftime,
-                              overwrite=overwrite,
-                              toTb=toTb,
-                              sclfactor=sclfactor,
-                              datacolumn=datacolumn,
-                              pbcor=pbcor,
-                              subregion=subregion,
-                              weighting='briggs',
-                              robust=robust)
-                ntrial += 1
+            ## ptclean retries the failed time slices itself, only the missing ones are imaged again.
             if np.count_nonzero(np.array(res['Succeeded']) == False) > 0:
-                print('Some intended images can not be created after {} trails. Preceed with missing images.'.format(
-                    ntrial))
+                print('Some intended images can not be created. Proceed with missing images.')
 
         if res:
             imres['Succeeded'] += res['Succeeded']
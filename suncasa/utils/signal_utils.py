@@ -107,6 +107,44 @@ def smooth(x, window_len=11, window='hanning', mode='same'):
         return y[np.int_(window_len / 2 - 1):-np.int_(window_len / 2)]
 
 
+def smooth_nd(x, window_len=11, window='hanning', axis=-1):
+    """Batched version of smooth(x, window_len, window) along one axis of an N-D array.
+
+    All 1-D signals along the axis are convolved in a single scipy.ndimage.convolve1d pass.
+    The mirror boundary and the centering of the window are the same as in smooth, so the
+    output equals smooth applied to each 1-D signal. Complex input is smoothed part by part.
+
+    input:
+        x: the input array
+        window_len: the dimension of the smoothing window
+        window: the type of window from 'flat', 'hanning', 'hamming', 'bartlett', 'blackman'
+        axis: the axis along which to smooth
+
+    output:
+        the smoothed array, of the same shape as x
+    """
+    from scipy.ndimage import convolve1d
+    if x.shape[axis] < window_len:
+        raise ValueError("Input vector needs to be bigger than window size.")
+
+    if window_len < 3:
+        return x
+
+    if not window in ['flat', 'hanning', 'hamming', 'bartlett', 'blackman']:
+        raise ValueError("Window is on of 'flat', 'hanning', 'hamming', 'bartlett', 'blackman'")
+
+    if window == 'flat':  # moving average
+        w = np.ones(window_len, 'd')
+    else:
+        w = getattr(np, window)(window_len)
+    w = w / w.sum()
+    origin = window_len % 2 - 1
+    if np.iscomplexobj(x):
+        return convolve1d(x.real, w, axis=axis, mode='mirror', origin=origin) + \
+               1j * convolve1d(x.imag, w, axis=axis, mode='mirror', origin=origin)
+    return convolve1d(x, w, axis=axis, mode='mirror', origin=origin)
+
+
 def butter_lowpass(cutoff, fs, order=5):
     nyq = 0.5 * fs
     normal_cutoff = cutoff / nyq
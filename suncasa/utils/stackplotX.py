@@ -1,9 +1,11 @@
+import ast
 import gc
 import json
 import multiprocessing as mp
 import os
 import pickle
 import time
+import warnings
 from copy import deepcopy
 from functools import partial
 
@@ -112,26 +114,13 @@ def c_correlate(a, v, returnx=False):
 
 
 def XCorrMap(data, refpix=[0, 0]):
-    from tqdm import tqdm
     ny, nx, nt = data.shape
-    ccmax = np.empty((ny, nx))
-    ccmax[:] = np.nan
-    ccpeak = np.empty((ny, nx))
-    ccpeak[:] = np.nan
-
-    lc_ref = data[refpix[0], refpix[1], :]
-    for xidx in tqdm(range(0, ny - 1)):
-        for yidx in range(0, nx - 1):
-            lc = data[xidx, yidx, :]
-            ccval = c_correlate(lc, lc_ref)
-            if sum(lc) != 0:
-                cmax = np.nanmax(ccval)
-                cpeak = np.nanargmax(ccval) - (nt - 1) / 2
-            else:
-                cmax = 0
-                cpeak = 0
-            ccmax[xidx, yidx - 1] = cmax
-            ccpeak[xidx, yidx - 1] = cpeak
+    # the light curves of all pixels are correlated with the reference one in one batch
+    lc = data.reshape(ny * nx, nt)
+    cm, lag = DButil.c_correlate_batch(lc, data[refpix[0], refpix[1], :], subsample=False)
+    empty = np.sum(lc, axis=1) == 0
+    ccmax = np.where(empty, 0, cm[:, 0]).reshape(ny, nx)
+    ccpeak = np.where(empty, 0, lag[:, 0] + (nt // 2 - (nt - 1) / 2.)).reshape(ny, nx)
 
     return {'ny': ny, 'nx': nx, 'nt': nt, 'ccmax': ccmax, 'ccpeak': ccpeak}
 
@@ -142,24 +131,23 @@ def XCorrStackplt(z, x, y, doxscale=True):
     :param z: data
     :param x: x axis
     :param y: y axis
+    :param doxscale: if True, the lags are refined to sub-pixel precision and given in pixels of xfit,
+            a 10 times finer grid of x. Otherwise in pixels of x.
     :return:
     '''
-    from tqdm import tqdm
-    from scipy.interpolate import splev, splrep
+    y = np.asarray(y)
+    ny, nx = z.shape
     if doxscale:
         xfit = np.linspace(x[0], x[-1], 10 * len(x) + 1)
-        zfit = np.zeros((len(y), len(xfit)))
-        for yidx1, yq in enumerate(y):
-            xx = x
-            yy = z[yidx1, :]
-            s = len(yy)  # (len(yy) - np.sqrt(2 * len(yy)))*2
-            tck = splrep(xx, yy, s=s)
-            ys = splev(xfit, tck)
-            zfit[yidx1, :] = ys
     else:
         xfit = x
-        zfit = z
-    ny, nxfit = zfit.shape
+    nxfit = len(xfit)
+    cm, lag = DButil.c_correlate_batch(z, subsample=doxscale)
+    cpeak = lag * (nxfit - 1.) / (nx - 1.) + (nxfit // 2 - (nxfit - 1) / 2.)
+    empty = np.sum(z, axis=1) == 0
+    idx1, idx2 = np.tril_indices(ny, -1)
+    valid = ~(empty[idx1] | empty[idx2])
+
     ccpeak = np.empty((ny - 1, ny - 1))
     ccpeak[:] = np.nan
     ccmax = ccpeak.copy()
@@ -167,32 +155,14 @@ def XCorrStackplt(z, x, y, doxscale=True):
     yv = ccpeak.copy()
     yidxa = ccpeak.copy()
     yidxv = ccpeak.copy()
-    for idx1 in tqdm(range(1, ny)):
-        for idx2 in range(0, idx1):
-            lightcurve1 = zfit[idx1, :]
-            lightcurve2 = zfit[idx2, :]
-            ccval = c_correlate(lightcurve1, lightcurve2)
-            if sum(lightcurve1) != 0 and sum(lightcurve2) != 0:
-                cmax = np.amax(ccval)
-                cpeak = np.argmax(ccval) - (nxfit - 1) / 2
-            else:
-                cmax = 0
-                cpeak = 0
-            ccmax[idx2, idx1 - 1] = cmax
-            ccpeak[idx2, idx1 - 1] = cpeak
-            ya[idx2, idx1 - 1] = y[idx1 - 1]
-            yv[idx2, idx1 - 1] = y[idx2]
-            yidxa[idx2, idx1 - 1] = idx1 - 1
-            yidxv[idx2, idx1 - 1] = idx2
-            # if idx1 - 1 != idx2:
-            #     ccmax[idx1 - 1, idx2] = cmax
-            #     ccpeak[idx1 - 1, idx2] = cpeak
-            #     ya[idx1 - 1, idx2] = y[idx2]
-            #     yv[idx1 - 1, idx2] = y[idx1 - 1]
-            #     yidxa[idx1 - 1, idx2] = idx2
-            #     yidxv[idx1 - 1, idx2] = idx1 - 1
-
-    return {'zfit': zfit, 'ccmax': ccmax, 'ccpeak': ccpeak, 'x': x, 'nx': len(x), 'xfit': xfit, 'nxfit': nxfit, 'y': y,
+    ccmax[idx2, idx1 - 1] = np.where(valid, cm[idx1, idx2], 0)
+    ccpeak[idx2, idx1 - 1] = np.where(valid, cpeak[idx1, idx2], 0)
+    ya[idx2, idx1 - 1] = y[idx1 - 1]
+    yv[idx2, idx1 - 1] = y[idx2]
+    yidxa[idx2, idx1 - 1] = idx1 - 1
+    yidxv[idx2, idx1 - 1] = idx2
+
+    return {'zfit': z, 'ccmax': ccmax, 'ccpeak': ccpeak, 'x': x, 'nx': len(x), 'xfit': xfit, 'nxfit': nxfit, 'y': y,
             'ny': ny, 'yv': yv, 'ya': ya,
             'yidxv': yidxv, 'yidxa': yidxa}
 
@@ -241,6 +211,70 @@ def MakeSlit(pointDF):
     return cutslitplt
 
 
+def slit_pixels(cutslit, ndy, ndx, xrange=None, yrange=None):
+    """
+    Pixel indices of all the samples across the slit, the same as those stputils.improfile(interp='nearest')
+    samples point by point. Computed once for a slit and an image geometry, and reused for every frame.
+
+    Inputs:
+        cutslit: cutslit generated from CutslitBuilder().cutslitplt
+        ndy, ndx: dimension of the image
+        xrange, yrange: see getimprofile
+
+    return:
+        yi, xi: pixel indices of shape (len(cutslit['xcen']), nsample)
+        valid: boolean mask of the same shape. False for padding and for points whose cross-slit segment
+               is not entirely inside the image
+    """
+    if xrange is not None and yrange is not None:
+        xs0 = (cutslit['xs0'] - xrange[0]) / (xrange[1] - xrange[0]) * ndx
+        xs1 = (cutslit['xs1'] - xrange[0]) / (xrange[1] - xrange[0]) * ndx
+        ys0 = (cutslit['ys0'] - yrange[0]) / (yrange[1] - yrange[0]) * ndy
+        ys1 = (cutslit['ys1'] - yrange[0]) / (yrange[1] - yrange[0]) * ndy
+    else:
+        xs0 = cutslit['xs0']
+        xs1 = cutslit['xs1']
+        ys0 = cutslit['ys0']
+        ys1 = cutslit['ys1']
+    xs0, xs1, ys0, ys1 = [np.asarray(v, dtype=np.float64) for v in [xs0, xs1, ys0, ys1]]
+    inside = (0 < xs0) & (xs0 < ndx) & (0 < xs1) & (xs1 < ndx) & (0 < ys0) & (ys0 < ndy) & (0 < ys1) & (ys1 < ndy)
+    length = np.floor(np.hypot(xs1 - xs0, ys1 - ys0)).astype(int)
+    nsample = max(np.max(length), 1)
+    t = np.arange(nsample)[None, :]
+    div = np.maximum(length - 1, 1)[:, None]
+    # same arithmetic as np.linspace, including the exact end point
+    x = t * ((xs1 - xs0)[:, None] / div) + xs0[:, None]
+    y = t * ((ys1 - ys0)[:, None] / div) + ys0[:, None]
+    last = t == (length - 1)[:, None]
+    x = np.where(last & (length > 1)[:, None], xs1[:, None], x)
+    y = np.where(last & (length > 1)[:, None], ys1[:, None], y)
+    valid = (t < length[:, None]) & inside[:, None]
+    xi = np.clip(np.floor(np.where(valid, x, 0)).astype(int), 0, ndx - 1)
+    yi = np.clip(np.floor(np.where(valid, y, 0)).astype(int), 0, ndy - 1)
+    return yi, xi, valid
+
+
+def sample_slit(data, yi, xi, valid, get_peak=False):
+    """
+    Average (or peak) of the samples across the slit for every point along the slit
+
+    Inputs:
+        data: image data, (ny, nx) or (ny, nx, nwv). Masked pixels are ignored
+        yi, xi, valid: output of slit_pixels
+
+    return:
+        intensity along the slit, the shape is (len(yi), [nwv])
+    """
+    inten = np.ma.filled(np.ma.asarray(data[yi, xi], dtype=np.float64), np.nan)
+    inten[~valid] = np.nan
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        if get_peak:
+            return np.nanmax(inten, axis=1)
+        else:
+            return np.nanmean(inten, axis=1)
+
+
 def getimprofile(data, cutslit, xrange=None, yrange=None, get_peak=False, verbose=False):
     """
     Get values at a slice
@@ -263,12 +297,10 @@ def getimprofile(data, cutslit, xrange=None, yrange=None, get_peak=False, verbos
     # first, check the dimension of the input image data
     if data.ndim == 2:
         ndy, ndx = data.shape
-        intens = np.zeros(len(cutslit['xcen']))
         if verbose:
             print("Input data cube is 2D, the dimension (ny, nx) is ({0:d}, {1:d})".format(ndy, ndx))
     elif data.ndim == 3:
         ndy, ndx, nwv = data.shape
-        intens = np.zeros((len(cutslit['xcen']), nwv))
         if verbose:
             print("Input data cube is 3D, the dimension (ny, nx, nwv) is ({0:d}, {1:d}, {2:d})".format(ndy, ndx, nwv))
 
@@ -277,25 +309,8 @@ def getimprofile(data, cutslit, xrange=None, yrange=None, get_peak=False, verbos
         print("The slice should have at least two anchoring points! Return -1")
         return -1
     else:
-        if xrange is not None and yrange is not None:
-            xs0 = (cutslit['xs0'] - xrange[0]) / (xrange[1] - xrange[0]) * ndx
-            xs1 = (cutslit['xs1'] - xrange[0]) / (xrange[1] - xrange[0]) * ndx
-            ys0 = (cutslit['ys0'] - yrange[0]) / (yrange[1] - yrange[0]) * ndy
-            ys1 = (cutslit['ys1'] - yrange[0]) / (yrange[1] - yrange[0]) * ndy
-        else:
-            xs0 = cutslit['xs0']
-            xs1 = cutslit['xs1']
-            ys0 = cutslit['ys0']
-            ys1 = cutslit['ys1']
-        for ll in range(num):
-            inten = stpu.improfile(data, [xs0[ll], xs1[ll]], [ys0[ll], ys1[ll]], interp='nearest')
-            try:
-                if get_peak:
-                    intens[ll] = np.nanmax(inten, axis=0)
-                else:
-                    intens[ll] = np.nanmean(inten, axis=0)
-            except:
-                intens[ll] = np.nan
+        yi, xi, valid = slit_pixels(cutslit, ndy, ndx, xrange=xrange, yrange=yrange)
+        intens = sample_slit(data, yi, xi, valid, get_peak=get_peak)
         intensdist = {'x': cutslit['dist'], 'y': intens}
         return intensdist
 
@@ -373,6 +388,303 @@ def polyfit(x, y, length, deg):
     return {'xs': xs, 'ys': ys, 'rms': rms}
 
 
+def process_fitsmap(maptmp, fov=None, binpix=1, superpixel=False, normalize=True):
+    """
+    Crop a map to fov (in arcsec, [x0, x1, y0, y1]), rebin it by binpix and normalize it by the exposure time.
+    """
+    if fov:
+        x0, x1, y0, y1 = fov
+        try:
+            submaptmp = maptmp.submap(u.Quantity([x0 * u.arcsec, x1 * u.arcsec]),
+                                      top_right=u.Quantity([y0 * u.arcsec, y1 * u.arcsec]))
+        except:
+            from astropy.coordinates import SkyCoord
+            bl = SkyCoord(x0 * u.arcsec, y0 * u.arcsec, frame=maptmp.coordinate_frame)
+            tr = SkyCoord(x1 * u.arcsec, y1 * u.arcsec, frame=maptmp.coordinate_frame)
+            submaptmp = maptmp.submap(bl, top_right=tr)
+    else:
+        submaptmp = maptmp
+    if superpixel:
+        submaptmp = submaptmp.superpixel(u.Quantity((binpix * u.pix, binpix * u.pix)))
+        data = submaptmp.data / float(binpix ** 2)
+        submaptmp = sunpy.map.Map(data, submaptmp.meta)
+    else:
+        submaptmp = submaptmp.resample(u.Quantity(submaptmp.dimensions) / binpix)
+    if submaptmp.detector != 'HMI' and normalize:
+        try:
+            submaptmp = DButil.normalize_aiamap(submaptmp)
+        except:
+            data = submaptmp.data.copy().astype(float)
+            idxpix = ~np.isnan(data)
+            data[idxpix] = data[idxpix] / submaptmp.exposure_time.value
+            data[data < 0] = 0
+            submaptmp.meta['exptime'] = 1.0
+            submaptmp = sunpy.map.Map(data, submaptmp.meta)
+    return submaptmp
+
+
+def _fitsframe_cachefile(ll, cachedir, **kwargs):
+    """
+    Name of the cache file of a processed frame. The key is the absolute path and modification time of the
+    fits file and the processing parameters, so a changed file or field of view gives a new entry.
+    """
+    import hashlib
+    ll = os.path.abspath(ll)
+    key = [ll, '{:.6f}'.format(os.path.getmtime(ll))] + ['{}={}'.format(k, kwargs[k]) for k in sorted(kwargs)]
+    h = hashlib.sha1('|'.join(key).encode()).hexdigest()
+    return os.path.join(cachedir, '{}_{}.frame'.format(os.path.basename(ll), h[:16]))
+
+
+def load_fitsframe(ll, fov=None, binpix=1, superpixel=False, aia_prep=False, dtype=None, normalize=True,
+                   cachedir=None):
+    """
+    Read a fits file, and crop, rebin and exposure-normalize the map as in Stackplot.make_mapseq.
+    If cachedir is given, the processed frame is kept there and reused on the next call with the same parameters.
+    :return: data, meta and original exposure time of the frame. The map is not built here so that the frame
+             is cheap to send back from a worker process.
+    """
+    if cachedir:
+        cachefile = _fitsframe_cachefile(ll, cachedir, fov=fov, binpix=binpix, superpixel=superpixel,
+                                         aia_prep=aia_prep, dtype=dtype, normalize=normalize)
+        if os.path.exists(cachefile):
+            try:
+                with open(cachefile, 'rb') as sf:
+                    return pickle.load(sf)
+            except Exception:
+                pass
+    maptmp = sunpy.map.Map(ll)
+    if type(maptmp) is list:
+        maptmp = maptmp[0]
+    exptime_orig = maptmp.exposure_time.value
+    if dtype is not None:
+        maptmp = sunpy.map.Map(maptmp.data.astype(dtype), maptmp.meta)
+    if aia_prep:
+        maptmp = aiaprep(maptmp)
+    submaptmp = process_fitsmap(maptmp, fov=fov, binpix=binpix, superpixel=superpixel, normalize=normalize)
+    frame = (submaptmp.data, dict(submaptmp.meta), exptime_orig)
+    if cachedir:
+        # write under a temporary name so that concurrent workers never read a partial file
+        tmpfile = '{}.{}.tmp'.format(cachefile, os.getpid())
+        with open(tmpfile, 'wb') as sf:
+            pickle.dump(frame, sf, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpfile, cachefile)
+    return frame
+
+
+def _meta_table(metas):
+    """
+    Pack the meta dictionaries of a list of maps into a structured array, one row per map.
+    Numbers and booleans are stored natively, everything else as utf-8 JSON strings so that None, lists,
+    dicts (e.g., keycomments) and the columns of mixed types are restored with their types.
+    :return: the structured array, and a boolean mask (nmap, nkey) of the keys present in each map
+    """
+    keys = []
+    for meta in metas:
+        for key in meta.keys():
+            if key not in keys:
+                keys.append(key)
+    dtypes = []
+    for key in keys:
+        vals = [meta[key] for meta in metas if key in meta]
+        if all(isinstance(v, (bool, np.bool_)) for v in vals):
+            dtypes.append((key, '?'))
+        elif all(isinstance(v, (int, np.integer)) and not isinstance(v, (bool, np.bool_)) for v in vals):
+            dtypes.append((key, 'i8'))
+        elif all(isinstance(v, (int, float, np.integer, np.floating)) and not isinstance(v, (bool, np.bool_))
+                 for v in vals):
+            dtypes.append((key, 'f8'))
+        else:
+            nchar = max([len(_meta_json(v)) for v in vals] + [1])
+            dtypes.append((key, 'S{}'.format(nchar)))
+    table = np.zeros(len(metas), dtype=dtypes)
+    mask = np.zeros((len(metas), len(keys)), dtype=bool)
+    for i, meta in enumerate(metas):
+        for k, (key, dt) in enumerate(dtypes):
+            if key in meta:
+                mask[i, k] = True
+                table[key][i] = _meta_json(meta[key]) if dt.startswith('S') else meta[key]
+    return table, mask
+
+
+def _meta_json_default(obj):
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    raise TypeError('{} is not JSON serializable'.format(type(obj).__name__))
+
+
+def _meta_json(val):
+    try:
+        return json.dumps(val, default=_meta_json_default).encode('utf-8')
+    except (TypeError, ValueError):
+        # e.g., astropy objects, kept as their string as before
+        return str(val).encode('utf-8')
+
+
+def _meta_from_table(row, mask):
+    meta = {}
+    for k, key in enumerate(row.dtype.names):
+        if mask[k]:
+            val = row[key]
+            if isinstance(val, bytes):
+                val = val.decode('utf-8')
+                try:
+                    meta[key] = json.loads(val)
+                except ValueError:
+                    # values that were not JSON serializable, and the files written with plain strings
+                    meta[key] = _parse_meta_value(val)
+            else:
+                meta[key] = val.item()
+    return meta
+
+
+def _parse_meta_value(val):
+    # meta values of the per-map layout were stored as strings, restore the numbers without eval
+    try:
+        return ast.literal_eval(val)
+    except (ValueError, SyntaxError):
+        return val
+
+
+class LazyMapList(object):
+    """
+    Read-only list of the maps in a chunked HDF5 map sequence file. The meta table is read once,
+    the data of a frame is read and the map is built only when the frame is accessed.
+    """
+
+    def __init__(self, infile):
+        self.infile = infile
+        with h5py.File(infile, 'r') as hf:
+            group = hf['map_sequence']
+            self.table = group['meta'][:]
+            self.mask = group['meta_mask'][:]
+            self.shape = group['data'].shape
+        self.index = np.arange(self.shape[0])
+        self._hf = None
+
+    def _subset(self, index):
+        new = object.__new__(LazyMapList)
+        new.__dict__.update(self.__dict__)
+        new.index = index
+        new._hf = None
+        return new
+
+    @property
+    def dataset(self):
+        if self._hf is None:
+            self._hf = h5py.File(self.infile, 'r')
+        return self._hf['map_sequence']['data']
+
+    def meta(self, key):
+        i = self.index[key]
+        return _meta_from_table(self.table[i], self.mask[i])
+
+    def data(self, key=slice(None)):
+        """data of the frames, without building the maps"""
+        index = self.index[key]
+        if np.ndim(index) == 0:
+            return self.dataset[index]
+        if len(index) and np.all(np.diff(index) == 1):
+            return self.dataset[index[0]:index[-1] + 1]
+        return np.array([self.dataset[i] for i in index])
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return sunpy.map.Map(self.data(key), self.meta(key))
+        return self._subset(self.index[key])
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self[k]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_hf'] = None
+        return state
+
+
+class LazyMapSequence(MapSequence):
+    """
+    MapSequence view of a chunked HDF5 map sequence file (see Stackplot.mapseq_tofile).
+    Opening is instant whatever the size of the file, only the frames that are accessed are decoded.
+    The maps are decoded anew at each access, use MapSequence(list(lazymapseq)) to get an in-memory copy.
+    """
+
+    def __init__(self, maps):
+        if not isinstance(maps, LazyMapList):
+            maps = LazyMapList(maps)
+        self.maps = maps
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.maps[key]
+        return LazyMapSequence(self.maps[key])
+
+    def __len__(self):
+        return len(self.maps)
+
+    def __deepcopy__(self, memo):
+        # frames are decoded from the file at each access, a copy of the view is as good as a deep copy
+        return LazyMapSequence(self.maps[:])
+
+    def all_maps_same_shape(self):
+        return True
+
+    def as_array(self):
+        return np.moveaxis(self.maps.data(), 0, -1)
+
+
+def ref_frame_index(t, dt):
+    """
+    Index of the reference frame of each frame for running difference: the frame closest in time to t - dt,
+    or the previous frame if that is the frame itself.
+    :param t: times of the frames
+    :param dt: time lag, in the unit of t
+    """
+    t = np.asarray(t, dtype=float)
+    nt = len(t)
+    if nt < 2:
+        return np.zeros(nt, dtype=int)
+    order = np.argsort(t, kind='stable')
+    ts = t[order]
+    target = t - dt
+    j = np.clip(np.searchsorted(ts, target), 1, nt - 1)
+    sidx = np.where(np.abs(ts[j - 1] - target) <= np.abs(ts[j] - target), j - 1, j)
+    # the first of the frames with the same time, as np.argmin does
+    sidx = order[np.searchsorted(ts, ts[sidx])]
+    idx = np.arange(nt)
+    sidx[(sidx == idx) & (idx > 0)] -= 1
+    return sidx
+
+
+def filter_frames(cube, gaussfilt=None, medfilt=None):
+    """
+    Spatial smoothing of a stack of frames (nt, ny, nx), each frame on its own.
+    :param gaussfilt: sigma of the gaussian filter in pixels, as scipy.ndimage.gaussian_filter with mode='nearest'
+    :param medfilt: kernel size of the median filter, as scipy.signal.medfilt
+    """
+    from scipy import ndimage
+    if gaussfilt:
+        cube = ndimage.gaussian_filter(cube, (0,) + tuple(np.broadcast_to(gaussfilt, 2)), mode='nearest')
+    if medfilt:
+        cube = ndimage.median_filter(cube, size=(1,) + tuple(np.broadcast_to(medfilt, 2)), mode='constant')
+    return cube
+
+
+def _mapseq_data(mapseq, index):
+    if isinstance(mapseq, LazyMapSequence):
+        return mapseq.maps.data(index).astype(float)
+    return np.array([mapseq[i].data for i in index], dtype=float)
+
+
+def _mapseq_meta(mapseq, idx):
+    if isinstance(mapseq, LazyMapSequence):
+        return mapseq.maps.meta(idx)
+    return mapseq[idx].meta
+
+
 class LightCurveBuilder:
     def __init__(self, stackplt, axes, scale=1.0, color='white'):
         self.stackplt = stackplt
@@ -1138,7 +1450,13 @@ class Stackplot:
     def make_mapseq(self, trange, outfile=None, fov=None, wavelength='171', binpix=1, dt_data=1, derotate=False,
                     tosave=True, hdf5=False, superpixel=False, aia_prep=False, mapinterp=False, overwrite=False,
                     dtype=None,
-                    normalize=True):
+                    normalize=True, ncpu=None, cachedir=None):
+        '''
+        Make a mapseq from the SDO fits files in a time range.
+        :param ncpu: number of processes to read and process the fits files. Default is the number of cpus minus one
+        :param cachedir: directory to keep the processed frames. A frame is reused when the fits file, fov, binpix and
+                         processing options are unchanged, so remaking a mapseq of the same fov skips the fits decoding
+        '''
         if not overwrite:
             if outfile is not None:
                 if os.path.exists(outfile):
@@ -1166,8 +1484,9 @@ class Stackplot:
         maplist = []
         self.exptime_orig = []
         print('Loading fits files....')
-        for idx, ll in enumerate(tqdm(fitsfile[::dt_data])):
-            if mapinterp:
+        if mapinterp:
+            # every frame is interpolated onto the pixel grid of the first one, load them in order
+            for idx, ll in enumerate(tqdm(fitsfile[::dt_data])):
                 maptmp = sunpy.map.Map(ll)
                 if type(maptmp) is list:
                     maptmp = maptmp[0]
@@ -1175,55 +1494,43 @@ class Stackplot:
                     all_coord = sunpy.map.all_coordinates_from_map(maptmp)
                     meta0 = deepcopy(maptmp.meta)
                 else:
-                    # print('1',meta0['date-obs'])
                     meta0.update({'date-obs': maptmp.meta['date-obs']})
                     meta0.update({'date_obs': maptmp.meta['date_obs']})
                     meta0.update({'date_end': maptmp.meta['date_end']})
-                    # print('2',meta0['date-obs'])
                     maptmp = sunpy.map.Map(map_interp(maptmp, all_coord), meta0)
-                    # print('3',meta0['date-obs'])
-
-            else:
-                maptmp = sunpy.map.Map(ll)
-                if type(maptmp) is list:
-                    maptmp = maptmp[0]
-            self.exptime_orig.append(maptmp.exposure_time.value)
-            if dtype is not None:
-                maptmp = sunpy.map.Map(maptmp.data.astype(dtype), maptmp.meta)
-            if aia_prep:
-                maptmp = aiaprep(maptmp)
-            if fov:
-                x0, x1, y0, y1 = fov
-                try:
-                    submaptmp = maptmp.submap(u.Quantity([x0 * u.arcsec, x1 * u.arcsec]),
-                                              top_right=u.Quantity([y0 * u.arcsec, y1 * u.arcsec]))
-                except:
-                    from astropy.coordinates import SkyCoord
-                    bl = SkyCoord(x0 * u.arcsec, y0 * u.arcsec, frame=maptmp.coordinate_frame)
-                    tr = SkyCoord(x1 * u.arcsec, y1 * u.arcsec, frame=maptmp.coordinate_frame)
-                    submaptmp = maptmp.submap(bl, top_right=tr)
-            else:
-                submaptmp = maptmp
-            if superpixel:
-                submaptmp = submaptmp.superpixel(u.Quantity((binpix * u.pix, binpix * u.pix)))
-                data = submaptmp.data / float(binpix ** 2)
-                submaptmp = sunpy.map.Map(data, submaptmp.meta)
-            else:
-                submaptmp = submaptmp.resample(u.Quantity(submaptmp.dimensions) / binpix)
-            if submaptmp.detector == 'HMI':
-                pass
+                self.exptime_orig.append(maptmp.exposure_time.value)
+                if dtype is not None:
+                    maptmp = sunpy.map.Map(maptmp.data.astype(dtype), maptmp.meta)
+                if aia_prep:
+                    maptmp = aiaprep(maptmp)
+                maptmp = process_fitsmap(maptmp, fov=fov, binpix=binpix, superpixel=superpixel, normalize=normalize)
+                maplist.append(maptmp)
+        else:
+            if cachedir:
+                if not os.path.exists(cachedir):
+                    os.makedirs(cachedir)
+            load_fitsframe_partial = partial(load_fitsframe, fov=fov, binpix=binpix, superpixel=superpixel,
+                                             aia_prep=aia_prep, dtype=dtype, normalize=normalize, cachedir=cachedir)
+            files = fitsfile[::dt_data]
+            if ncpu is None:
+                ncpu = mp.cpu_count() - 1
+            ncpu = max(1, min(ncpu, len(files)))
+            pool = None
+            if ncpu == 1:
+                frames = map(load_fitsframe_partial, files)
             else:
-                if normalize:
-                    try:
-                        submaptmp = DButil.normalize_aiamap(submaptmp)
-                    except:
-                        data = submaptmp.data.copy().astype(float)
-                        idxpix = ~np.isnan(data)
-                        data[idxpix] = data[idxpix] / submaptmp.exposure_time.value
-                        data[data < 0] = 0
-                        submaptmp.meta['exptime'] = 1.0
-                        submaptmp = sunpy.map.Map(data, submaptmp.meta)
-            maplist.append(submaptmp)
+                pool = mp.Pool(ncpu)
+                # imap keeps the file order and lets the maps be built while the workers read the next files
+                frames = pool.imap(load_fitsframe_partial, files, chunksize=max(1, len(files) // (ncpu * 8)))
+            try:
+                for data, meta, exptime in tqdm(frames, total=len(files)):
+                    self.exptime_orig.append(exptime)
+                    maplist.append(sunpy.map.Map(data, meta))
+            finally:
+                # as on leaving a `with mp.Pool()` block, so that the workers are not left behind on an error
+                if pool is not None:
+                    pool.terminate()
+                    pool.join()
         if derotate:
             mapseq = mapsequence_solar_derotate(sunpy.map.Map(maplist, sequence=True))
         else:
@@ -1252,38 +1559,50 @@ class Stackplot:
             self.mapseq_tofile(outfile, hdf5=hdf5)
         gc.collect()
 
-    def mapseq_fromfile(self, infile):
+    def mapseq_fromfile(self, infile, lazy=True):
+        '''
+        Load a mapseq saved by mapseq_tofile.
+        :param lazy: for an HDF5 file with all frames in a single dataset, return a LazyMapSequence that only
+                     reads the frames that are accessed. Otherwise all the maps are loaded into memory
+        '''
         t0 = time.time()
-        if infile.endswith('.h5'):
+        if h5py.is_hdf5(infile):
             with h5py.File(infile, 'r') as hf:
                 # Load the map sequence
                 map_group = hf['map_sequence']
-                mapseq = []
-                for i in range(len(map_group)):
-                    # print(f'Loading map_{i}....')
-                    if f'map_{i}' not in map_group: continue
-                    subgroup = map_group[f'map_{i}']
-                    data = subgroup['data'][:]
-                    # Deserialize JSON string to dictionary
-                    meta = json.loads(subgroup.attrs['meta'])
-                    # Convert meta back to the correct types as needed
-                    for key, val in meta.items():
-                        try:
-                            # Attempt to interpret stringified numbers properly
-                            meta[key] = eval(val)
-                        except:
-                            continue
-                    mapseq.append(sunpy.map.Map(data, meta))
-                self.mapseq = sunpy.map.Map(mapseq, sequence=True)
+                cube = 'data' in map_group
+                if not cube:
+                    mapseq = []
+                    for i in range(len(map_group)):
+                        # print(f'Loading map_{i}....')
+                        if f'map_{i}' not in map_group: continue
+                        subgroup = map_group[f'map_{i}']
+                        data = subgroup['data'][:]
+                        # Deserialize JSON string to dictionary
+                        meta = json.loads(subgroup.attrs['meta'])
+                        # Convert meta back to the correct types as needed
+                        for key, val in meta.items():
+                            meta[key] = _parse_meta_value(val)
+                        mapseq.append(sunpy.map.Map(data, meta))
+                    self.mapseq = sunpy.map.Map(mapseq, sequence=True)
 
                 # Load additional information
                 if 'additional_info' in hf.keys():
                     info_group = hf['additional_info']
-                    self.dt_data = info_group.attrs.get('dt_data', None)
-                    self.fitsfile = info_group.attrs.get('fitsfile', None)
-                    self.exptime_orig = np.array(info_group.attrs.get('exptime_orig', []))
-                    self.fov = info_group.attrs.get('fov', None)
-                    self.binpix = info_group.attrs.get('binpix', None)
+                    info = dict(info_group.attrs.items())
+                    for key in info_group.keys():
+                        info[key] = info_group[key][()]
+                        if isinstance(info[key], np.ndarray) and info[key].dtype.kind in 'OS':
+                            info[key] = info[key].astype(str)
+                    self.dt_data = info.get('dt_data', None)
+                    self.fitsfile = info.get('fitsfile', None)
+                    self.exptime_orig = np.array(info.get('exptime_orig', []))
+                    self.fov = info.get('fov', None)
+                    self.binpix = info.get('binpix', None)
+            if cube:
+                self.mapseq = LazyMapSequence(infile)
+                if not lazy:
+                    self.mapseq = MapSequence(list(self.mapseq))
         else:
             with open(infile, 'rb') as sf:
                 print('Loading mapseq....')
@@ -1316,7 +1635,13 @@ class Stackplot:
         self.mapseq_info()
         print('It took {} to load the mapseq.'.format(time.time() - t0))
 
-    def mapseq_tofile(self, outfile=None, mapseq=None, hdf5=False):
+    def mapseq_tofile(self, outfile=None, mapseq=None, hdf5=False, compression='gzip'):
+        '''
+        Save a mapseq to a pickle file, or to an HDF5 file if hdf5 is True.
+        In the HDF5 file, maps of the same shape are stored in a single (nt, ny, nx) dataset with one chunk per frame,
+        and their meta in a structured table, so that the file can be opened lazily by mapseq_fromfile.
+        :param compression: compression filter of the HDF5 dataset, e.g., 'gzip' or 'lzf'. None for no compression
+        '''
         t0 = time.time()
         if not mapseq:
             mapseq = self.mapseq
@@ -1331,12 +1656,27 @@ class Stackplot:
             with h5py.File(outfile, 'w') as hf:
                 # Create a group for the map sequence
                 map_group = hf.create_group('map_sequence')
-                for i, smap in enumerate(mapseq):
-                    subgroup = map_group.create_group(f'map_{i}')
-                    subgroup.create_dataset('data', data=smap.data, compression='gzip', compression_opts=9)
-                    # Serialize meta dictionary into JSON and store as a string in a single attribute
-                    meta_str = json.dumps({key: str(value) for key, value in smap.meta.items()})
-                    subgroup.attrs['meta'] = meta_str
+                if len(set(smap.data.shape for smap in mapseq)) == 1:
+                    smap = mapseq[0]
+                    nt = len(mapseq)
+                    ny, nx = smap.data.shape
+                    dset = map_group.create_dataset('data', shape=(nt, ny, nx), dtype=smap.data.dtype,
+                                                    chunks=(1, ny, nx), compression=compression)
+                    metas = []
+                    for i, smap in enumerate(mapseq):
+                        dset[i] = smap.data
+                        metas.append(dict(smap.meta))
+                    table, mask = _meta_table(metas)
+                    map_group.create_dataset('meta', data=table)
+                    map_group.create_dataset('meta_mask', data=mask)
+                else:
+                    # maps of different shapes, one group per map
+                    for i, smap in enumerate(mapseq):
+                        subgroup = map_group.create_group(f'map_{i}')
+                        subgroup.create_dataset('data', data=smap.data, compression=compression)
+                        # Serialize meta dictionary into JSON and store as a string in a single attribute
+                        meta_str = json.dumps({key: str(value) for key, value in smap.meta.items()})
+                        subgroup.attrs['meta'] = meta_str
 
                 # Store additional information
                 info_group = hf.create_group('additional_info')
@@ -1346,7 +1686,7 @@ class Stackplot:
                 for key, value in info.items():
                     if isinstance(value, (np.ndarray, list)):  # Handle list and arrays specifically
                         info_group.create_dataset(key, data=value)
-                    else:
+                    elif value is not None:
                         info_group.attrs[key] = value
         else:
             with open(outfile, 'wb') as sf:
@@ -1404,7 +1744,8 @@ class Stackplot:
         return mapseq_diff
 
     def mapseq_mkdiff(self, mode='rdiff', dt=36., medfilt=None, gaussfilt=None, bfilter=False, lowcut=1 / 10 / 60.,
-                      highcut=1 / 1 / 60., window=[None, None], outfile=None, tosave=False, dtype=None, hdf5=False, normalize=True):
+                      highcut=1 / 1 / 60., window=[None, None], outfile=None, tosave=False, dtype=None, hdf5=False, normalize=True,
+                      maxmem=2048):
         '''
 
         :param mode: accept modes: rdiff, rratio, bdiff, bratio, dtrend, dtrend_diff, dtrend_ratio
@@ -1416,6 +1757,7 @@ class Stackplot:
         :param highcut: high cutoff frequency in Hz
         :param outfile:
         :param tosave:
+        :param maxmem: memory limit in MB of the working cube. Longer sequences are processed in blocks of frames
         :return:
         '''
         if dtype is None:
@@ -1423,38 +1765,44 @@ class Stackplot:
         self.mapseq_diff = None
         # modes = {0: 'rdiff', 1: 'rratio', 2: 'bdiff', 3: 'bratio'}
         maplist = []
-        datacube = self.mapseq.as_array().astype(float)
-        if gaussfilt:
-            from scipy.ndimage import gaussian_filter
-            print('gaussian filtering map.....')
-            for idx, ll in enumerate(tqdm(self.mapseq)):
-                datacube[:, :, idx] = gaussian_filter(datacube[:, :, idx], gaussfilt, mode='nearest')
-        if medfilt:
-            print('median filtering map.....')
-            for idx, ll in enumerate(tqdm(self.mapseq)):
-                datacube[:, :, idx] = signal.medfilt(datacube[:, :, idx], medfilt)
-        print('making the diff mapseq.....')
         tplt = self.tplt.jd
+        nt = len(self.mapseq)
         if mode in ['rdiff', 'rratio', 'bdiff', 'bratio']:
-            for idx, ll in enumerate(tqdm(self.mapseq)):
-                maplist.append(deepcopy(ll))
-                tjd_ = tplt[idx]
-                sidx = np.argmin(np.abs(tplt - (tjd_ - dt / 3600. / 24.)))
-                if sidx==idx and idx>0:
-                    sidx=idx-1
-                print(f'time difference between {idx} and {sidx} is {(tplt[idx] - tplt[sidx])*24*3600}')
-                if mode == 'rdiff':
-                    mapdata = datacube[:, :, idx] - datacube[:, :, sidx]
-                    mapdata[np.isnan(mapdata)] = 0.0
-                elif mode == 'rratio':
-                    mapdata = datacube[:, :, idx].astype(float) / datacube[:, :, sidx].astype(float)
-                    mapdata[np.isnan(mapdata)] = 1.0
-                elif mode == 'bdiff':
-                    mapdata = datacube[:, :, idx] - datacube[:, :, 0]
-                elif mode == 'bratio':
-                    mapdata = datacube[:, :, idx].astype(float) / datacube[:, :, 0].astype(float)
-                maplist[idx] = sunpy.map.Map(mapdata.astype(dtype), maplist[idx].meta)
+            if mode.startswith('b'):
+                sidx = np.zeros(nt, dtype=int)
+            else:
+                sidx = ref_frame_index(tplt, dt / 3600. / 24.)
+                tdif = (tplt - tplt[sidx])[1:] * 24 * 3600
+                if len(tdif):
+                    print('time difference between the frames and their reference frames is {:.1f} to {:.1f} s'.format(
+                        tdif.min(), tdif.max()))
+            ny, nx = self.mapseq[0].data.shape
+            # frames of a block plus up to as many reference frames, in float
+            nblk = int(max(1, min(nt, maxmem * 2 ** 20 // (ny * nx * 8 * 2))))
+            if gaussfilt or medfilt:
+                print('filtering map.....')
+            print('making the diff mapseq.....')
+            for b in tqdm(range(0, nt, nblk)):
+                e = min(b + nblk, nt)
+                # load and filter each frame needed by the block once, then difference with fancy indexing
+                index = np.unique(np.hstack((np.arange(b, e), sidx[b:e])))
+                cube = filter_frames(_mapseq_data(self.mapseq, index), gaussfilt=gaussfilt, medfilt=medfilt)
+                pos = np.searchsorted(index, np.arange(b, e))
+                spos = np.searchsorted(index, sidx[b:e])
+                if mode.endswith('diff'):
+                    mapdata = cube[pos] - cube[spos]
+                    if mode == 'rdiff':
+                        mapdata[np.isnan(mapdata)] = 0.0
+                else:
+                    mapdata = cube[pos] / cube[spos]
+                    if mode == 'rratio':
+                        mapdata[np.isnan(mapdata)] = 1.0
+                mapdata = mapdata.astype(dtype)
+                for k, idx in enumerate(range(b, e)):
+                    maplist.append(sunpy.map.Map(mapdata[k], _mapseq_meta(self.mapseq, idx)))
         elif mode.startswith('dtrend'):
+            datacube = np.moveaxis(filter_frames(_mapseq_data(self.mapseq, np.arange(nt)), gaussfilt=gaussfilt,
+                                                 medfilt=medfilt), 0, -1)
             datacube_ft = np.zeros_like(datacube)
             ny, nx, nt = datacube_ft.shape
             ncpu = mp.cpu_count() - 1
@@ -1814,6 +2162,11 @@ class Stackplot:
             movingcut = [np.zeros(nframe), np.zeros(nframe)]
         else:
             pass
+        cutslitplt = self.cutslitbd.cutslitplt
+        if len(cutslitplt['xcen']) < 2:
+            print("The slice should have at least two anchoring points!")
+            return mapseq
+        slitgeo = {}
         for idx, smap in enumerate(tqdm(mapseq)):
             if frm_range[0] <= idx <= frm_range[-1]:
                 data = smap.data.copy()
@@ -1841,12 +2194,18 @@ class Stackplot:
                         pass
                 else:
                     fov = stpu.get_map_corner_coord(smap)
-                intens = getimprofile(data, self.cutslitbd.cutslitplt, xrange=fov[:2].value + movingcut[0][idx],
-                                      yrange=fov[2:].value + movingcut[1][idx], get_peak=get_peak)
+                # the slit geometry is computed once and reused for all frames with the same field of view
+                xrange = fov[:2].value + movingcut[0][idx]
+                yrange = fov[2:].value + movingcut[1][idx]
+                geokey = (data.shape, tuple(xrange), tuple(yrange))
+                if geokey not in slitgeo:
+                    slitgeo[geokey] = slit_pixels(cutslitplt, data.shape[0], data.shape[1], xrange=xrange,
+                                                  yrange=yrange)
+                intens = sample_slit(data, *slitgeo[geokey], get_peak=get_peak)
                 if negval:
-                    stackplt.append(-intens['y'])
+                    stackplt.append(-intens)
                 else:
-                    stackplt.append(intens['y'])
+                    stackplt.append(intens)
             else:
                 stackplt.append(np.zeros_like(self.cutslitbd.cutslitplt['dist']) * np.nan)
                 maplist.append(mapseq[idx])
@@ -0,0 +1,162 @@
+"""
+Regression tests of the batched NumPy polynomial fits of fit_planet_position against the legacy pure Python
+routines (svdfit, svdvar) on synthetic ephemerides.
+"""
+import time
+
+import numpy as np
+import pytest
+
+from suncasa.utils import fit_planet_position as fp
+
+NPOLYMAX = 7
+ASEC2RAD = 2.0626480624710e5
+
+
+def legacy_series_fit(time_array, values, npoly, allowed_error):
+    # the fitting loop that fit_planet_positions ran for each of ra, dec and distance
+    sig = [values[0] / 1000.0] * len(values)
+    max_difn = allowed_error + 1.0
+    while max_difn > allowed_error and npoly <= NPOLYMAX:
+        (coef, uu, vt, ww, chisq) = fp.svdfit(time_array, values, sig, npoly)
+        cvm = fp.svdvar(vt, ww, npoly)
+        max_difn = 0.0
+        for ii in range(len(time_array)):
+            model = 0.0
+            for jj in range(npoly):
+                model += coef[jj] * pow(time_array[ii], jj)
+            max_difn = max(max_difn, abs(model - values[ii]))
+        npoly += 1
+    npoly -= 1
+    failed = npoly == NPOLYMAX and max_difn > allowed_error
+    return coef, cvm, failed
+
+
+def legacy_fit_planet_positions(times, ras, decs, distances=None, allowed_error=0.01):
+    # the previous fit_planet_positions over the whole table, with the covariance matrices appended
+    times = np.array(times)
+    end_index = len(times) - 1
+    times_slice = times[:end_index]
+    t0 = times_slice[int(len(times_slice) / 2)]
+    time_array = list(times_slice - t0)
+    allowed_error /= ASEC2RAD
+    result = [0, t0]
+    cvms = []
+    series = [(ras, 2, allowed_error, 1), (decs, 1, allowed_error, 2)]
+    if distances:
+        series.append((distances, 1, 1.0e-8, 4))
+    for values, npoly, error, bit in series:
+        coef, cvm, failed = legacy_series_fit(time_array, list(values[:end_index]), npoly, error)
+        if failed:
+            result[0] += bit
+        result.append(coef)
+        cvms.append(np.array(cvm))
+    result.append(cvms)
+    return result
+
+
+def synthetic_ephemeris(rng, nt, ra_noise=0., dec_noise=0., distance_noise=0.):
+    times = 60000. + np.arange(nt) / 1440. * rng.uniform(1, 30)
+    tt = times - times[0]
+    ras = (rng.uniform(0.5, 6) + rng.normal(0, 1e-2) * tt + rng.normal(0, 1e-3) * tt ** 2
+           + rng.normal(0, 1e-8) * np.sin(tt * rng.uniform(1, 10)) + rng.normal(0, ra_noise, nt))
+    decs = (rng.uniform(-0.4, 0.4) + rng.normal(0, 1e-2) * tt + rng.normal(0, 1e-8) * np.cos(tt * rng.uniform(1, 10))
+            + rng.normal(0, dec_noise, nt))
+    distances = 1 + 0.01 * np.sin(tt) + rng.normal(0, distance_noise, nt)
+    return list(times), list(ras), list(decs), list(distances)
+
+
+def assert_same_fit(legacy, new):
+    assert new[0] == legacy[0]
+    assert new[1] == legacy[1]
+    assert len(new) == len(legacy)
+    for coef_legacy, coef_new, cvm_legacy, cvm_new in zip(legacy[2:-1], new[2:-1], legacy[-1], new[-1]):
+        assert len(coef_new) == len(coef_legacy)
+        np.testing.assert_allclose(coef_new, coef_legacy, rtol=1e-6, atol=1e-12 * np.max(np.abs(coef_legacy)))
+        # the differences in the units of the standard deviations, as the near-zero cross terms of the
+        # ill-conditioned high order fits are dominated by roundoff
+        sigma = np.sqrt(np.diag(cvm_legacy))
+        np.testing.assert_allclose(np.diag(cvm_new), np.diag(cvm_legacy), rtol=1e-5)
+        assert np.max(np.abs(cvm_new - cvm_legacy) / np.outer(sigma, sigma)) < 1e-5
+
+
+@pytest.mark.parametrize('allowed_error', [0.01, 0.05, 1.])
+def test_fit_planet_positions_random(allowed_error):
+    rng = np.random.default_rng(int(allowed_error * 100))
+    for _ in range(10):
+        times, ras, decs, distances = synthetic_ephemeris(rng, rng.integers(10, 120))
+        legacy = legacy_fit_planet_positions(times, ras, decs, distances=distances, allowed_error=allowed_error)
+        new = fp.fit_planet_positions(times, ras, decs, distances=distances, allowed_error=allowed_error,
+                                      return_covariance=True)
+        assert_same_fit(legacy, new)
+
+
+def test_fit_planet_positions_without_distance():
+    rng = np.random.default_rng(1)
+    times, ras, decs, _ = synthetic_ephemeris(rng, 60)
+    legacy = legacy_fit_planet_positions(times, ras, decs)
+    new = fp.fit_planet_positions(times, ras, decs, return_covariance=True)
+    assert len(new) == 5
+    assert_same_fit(legacy, new)
+    # without return_covariance, the coefficients are returned as lists as before
+    new = fp.fit_planet_positions(times, ras, decs)
+    assert len(new) == 4
+    assert isinstance(new[2], list) and isinstance(new[3], list)
+
+
+@pytest.mark.parametrize('noise, status', [((0., 0., 0.), 0),
+                                           ((1e-5, 0., 0.), 1),
+                                           ((0., 1e-5, 0.), 2),
+                                           ((1e-5, 1e-5, 0.), 3),
+                                           ((0., 0., 1e-7), 4),
+                                           ((1e-5, 0., 1e-7), 5),
+                                           ((0., 1e-5, 1e-7), 6),
+                                           ((1e-5, 1e-5, 1e-7), 7)])
+def test_fit_planet_positions_status(noise, status):
+    # the noise added to ra, dec or distance can not be fitted within the allowed errors
+    rng = np.random.default_rng(status)
+    times, ras, decs, distances = synthetic_ephemeris(rng, 50, *noise)
+    legacy = legacy_fit_planet_positions(times, ras, decs, distances=distances)
+    new = fp.fit_planet_positions(times, ras, decs, distances=distances, return_covariance=True)
+    assert legacy[0] == status
+    assert_same_fit(legacy, new)
+
+
+def test_fit_planet_positions_out_of_range():
+    rng = np.random.default_rng(2)
+    times, ras, decs, _ = synthetic_ephemeris(rng, 20)
+    assert fp.fit_planet_positions(times, ras, decs, start_time=times[0] - 1., end_time=times[-1]) == [8]
+
+
+def test_polyfit_batch_svdfit():
+    rng = np.random.default_rng(3)
+    x = np.linspace(-0.05, 0.05, 40)
+    y = (1 + 2 * x + 3 * x ** 2)[:, None] + rng.normal(0, 1e-3, (len(x), 5))
+    sig = rng.uniform(1e-3, 2e-3, y.shape)
+    coef, cvm, chisq = fp.polyfit_batch(x, y, 3, sig)
+    for k in range(y.shape[1]):
+        coef_legacy, uu, vv, ww, chisq_legacy = fp.svdfit(list(x), list(y[:, k]), list(sig[:, k]), 3)
+        np.testing.assert_allclose(coef[:, k], coef_legacy, rtol=1e-8)
+        np.testing.assert_allclose(cvm[:, :, k], fp.svdvar(vv, ww, 3), rtol=1e-8)
+        np.testing.assert_allclose(chisq[k], chisq_legacy, rtol=1e-8)
+
+
+def test_fit_polynomials_timing():
+    # all the series are fitted together, compared with the legacy loop over the series
+    rng = np.random.default_rng(4)
+    x = np.linspace(-0.05, 0.05, 100)
+    nseries = 100
+    y = (rng.normal(size=(1, nseries)) + np.outer(x, rng.normal(size=nseries))
+         + 1e-2 * np.outer(x ** 3, rng.normal(size=nseries)))
+    sig = np.abs(y[0]) / 1000.
+    t0 = time.perf_counter()
+    status, coefs, cvms = fp.fit_polynomials(x, y, sig=sig, allowed_error=1e-6, npoly_min=1, npoly_max=NPOLYMAX)
+    t_new = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for k in range(nseries):
+        coef, cvm, failed = legacy_series_fit(list(x), list(y[:, k]), 1, 1e-6)
+        assert status[k] != failed
+        np.testing.assert_allclose(coefs[k], coef, rtol=1e-6, atol=1e-10)
+    t_legacy = time.perf_counter() - t0
+    print('fit_polynomials: {:.4f} s, legacy svdfit loop: {:.4f} s for {} series'.format(t_new, t_legacy, nseries))
+    assert t_new < t_legacy
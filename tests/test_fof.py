@@ -0,0 +1,137 @@
+"""
+Friends-of-friends grouping of the self-calibration mask (suncasa.utils.fof, used by
+FlareSelfCalib.gen_fof_groups), compared with the pairwise O(n^2) grouping it replaced.
+"""
+import numpy as np
+
+from suncasa.utils import fof
+
+
+def _linked(pos, m1, m2):
+    return np.sqrt((pos[1][m1] - pos[1][m2]) ** 2 + (pos[0][m1] - pos[0][m2]) ** 2) < 3
+
+
+def legacy_combine_groups(group, pos):
+    # the previous implementation of FlareSelfCalib.combine_groups
+    groups_com = []
+    deleted_groups = []
+    for g1 in range(len(group)):
+        if g1 in deleted_groups:
+            continue
+        for g2 in range(g1 + 1, len(group)):
+            if any(_linked(pos, mem1, mem2) for mem1 in group[g1] for mem2 in group[g2]):
+                group[g1].extend(group[g2])
+                deleted_groups.append(g2)
+        groups_com.append(list(group[g1]))
+    return groups_com
+
+
+def legacy_gen_fof_groups(data3, thres):
+    # the previous implementation of FlareSelfCalib.gen_fof_groups
+    pos = np.where(data3 > thres)
+    groups = [[0]]
+    for i in range(1, len(pos[0])):
+        for g in groups:
+            if any(_linked(pos, mem, i) for mem in g):
+                g.append(i)
+                break
+        else:
+            groups.append([i])
+    final_groups_y = []
+    final_groups_x = []
+    for g1 in legacy_combine_groups(groups, pos):
+        if len(g1) > 3:
+            final_groups_y.extend(pos[0][g1])
+            final_groups_x.extend(pos[1][g1])
+    return [final_groups_y, final_groups_x]
+
+
+def brute_force_components(pos):
+    # connected components of the pixels closer than 3 pixels, by a breadth-first search over all the pairs
+    n = len(pos[0])
+    labels = -np.ones(n, dtype=int)
+    for i in range(n):
+        if labels[i] >= 0:
+            continue
+        labels[i] = i
+        queue = [i]
+        while queue:
+            k = queue.pop()
+            for j in np.flatnonzero(labels < 0):
+                if _linked(pos, k, j):
+                    labels[j] = i
+                    queue.append(j)
+    return labels
+
+
+def pixels(groups):
+    return set(zip(np.asarray(groups[0], dtype=int).tolist(), np.asarray(groups[1], dtype=int).tolist()))
+
+
+def random_image(rng):
+    ny, nx = rng.integers(5, 40, size=2)
+    return rng.random((ny, nx)) * (rng.random((ny, nx)) < rng.uniform(0.005, 0.3))
+
+
+def test_gen_fof_groups_random():
+    rng = np.random.default_rng(20240101)
+    nsame = 0
+    ntest = 300
+    for _ in range(ntest):
+        data = random_image(rng)
+        if not np.any(data > 0.5):
+            data[0, 0] = 1.
+        new = pixels(fof.gen_fof_groups(data, 0.5))
+        old = pixels(legacy_gen_fof_groups(data, 0.5))
+        # the legacy grouping can only lose pixels, in the chain case of test_gen_fof_groups_chain
+        assert old <= new
+        nsame += old == new
+        # the new grouping is exactly the components of more than 3 pixels
+        pos = np.where(data > 0.5)
+        labels = brute_force_components(pos)
+        nmem = np.bincount(labels, minlength=len(labels))
+        keep = nmem[labels] > 3
+        assert new == set(zip(pos[0][keep].tolist(), pos[1][keep].tolist()))
+    assert nsame >= 0.98 * ntest
+
+
+def test_gen_fof_groups_chain():
+    # The greedy pass groups the pixels as A = [(0, 2), (2, 3)], B = [(0, 8), (2, 7)] and C = [(1, 5)].
+    # A and B are both linked to C but not to each other. The legacy combine_groups merged C into A, then
+    # again into B, as it did not skip the groups already merged. Both copies have 3 pixels and were dropped,
+    # while the five pixels form a single group.
+    data = np.zeros((4, 12))
+    chain = [(0, 2), (0, 8), (1, 5), (2, 3), (2, 7)]
+    for y, x in chain:
+        data[y, x] = 1.
+    assert pixels(legacy_gen_fof_groups(data, 0.5)) == set()
+    assert pixels(fof.gen_fof_groups(data, 0.5)) == set(chain)
+
+
+def test_gen_fof_groups_empty():
+    assert fof.gen_fof_groups(np.zeros((8, 8)), 0.5) == [[], []]
+
+
+def test_combine_groups_random():
+    rng = np.random.default_rng(7)
+    for _ in range(100):
+        data = random_image(rng)
+        pos = np.where(data > 0.5)
+        if len(pos[0]) == 0:
+            continue
+        groups = fof.combine_groups([[i] for i in range(len(pos[0]))], pos)
+        labels = brute_force_components(pos)
+        assert sorted(sorted(g) for g in groups) == sorted(
+            np.flatnonzero(labels == l).tolist() for l in np.unique(labels))
+        # groups in the order of their first member
+        assert [g[0] for g in groups] == sorted(g[0] for g in groups)
+
+
+def test_fof_links():
+    y = np.array([0, 0, 0, 2, 5])
+    x = np.array([0, 2, 3, 2, 5])
+    links_i, links_j = fof.fof_links(y, x)
+    links = set(map(frozenset, zip(links_i.tolist(), links_j.tolist())))
+    pos = (y, x)
+    expected = set(frozenset((i, j)) for i in range(5) for j in range(i + 1, 5) if _linked(pos, i, j))
+    assert links == expected
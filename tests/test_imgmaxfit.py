@@ -0,0 +1,87 @@
+"""
+NumPy maxfit engine of pmaxfit (suncasa.utils.imgmaxfit) on synthetic FITS images, and the conversion of its
+results with DButil.transfitdict2DF.
+"""
+import numpy as np
+import pytest
+from astropy.io import fits
+
+pd = pytest.importorskip('pandas')
+
+from suncasa.utils import DButil
+from suncasa.utils import imgmaxfit
+
+NPOL, NCHAN, NY, NX = 2, 3, 64, 80
+# source position (x, y) in pixels of each channel
+SOURCES = [(30.3, 20.6), (41.0, 33.25), (55.7, 40.4)]
+
+
+def write_image(fname, date_obs='2022-11-12T18:00:00.000'):
+    yy, xx = np.mgrid[:NY, :NX]
+    data = np.zeros((NPOL, NCHAN, NY, NX), dtype=np.float32)
+    for ll, (x0, y0) in enumerate(SOURCES):
+        for pp in range(NPOL):
+            data[pp, ll] = (pp + 1) * 10. * np.exp(-((xx - x0) ** 2 + (yy - y0) ** 2) / (2 * 3. ** 2))
+    hdr = fits.Header()
+    hdr['CTYPE1'], hdr['CRPIX1'], hdr['CRVAL1'], hdr['CDELT1'], hdr['CUNIT1'] = 'RA---SIN', 41., 230., -2. / 3600., 'deg'
+    hdr['CTYPE2'], hdr['CRPIX2'], hdr['CRVAL2'], hdr['CDELT2'], hdr['CUNIT2'] = 'DEC--SIN', 33., -18., 2. / 3600., 'deg'
+    hdr['CTYPE3'], hdr['CRPIX3'], hdr['CRVAL3'], hdr['CDELT3'], hdr['CUNIT3'] = 'FREQ', 1., 1.e9, 5.e8, 'Hz'
+    hdr['CTYPE4'], hdr['CRPIX4'], hdr['CRVAL4'], hdr['CDELT4'] = 'STOKES', 1., -1., -1.
+    hdr['DATE-OBS'] = date_obs
+    hdr['BUNIT'] = 'K'
+    hdr['RADESYS'] = 'FK5'
+    hdr['EQUINOX'] = 2000.
+    fits.writeto(fname, data, hdr)
+    return fname
+
+
+def pmaxfit_results(imgfiles):
+    # repackaged as pmaxfit does with maxfit_iter_np
+    results = {'succeeded': [], 'timestamps': [], 'imagenames': [], 'outputs': []}
+    for img in imgfiles:
+        timstr, res = imgmaxfit.maxfit_image(img, width=3)
+        results['succeeded'].append(True)
+        results['timestamps'].append(timstr)
+        results['imagenames'].append(img)
+        results['outputs'].append(res)
+    return results
+
+
+def test_maxfit_image(tmp_path):
+    img = write_image(str(tmp_path / 'img.fits'))
+    timstr, results = imgmaxfit.maxfit_image(img, width=3)
+    assert timstr == '2022-11-12T18:00:00.000'
+    assert sorted(results.keys()) == ['LL', 'RR']
+    for pp, pol in enumerate(['RR', 'LL']):
+        assert results[pol]['converged'] == [True] * NCHAN
+        for ll, (x0, y0) in enumerate(SOURCES):
+            comp = results[pol]['results']['component{}'.format(ll)]
+            np.testing.assert_allclose(comp['pixelcoords'], [x0, y0], atol=0.05)
+            # the quadratic over +-3 pixels slightly underestimates the peak of the Gaussian
+            assert comp['flux']['value'][0] == pytest.approx((pp + 1) * 10., rel=0.1)
+            assert comp['flux']['polarisation'] == pol
+            # the centroid is a measure record {'direction': ...} as iatool.toworld(..., 'm')['measure']
+            assert comp['centroid']['direction']['refer'] == 'J2000'
+            for key in ['m0', 'm1']:
+                assert comp['centroid']['direction'][key]['unit'] == 'rad'
+            assert comp['centroid']['direction']['m0']['value'] == pytest.approx(
+                comp['shape']['direction']['m0']['value'], abs=np.radians(0.5 / 3600))
+
+
+@pytest.mark.parametrize('getcentroid', [False, True])
+def test_transfitdict2DF(tmp_path, getcentroid):
+    from astropy.wcs import WCS
+    imgfiles = [write_image(str(tmp_path / 'img{}.fits'.format(i)), date_obs='2022-11-12T18:00:0{}.000'.format(i))
+                for i in range(2)]
+    df = DButil.transfitdict2DF(pmaxfit_results(imgfiles), gaussfit=False, getcentroid=getcentroid)
+    assert len(df) == 2 * NCHAN
+    assert sorted(df['freqstr'].unique()) == ['1.000', '1.500', '2.000']
+    wcs = WCS(fits.getheader(imgfiles[0]))
+    for pp, pol in enumerate(['RR', 'LL']):
+        for ll, (x0, y0) in enumerate(SOURCES):
+            row = df[(df['freqstr'] == '{:.3f}'.format(1. + 0.5 * ll)) & (df['fits_local'] == 'img0.fits')].iloc[0]
+            # the peak and the centroid of the symmetric source are both at its position, 2 arcsec per pixel
+            lon, lat = wcs.wcs_pix2world(x0, y0, ll, pp, 0)[:2]
+            assert row['shape_longitude{}'.format(pol)] == pytest.approx(lon * 3600., abs=0.2)
+            assert row['shape_latitude{}'.format(pol)] == pytest.approx(lat * 3600., abs=0.2)
+            assert row['peak{}'.format(pol)] == pytest.approx((pp + 1) * 10., rel=0.1)
@@ -0,0 +1,101 @@
+"""
+Rotation direction and center of suncasa.utils.imgrotate.rotate_image, which replaced ia.rotate in imreg,
+on asymmetric synthetic images. The comparison with ia.rotate itself runs where casatools is installed.
+"""
+import numpy as np
+import pytest
+
+from suncasa.utils.imgrotate import rotate_image
+
+NY, NX = 48, 40
+# an off-middle rotation center (y, x), as the reference pixel of an image usually is
+CENTER = (26., 17.)
+
+
+def gaussian(x0, y0, sigma=2.):
+    yy, xx = np.mgrid[:NY, :NX]
+    return np.exp(-((xx - x0) ** 2 + (yy - y0) ** 2) / (2 * sigma ** 2))
+
+
+def centroid(img):
+    yy, xx = np.mgrid[:NY, :NX]
+    img = np.where(np.isnan(img), 0., img)
+    return np.sum(img * xx) / np.sum(img), np.sum(img * yy) / np.sum(img)
+
+
+def test_rotate_image_90():
+    # three impulses of different values, so that any flip, transpose or wrong center shows up.
+    # counterclockwise by 90 deg about the center (y up, x right): right of the center goes up, up goes left
+    cy, cx = CENTER
+    data = np.zeros((NY, NX))
+    data[int(cy), int(cx) + 5] = 1.
+    data[int(cy) + 3, int(cx)] = 2.
+    data[int(cy) - 7, int(cx) - 2] = 3.
+    out = rotate_image(data, 90., CENTER, order=1)
+    expected = np.zeros((NY, NX))
+    expected[int(cy) + 5, int(cx)] = 1.
+    expected[int(cy), int(cx) - 3] = 2.
+    expected[int(cy) - 2, int(cx) + 7] = 3.
+    valid = ~np.isnan(out)
+    assert valid[int(cy) - 10:int(cy) + 10, int(cx) - 10:int(cx) + 10].all()
+    np.testing.assert_allclose(out[valid], expected[valid], atol=1e-10)
+
+
+@pytest.mark.parametrize('angle', [-37.5, 12., 90., 163.])
+def test_rotate_image_direction(angle):
+    cy, cx = CENTER
+    r, pa = 12., 20.
+    x0, y0 = cx + r * np.cos(np.radians(pa)), cy + r * np.sin(np.radians(pa))
+    out = rotate_image(gaussian(x0, y0), angle, CENTER)
+    xc, yc = centroid(out)
+    np.testing.assert_allclose([xc, yc], [cx + r * np.cos(np.radians(pa + angle)),
+                                          cy + r * np.sin(np.radians(pa + angle))], atol=0.05)
+    # the rotation center stays in place
+    out = rotate_image(gaussian(cx, cy), angle, CENTER)
+    np.testing.assert_allclose(centroid(out), [cx, cy], atol=0.05)
+
+
+def test_rotate_image_solar_north():
+    # imreg rotates by -p0. With RA increasing to the left, a source at position angle p0 (east of north)
+    # ends up straight above the reference pixel
+    cy, cx = CENTER
+    r, p0 = 15., 23.4
+    data = gaussian(cx - r * np.sin(np.radians(p0)), cy + r * np.cos(np.radians(p0)))
+    xc, yc = centroid(rotate_image(data, -p0, CENTER))
+    np.testing.assert_allclose([xc, yc], [cx, cy + r], atol=0.05)
+
+
+def test_rotate_image_planes_and_nans():
+    cy, cx = CENTER
+    data = np.stack([gaussian(cx + 8., cy - 4.), 2. * gaussian(cx - 5., cy + 9.)])[None]
+    data[0, 1, int(cy), int(cx)] = np.nan
+    out = rotate_image(data.astype(np.float32), 30., CENTER)
+    assert out.shape == data.shape and out.dtype == np.float32
+    for i in range(2):
+        np.testing.assert_allclose(out[0, i], rotate_image(data[0, i], 30., CENTER), atol=1e-6, equal_nan=True)
+    # the NaN pixel stays NaN at the rotation center, and the corners come from outside the image
+    assert np.isnan(out[0, 1, int(cy), int(cx)]) and not np.isnan(out[0, 0, int(cy), int(cx)])
+    assert np.isnan(out[0, :, 0, 0]).all() and np.isnan(out[0, :, -1, -1]).all()
+    np.testing.assert_allclose(rotate_image(data, 0., CENTER), data, atol=1e-12, equal_nan=True)
+
+
+def test_rotate_image_casa():
+    casatools = pytest.importorskip('casatools')
+    cy, cx = CENTER
+    data = gaussian(cx + 9., cy + 4.) + 0.5 * gaussian(cx - 3., cy - 10., 3.)
+    ia = casatools.image()
+    ia.fromarray(outfile='', pixels=data.T, overwrite=True)
+    cs = ia.coordsys()
+    cs.setreferencepixel([cx, cy])
+    ia.setcoordsys(cs.torecord())
+    cs.done()
+    for p0 in [-26.3, 14.]:
+        imr = ia.rotate(outfile='', pa='{}deg'.format(-p0))
+        casa = imr.getchunk().T
+        mask = imr.getchunk(getmask=True).T
+        imr.done()
+        out = rotate_image(data, -p0, CENTER)
+        np.testing.assert_allclose(centroid(np.where(mask, casa, 0.)), centroid(out), atol=0.1)
+        inner = mask & ~np.isnan(out)
+        np.testing.assert_allclose(out[inner], casa[inner], atol=0.02)
+    ia.done()
@@ -0,0 +1,66 @@
+"""
+Lazy reads of suncasa.io.ndfits: the FitsSection view and the file handles it keeps open.
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+pytest.importorskip('sunpy.map')
+ndfits = pytest.importorskip('suncasa.io.ndfits')
+
+pytestmark = pytest.mark.skipif(not os.path.isdir('/proc/self/fd'), reason='needs /proc/self/fd')
+
+
+def nfd():
+    return len(os.listdir('/proc/self/fd'))
+
+
+def write_cube(fname):
+    hdr = fits.Header()
+    for k, (ctype, crval) in enumerate([('SOLAR-X', 0.), ('SOLAR-Y', 0.), ('FREQ', 1.e9), ('STOKES', 1.)]):
+        hdr['CTYPE{}'.format(k + 1)] = ctype
+        hdr['CRVAL{}'.format(k + 1)] = crval
+        hdr['CDELT{}'.format(k + 1)] = 1.
+    data = np.arange(2 * 3 * 6 * 8, dtype=np.float32).reshape(2, 3, 6, 8)
+    data[0, 0, 0, 0] = np.nan
+    fits.writeto(fname, data, hdr)
+    return data
+
+
+def test_read_lazy(tmp_path):
+    fname = str(tmp_path / 'cube.fits')
+    data = write_cube(fname)
+    meta, section = ndfits.read(fname, lazy=True)
+    assert section.shape == data.shape
+    assert meta['nfreq'] == 3 and meta['npol'] == 2
+    np.testing.assert_array_equal(section[1, 2], data[1, 2])
+    assert section[0, 0, 0, 0] == 0.
+    section.close()
+
+
+def test_read_lazy_close(tmp_path):
+    fname = str(tmp_path / 'cube.fits')
+    write_cube(fname)
+    n0 = nfd()
+    sections = []
+    for hdus in [None, [0]]:
+        meta, section = ndfits.read(fname, hdus=hdus, lazy=True)
+        section[0, 1]
+        assert nfd() > n0
+        section.close()
+        # the view is still referenced, but the file and its memory map are released
+        sections.append(section)
+        assert nfd() == n0
+
+
+def test_read_lazy_no_image(tmp_path):
+    fname = str(tmp_path / 'table.fits')
+    fits.HDUList([fits.PrimaryHDU(),
+                  fits.BinTableHDU.from_columns([fits.Column('a', 'E', array=[1.])])]).writeto(fname)
+    n0 = nfd()
+    meta, section = ndfits.read(fname, lazy=True)
+    assert section is None
+    assert nfd() == n0